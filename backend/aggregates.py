@@ -0,0 +1,135 @@
+import threading
+
+import numpy as np
+
+from config import DATA_MODE
+from data_store import get_data_store
+
+# Buckets are keyed by (month, county, disease); disease names are lowercased
+KEY = ('month', 'county', 'disease')
+ENV_COLUMNS = ['avg_temp', 'avg_rainfall', 'unimproved_sanitation_rate', 'mean_ndvi']
+SUM_COLUMNS = ['cases', 'outbreak'] + ENV_COLUMNS
+# Layout of a bucket vector: row count, NaN-skipping sums of SUM_COLUMNS,
+# then non-NaN counts of ENV_COLUMNS (for means)
+N_MEASURES = 1 + len(SUM_COLUMNS) + len(ENV_COLUMNS)
+# Coarser groupings maintained alongside the buckets
+ROLLUPS = [('month',), ('month', 'disease'), ('county',), ('disease',)]
+
+
+def bucket_totals(store, rows):
+    """Measure vectors per (month, county, disease) bucket for the given store rows."""
+    if len(rows) == 0:
+        return {}
+    n_counties = len(store.categories['county'])
+    n_diseases = len(store.categories['disease'])
+    combined = (store.columns['month'][rows].astype(np.int64) * n_counties
+                + store.columns['county'][rows]) * n_diseases + store.columns['disease'][rows]
+    uniq, inverse = np.unique(combined, return_inverse=True)
+    totals = np.zeros((len(uniq), N_MEASURES))
+    totals[:, 0] = np.bincount(inverse, minlength=len(uniq))
+    for j, column in enumerate(SUM_COLUMNS):
+        values = store.columns[column][rows].astype(np.float64)
+        present = ~np.isnan(values)
+        totals[:, 1 + j] = np.bincount(inverse[present], weights=values[present], minlength=len(uniq))
+        if column in ENV_COLUMNS:
+            k = 1 + len(SUM_COLUMNS) + ENV_COLUMNS.index(column)
+            totals[:, k] = np.bincount(inverse[present], minlength=len(uniq))
+
+    months = store.categories['month']
+    counties = store.categories['county']
+    diseases = store.categories['disease']
+    result = {}
+    for vector, code in zip(totals, uniq.tolist()):
+        disease = code % n_diseases
+        county = (code // n_diseases) % n_counties
+        month = code // (n_diseases * n_counties)
+        key = (months[month], counties[county], diseases[disease].lower())
+        result[key] = result[key] + vector if key in result else vector
+    return result
+
+
+def summarize(vector):
+    """Readable measures for one bucket or rollup vector."""
+    summary = {'rows': int(vector[0])}
+    for j, column in enumerate(SUM_COLUMNS):
+        summary[column] = float(vector[1 + j])
+    for j, column in enumerate(ENV_COLUMNS):
+        count = vector[1 + len(SUM_COLUMNS) + j]
+        summary[f'{column}_mean'] = float(vector[1 + SUM_COLUMNS.index(column)] / count) if count else None
+    return summary
+
+
+class MaterializedAggregates:
+    """
+    Running totals per (month, county, disease) plus the rollups in ROLLUPS.
+
+    Built once from the data store; afterwards only the buckets touched by
+    appended rows (e.g. one new week: its month's county/disease buckets)
+    are updated, so endpoints read results in O(groups) without grouping
+    the raw rows again.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.rollups = {dims: {} for dims in ROLLUPS}
+        self.version = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, store):
+        aggregates = cls()
+        aggregates.add_rows(store, np.arange(store.n_rows))
+        return aggregates
+
+    @classmethod
+    def from_totals(cls, totals):
+        """Aggregates over bucket vectors computed elsewhere (see partitions.BucketTotals)."""
+        aggregates = cls()
+        aggregates._apply(totals)
+        return aggregates
+
+    def add_rows(self, store, rows):
+        """Fold newly appended store rows into their buckets."""
+        self._apply(bucket_totals(store, rows))
+
+    def _apply(self, deltas):
+        with self._lock:
+            self._add(self.buckets, deltas.items())
+            for dims, rollup in self.rollups.items():
+                positions = [KEY.index(d) for d in dims]
+                self._add(rollup, ((tuple(key[p] for p in positions), vector) for key, vector in deltas.items()))
+            self.version += 1
+
+    @staticmethod
+    def _add(target, items):
+        for key, vector in items:
+            current = target[key] + vector if key in target else vector.copy()
+            # A group disappears once its row count drops to zero
+            if current[0] <= 0:
+                target.pop(key, None)
+            else:
+                target[key] = current
+
+    def rollup(self, *dims):
+        """Summaries for one rollup, e.g. rollup('month', 'disease'), sorted by key."""
+        with self._lock:
+            groups = self.buckets if tuple(dims) == KEY else self.rollups[tuple(dims)]
+            items = sorted(groups.items())
+        return {key: summarize(vector) for key, vector in items}
+
+
+_aggregates = None
+_aggregates_lock = threading.Lock()
+
+
+def get_aggregates():
+    global _aggregates
+    if _aggregates is None:
+        with _aggregates_lock:
+            if _aggregates is None:
+                if DATA_MODE == 'chunked':
+                    from partitions import BucketTotals, get_dataset
+                    _aggregates = MaterializedAggregates.from_totals(get_dataset().run(BucketTotals()))
+                else:
+                    _aggregates = MaterializedAggregates.from_store(get_data_store())
+    return _aggregates
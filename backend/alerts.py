@@ -0,0 +1,181 @@
+"""
+Early-warning detectors over the weekly case series of every
+(county, disease) pair.
+
+Cases are summed per series and week into one (series, weeks) matrix whose
+columns are every calendar week of the data, including weeks with no rows at
+all. Weeks without any report count as zero cases. Each detector is
+evaluated for every series at once with sliding windows over that matrix:
+
+  - c1, c2: EARS C1/C2. The week is compared with the mean and standard
+    deviation of the 7 weeks before it. C2 leaves a 2-week guard band.
+  - c3: EARS C3. Sum of the C2 excesses over 1 for the week and the two
+    before it.
+  - cusum: one-sided CUSUM of the C2 statistic.
+  - zscore: z-score against a longer rolling baseline.
+
+When rows are appended, only the weeks from the earliest affected one
+onwards are recomputed.
+"""
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data_store import get_data_store
+from weekly_series import WeeklySeries, move
+
+# Baseline of the window-based detectors: `window` weeks ending `lag` weeks
+# before the week being tested
+BASELINES = {
+    'c1': {'window': 7, 'lag': 0},
+    'c2': {'window': 7, 'lag': 2},
+    'zscore': {'window': 12, 'lag': 1},
+}
+THRESHOLDS = {'c1': 3.0, 'c2': 3.0, 'c3': 2.0, 'cusum': 4.0, 'zscore': 2.5}
+DETECTORS = list(THRESHOLDS)
+# CUSUM reference value: drift per week below which the sum decays
+CUSUM_K = 0.5
+# Floor on the baseline standard deviation so flat series don't divide by 0
+MIN_STD = 1.0
+# Fraction of a baseline window that must have reports
+MIN_BASELINE_FRACTION = 0.5
+
+
+def baseline(X, window, lag, start):
+    """
+    Mean and standard deviation of the baseline of every week from `start`
+    on, i.e. X[:, t - lag - window:t - lag] for each week t.
+    NaN where too few baseline weeks have reports.
+    """
+    pad = window + lag
+    padded = np.concatenate([np.full((X.shape[0], pad), np.nan), X], axis=1)
+    # Window k covers padded[:, k:k + window] = X[:, k - pad:k - lag]
+    windows = sliding_window_view(padded[:, start:padded.shape[1] - lag], window, axis=1)[:, :X.shape[1] - start]
+    count = np.sum(~np.isnan(windows), axis=2)
+    enough = count >= max(2, int(np.ceil(window * MIN_BASELINE_FRACTION)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        total = np.nansum(windows, axis=2)
+        mean = np.where(enough, total / np.maximum(count, 1), np.nan)
+        sq = np.nansum((windows - mean[:, :, None]) ** 2, axis=2)
+        std = np.sqrt(sq / np.maximum(count - 1, 1))
+    return mean, np.where(enough, np.maximum(std, MIN_STD), np.nan)
+
+
+class AlertEngine:
+    """
+    Detector statistics for every (county, disease) weekly series of the
+    data store, kept in step with it: rows appended to the store since the
+    last call are folded into the case matrix and only the weeks they touch
+    (and those after them) are recomputed.
+    """
+
+    def __init__(self):
+        self.data = WeeklySeries()
+        self.stats = {name: np.zeros((0, 0)) for name in DETECTORS}
+        self.expected = np.zeros((0, 0))
+        self._lock = threading.Lock()
+
+    @property
+    def store_version(self):
+        return self.data.store_version
+
+    def update(self, store):
+        """Catch up with `store`."""
+        with self._lock:
+            change = self.data.sync(store)
+            if change is None:
+                return
+            first, moved = change
+            if moved is not None:
+                shape = self.data.shape
+                # A new series has had no alarms so far, so its CUSUM starts at 0
+                self.stats = {
+                    name: move(values, moved, shape, 0.0 if name == 'cusum' else np.nan)
+                    for name, values in self.stats.items()
+                }
+                self.expected = move(self.expected, moved, shape, np.nan)
+            self._recompute(first)
+
+    def _recompute(self, start):
+        """
+        Recompute every statistic for the weeks from column `start` on. All
+        detectors only look back in time, so earlier weeks are unaffected.
+        """
+        X = self.data.cases
+        with np.errstate(invalid='ignore'):
+            for name, params in BASELINES.items():
+                mean, std = baseline(X, params['window'], params['lag'], start)
+                self.stats[name][:, start:] = (X[:, start:] - mean) / std
+                if name == 'c2':
+                    self.expected[:, start:] = mean
+            c2 = self.stats['c2']
+            excess = np.maximum(np.nan_to_num(c2, nan=0.0) - 1.0, 0.0)
+            padded = np.concatenate([np.zeros((len(c2), 2)), excess], axis=1)
+            c3 = sliding_window_view(padded, 3, axis=1).sum(axis=2)
+            self.stats['c3'][:, start:] = np.where(np.isnan(c2[:, start:]), np.nan, c3[:, start:])
+
+            # CUSUM is recursive in time but vectorized across series. Weeks
+            # without a C2 statistic carry the sum over; it restarts from 0
+            # after each alarm
+            cusum = self.stats['cusum']
+            state = cusum[:, start - 1] if start else np.zeros(len(c2))
+            for t in range(start, c2.shape[1]):
+                state = np.where(state > THRESHOLDS['cusum'], 0.0, state)
+                z = c2[:, t]
+                state = np.where(np.isnan(z), state, np.maximum(0.0, state + z - CUSUM_K))
+                cusum[:, t] = state
+
+    def detect(self, counties=None, diseases=None, week_from=None, week_to=None, detectors=None):
+        """
+        Flagged (series, week) cells, ordered by week then series, as dicts
+        with the cases, the C2 expected count, every detector statistic and
+        the detectors whose threshold was exceeded.
+        """
+        detectors = detectors or DETECTORS
+        data = self.data
+        with self._lock:
+            if not data.weeks:
+                return []
+            selected = data.select(counties, diseases)
+            in_range = data.weeks_between(week_from, week_to)
+
+            reported = data.reports > 0
+            flags = {
+                name: (np.nan_to_num(self.stats[name], nan=-np.inf) > THRESHOLDS[name]) & reported
+                for name in detectors
+            }
+            flagged = np.logical_or.reduce(list(flags.values())) & selected[:, None] & in_range[None, :]
+            s, w = np.nonzero(flagged.T)[::-1]
+            alerts = []
+            for i, j in zip(s.tolist(), w.tolist()):
+                county, disease = data.series[i]
+                alerts.append({
+                    'county': county,
+                    'disease': disease,
+                    'week': data.weeks[j],
+                    'cases': float(data.cases[i, j]),
+                    'expected': _round_or_none(self.expected[i, j]),
+                    'statistics': {name: _round_or_none(self.stats[name][i, j]) for name in DETECTORS},
+                    'flagged_by': [name for name in detectors if flags[name][i, j]],
+                })
+            return alerts
+
+
+def _round_or_none(value, digits=4):
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_alert_engine():
+    """The shared engine, caught up with the current data store."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AlertEngine()
+    _engine.update(get_data_store())
+    return _engine
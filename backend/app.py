@@ -1,124 +1,197 @@
 import numpy as np
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Blueprint, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 
 import io
-import pandas as pd
-from model_utils import predict_cholera, predict_malaria, get_csv_data
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from model_utils import get_csv_data, model_registry
+from config import (MODEL_RELOAD_INTERVAL, RISK_GRID_ENABLED, SCORING_WORKERS, SCORING_TIMEOUT,
+                    PDF_RENDER_TIMEOUT, OUTBREAK_CACHE_MAX_ROWS, DATA_MODE, PRELOAD_PDF_STACK)
+from risk_grid import get_risk_grid, score_what_if
+from prediction_cache import prediction_cache
+from ingest import ingest_rows, IngestError
+from data_store import COLUMNS, get_data_store
+from risk_scores import SCORE_COLUMN, get_risk_scores
+from aggregates import get_aggregates
+from alerts import get_alert_engine, DETECTORS, THRESHOLDS
+from forecast import get_forecast_engine, MAX_HORIZON
+from spatial import get_spatial_rollups, LEVELS
+from partitions import CountyRisk, get_dataset
+from report_builder import REPORTS_DIR, start_background_build, build_status
+from report_catalog import query_reports
+from pdf_reports import get_report_pdf, preload_pdf_stack, prerender_reports
+from logs import configure_logging
+from instrumentation import instrument, timed_body
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, PREDICT_BATCH_SIZE
+from serializers import FORMATS, SHAPES, encode_rows, negotiate
+from http_cache import versioned, dataset_tag, dataset_and_models_tag, manifest_tag
 
 import os
 from datetime import datetime
 
-REPORTS_DIR = os.path.join(os.path.dirname(__file__), 'reports')
-os.makedirs(REPORTS_DIR, exist_ok=True)
-
-# Utility to generate and save reports
-
-def sanitize_filename(s):
-    return s.replace('/', '_').replace('\\', '_')
-
-def make_report_filename(report_type, period, extra_desc=None, ext='csv'):
-    # Example: weekly_2024-11-18_2024-11-24_Baringo_and_Nairobi.csv
-    base = f"{report_type}_{period}"
-    if extra_desc:
-        base += f"_{sanitize_filename(extra_desc)}"
-    return f"{base}.{ext}"
-
-def generate_and_save_reports():
-    from model_utils import predict_cholera, predict_malaria
-    df = get_csv_data()
-    df['week'] = df['week'].astype(str)
-
-    def add_predictions_and_summary(group):
-        group = group.copy()
-        # Add model predictions
-        cholera_mask = group['disease'].str.lower() == 'cholera'
-        malaria_mask = group['disease'].str.lower() == 'malaria'
-        group['predicted_risk'] = None
-        # Cholera predictions
-        group.loc[cholera_mask, 'predicted_risk'] = group[cholera_mask].apply(
-            lambda row: predict_cholera([
-                row['unimproved_sanitation_rate'],
-                row['avg_rainfall']
-            ]), axis=1
-        )
-        # Malaria predictions
-        group.loc[malaria_mask, 'predicted_risk'] = group[malaria_mask].apply(
-            lambda row: predict_malaria([
-                row['mean_ndvi'],
-                row['avg_temp']
-            ]), axis=1
-        )
-        # Summary statistics
-        summary = {
-            'total_cases': int(group['cases'].sum()),
-            'total_outbreaks': int(group['outbreak'].sum()),
-            'avg_temp': float(group['avg_temp'].mean()),
-            'avg_rainfall': float(group['avg_rainfall'].mean()),
-            'avg_sanitation_rate': float(group['unimproved_sanitation_rate'].mean()),
-            'avg_ndvi': float(group['mean_ndvi'].mean()),
-        }
-        # Add per-disease summary
-        for disease in group['disease'].unique():
-            mask = group['disease'] == disease
-            summary[f'{disease}_cases'] = int(group[mask]['cases'].sum())
-            summary[f'{disease}_avg_predicted_risk'] = float(group[mask]['predicted_risk'].astype(float).mean())
-        return group, summary
-
-    # Generate weekly reports
-    for week, group in df.groupby('week'):
-        safe_week = sanitize_filename(week)
-        counties = '_'.join(sorted(group['county'].unique()))
-        period = safe_week
-        fname = make_report_filename('weekly', period, counties, 'csv')
-        group_with_pred, summary = add_predictions_and_summary(group)
-        with open(os.path.join(REPORTS_DIR, fname), 'w', encoding='utf-8') as f:
-            for k, v in summary.items():
-                f.write(f'# {k}: {v}\n')
-            group_with_pred.to_csv(f, index=False)
-
-    # Generate monthly reports
-    df['month'] = df['week'].str[:7]
-    for month, group in df.groupby('month'):
-        safe_month = sanitize_filename(month)
-        counties = '_'.join(sorted(group['county'].unique()))
-        period = safe_month
-        fname = make_report_filename('monthly', period, counties, 'csv')
-        group_with_pred, summary = add_predictions_and_summary(group)
-        with open(os.path.join(REPORTS_DIR, fname), 'w', encoding='utf-8') as f:
-            for k, v in summary.items():
-                f.write(f'# {k}: {v}\n')
-            group_with_pred.to_csv(f, index=False)
-
-# Call this at startup (or expose as an endpoint for regeneration)
-generate_and_save_reports()
-
-app = Flask(__name__)
-CORS(app)
-
-@app.route('/data/outbreak', methods=['GET'])
+logger = logging.getLogger(__name__)
+
+def warm_up():
+    """
+    Load the models and build everything the endpoints read from memory, so
+    the first requests don't pay for it. Starts no threads, so it is safe to
+    run in a preloading server's master before workers are forked.
+    """
+    model_registry.warm_up()
+    if RISK_GRID_ENABLED:
+        for name in ('cholera', 'malaria'):
+            get_risk_grid(name)
+    if DATA_MODE == 'chunked':
+        # Only what is built from the partitions; the rest loads on first use
+        get_aggregates()
+        get_dataset().run(CountyRisk())
+        return
+    get_risk_scores().scores(get_data_store())
+    get_aggregates()
+    get_alert_engine()
+    get_forecast_engine()
+    get_spatial_rollups()
+
+
+def start_background_tasks(build_reports=True):
+    """
+    Watch the model pickles so a retrained model is picked up without a
+    restart, import the PDF stack in the background (PRELOAD_PDF_STACK)
+    and, unless disabled, bring the CSV reports up to date and pre-render
+    PDFs for the ones that changed. Run once per serving process.
+    """
+    configure_logging()
+    model_registry.start_watcher(MODEL_RELOAD_INTERVAL)
+    if PRELOAD_PDF_STACK:
+        preload_pdf_stack()
+    if build_reports:
+        start_background_build(on_complete=prerender_reports)
+
+
+def create_app(warm=False, background=False):
+    """Application factory; importing this module does no work by itself."""
+    configure_logging()
+    app = Flask(__name__)
+    CORS(app)
+    instrument(app)
+    app.register_blueprint(api)
+    if warm:
+        warm_up()
+    if background:
+        start_background_tasks()
+    return app
+
+
+api = Blueprint('api', __name__)
+
+# Batch scoring runs here rather than on the request thread, one task per
+# disease, so a burst of large batches queues instead of oversubscribing CPUs
+_scoring_pool = ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix='scoring')
+
+def outbreak_variant():
+    """Short name of the format negotiated for /data/outbreak; None if invalid."""
+    try:
+        mimetype = negotiate(request.accept_mimetypes, request.args.get('format'))
+    except ValueError:
+        return None
+    return next((name for name, value in FORMATS.items() if value == mimetype), None)
+
+@api.route('/data/outbreak', methods=['GET'])
+@versioned(dataset_and_models_tag, variant=outbreak_variant)
 def get_outbreak_data():
+    """
+    Outbreak rows as a JSON array of records: the CSV columns plus
+    p_outbreak, the stored model score of the row. Selections of more than
+    OUTBREAK_CACHE_MAX_ROWS rows are streamed; smaller ones are cached per
+    dataset version (see http_cache.py).
+
+    Optional query parameters:
+      - county, disease: comma-separated names (case-insensitive)
+      - week_from, week_to: YYYY-MM-DD, keeps weeks overlapping the range
+      - limit, cursor: page size and the X-Next-Cursor value of the previous page
+      - shape: records (default) or columnar, {"columns": [...], "data": {column: [...]}}
+      - format: json, ndjson or arrow (Arrow IPC stream); also chosen from
+        the Accept header (application/x-ndjson, application/vnd.apache.arrow.stream)
+    """
     try:
-        df = get_csv_data()
-        # Optionally, limit rows for performance
-        data = df.to_dict(orient='records')
-        return jsonify(data)
+        store = get_data_store()
+        county = request.args.get('county')
+        disease = request.args.get('disease')
+        week_from = request.args.get('week_from')
+        week_to = request.args.get('week_to')
+        try:
+            limit = request.args.get('limit', type=int)
+            cursor = request.args.get('cursor', type=int)
+            weeks = store.weeks_between(week_from, week_to) if week_from or week_to else None
+        except ValueError as e:
+            return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+        if limit is not None and limit <= 0:
+            return jsonify({'error': 'limit must be positive'}), 400
+        shape = request.args.get('shape', 'records')
+        if shape not in SHAPES:
+            return jsonify({'error': f'shape must be one of {", ".join(SHAPES)}'}), 400
+        try:
+            mimetype = negotiate(request.accept_mimetypes, request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if mimetype is None:
+            return jsonify({'error': 'Arrow responses need pyarrow on the server'}), 406
+
+        rows = store.rows(
+            county=county.split(',') if county else None,
+            disease=disease.split(',') if disease else None,
+            week=weeks,
+        )
+        # Row ids only grow, so the last id served is a stable cursor
+        if cursor is not None:
+            rows = rows[np.searchsorted(rows, cursor, side='right'):]
+        headers = {}
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            headers['X-Next-Cursor'] = str(int(rows[-1]))
+
+        extra = {SCORE_COLUMN: get_risk_scores().scores(store)}
+        body = timed_body(encode_rows(store, rows, mimetype, shape, COLUMNS + [SCORE_COLUMN], extra))
+        if len(rows) > OUTBREAK_CACHE_MAX_ROWS:
+            return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+        return Response(b''.join(body), mimetype=mimetype, headers=headers)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/')
+@api.route('/')
 def index():
     return {'status': 'Flask backend running'}
 
-@app.route('/predict/cholera', methods=['POST'])
+@api.route('/models', methods=['GET'])
+def list_models():
+    return jsonify(model_registry.info())
+
+@api.route('/models/reload', methods=['POST'])
+def reload_models():
+    try:
+        reloaded = model_registry.reload_changed()
+        return jsonify({'reloaded': reloaded, 'models': model_registry.info()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of this process's metrics."""
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+@api.route('/predict/cache', methods=['GET'])
+def prediction_cache_stats():
+    return jsonify(prediction_cache.stats())
+
+# Pass mode=grid (query string or JSON body) to /predict/cholera or
+# /predict/malaria for an exact answer from the model's lookup table
+@api.route('/predict/cholera', methods=['POST'])
 def predict_cholera_endpoint():
     data = request.json
     features = data.get('features')
-    print('Received /predict/cholera request with features:', features, flush=True)
     if not features:
-        print('Missing features!', flush=True)
+        logger.debug('/predict/cholera without features')
         return jsonify({'error': 'Missing features'}), 400
     try:
         if isinstance(features, dict):
@@ -126,159 +199,297 @@ def predict_cholera_endpoint():
         else:
             input_features = [features[0], features[1]]
         # Get probability of outbreak (P(1))
-        model = predict_cholera.__globals__['get_cholera_model']()
-        proba = model.predict_proba([input_features])[0][1]
-        print(f'Cholera prediction: features={input_features}, risk_score(P(1))={proba}', flush=True)
+        if RISK_GRID_ENABLED and (request.args.get('mode') or data.get('mode')) == 'grid':
+            proba, mode, max_error = score_what_if('cholera', float(input_features[0]), float(input_features[1]))
+            return jsonify({'probability': proba, 'mode': mode, 'max_error': max_error})
+        proba = prediction_cache.score('cholera', np.asarray([input_features], dtype=np.float64))[0]
+        logger.debug('Cholera prediction: features=%s, risk_score(P(1))=%s', input_features, proba)
         return jsonify({'probability': float(proba)})
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
-        print('Error in /predict/cholera:', tb, flush=True)
+        logger.error('Error in /predict/cholera', exc_info=True)
         return jsonify({'error': str(e), 'traceback': tb, 'features': features}), 500
 
-@app.route('/predict/malaria', methods=['POST'])
+@api.route('/predict/malaria', methods=['POST'])
 def predict_malaria_endpoint():
     data = request.json
     features = data.get('features')
-    print('Received /predict/malaria request with features:', features, flush=True)
     if not features:
-        print('Missing features!', flush=True)
+        logger.debug('/predict/malaria without features')
         return jsonify({'error': 'Missing features'}), 400
     try:
         if isinstance(features, dict):
             input_features = [features['mean_ndvi'], features['avg_temp']]
         else:
             input_features = [features[2], features[3]]
-        model = predict_malaria.__globals__['get_malaria_model']()
-        proba = model.predict_proba([input_features])[0][1]
-        print(f'Malaria prediction: features={input_features}, risk_score(P(1))={proba}', flush=True)
+        if RISK_GRID_ENABLED and (request.args.get('mode') or data.get('mode')) == 'grid':
+            proba, mode, max_error = score_what_if('malaria', float(input_features[0]), float(input_features[1]))
+            return jsonify({'probability': proba, 'mode': mode, 'max_error': max_error})
+        proba = prediction_cache.score('malaria', np.asarray([input_features], dtype=np.float64))[0]
+        logger.debug('Malaria prediction: features=%s, risk_score(P(1))=%s', input_features, proba)
         return jsonify({'probability': float(proba)})
     except Exception as e:
         import traceback
         tb = traceback.format_exc()
-        print('Error in /predict/malaria:', tb, flush=True)
+        logger.error('Error in /predict/malaria', exc_info=True)
         return jsonify({'error': str(e), 'traceback': tb, 'features': features}), 500
 
-@app.route('/predict/batch', methods=['POST'])
+def extract_features(disease, features):
+    """Return the model input row for `disease` from a dict or positional feature list."""
+    if disease == 'cholera':
+        if isinstance(features, dict):
+            return [float(features['unimproved_sanitation_rate']), float(features['avg_rainfall'])]
+        return [float(features[0]), float(features[1])]
+    if isinstance(features, dict):
+        return [float(features['mean_ndvi']), float(features['avg_temp'])]
+    return [float(features[2]), float(features[3])]
+
+@api.route('/predict/batch', methods=['POST'])
 def predict_batch():
     """
     Expects JSON array of items, each with:
       - disease: 'cholera' or 'malaria'
       - features: array or dict of features
     Returns array of probabilities (risk scores) in the same order.
+
+    Items are grouped by disease so each model scores a single feature
+    matrix; results are scattered back to their original positions.
     """
+    import traceback
     try:
         items = request.json
         if not isinstance(items, list):
             return jsonify({'error': 'Request body must be a JSON array'}), 400
-        results = []
-        for item in items:
+        PREDICT_BATCH_SIZE.observe(len(items))
+        results = [None] * len(items)
+        # disease -> (original positions, feature rows)
+        pending = {'cholera': ([], []), 'malaria': ([], [])}
+        for i, item in enumerate(items):
             disease = item.get('disease')
             features = item.get('features')
             if not disease or not features:
-                results.append({'error': 'Missing disease or features', 'input': item})
+                results[i] = {'error': 'Missing disease or features', 'input': item}
                 continue
             try:
-                if disease.lower() == 'cholera':
-                    if isinstance(features, dict):
-                        input_features = [features['unimproved_sanitation_rate'], features['avg_rainfall']]
-                    else:
-                        input_features = [features[0], features[1]]
-                    model = predict_cholera.__globals__['get_cholera_model']()
-                    proba = model.predict_proba([input_features])[0][1]
-                    print(f'Batch cholera prediction: features={input_features}, risk_score(P(1))={proba}', flush=True)
-                    results.append({'probability': float(proba)})
-                elif disease.lower() == 'malaria':
-                    if isinstance(features, dict):
-                        input_features = [features['mean_ndvi'], features['avg_temp']]
-                    else:
-                        input_features = [features[2], features[3]]
-                    model = predict_malaria.__globals__['get_malaria_model']()
-                    proba = model.predict_proba([input_features])[0][1]
-                    print(f'Batch malaria prediction: features={input_features}, risk_score(P(1))={proba}', flush=True)
-                    results.append({'probability': float(proba)})
-                else:
-                    results.append({'error': f'Unknown disease: {disease}', 'input': item})
+                disease_key = disease.lower()
+                if disease_key not in pending:
+                    results[i] = {'error': f'Unknown disease: {disease}', 'input': item}
+                    continue
+                row = extract_features(disease_key, features)
+            except Exception as e:
+                results[i] = {'error': str(e), 'traceback': traceback.format_exc(), 'input': item}
+                continue
+            pending[disease_key][0].append(i)
+            pending[disease_key][1].append(row)
+
+        futures = {
+            disease_key: _scoring_pool.submit(prediction_cache.score, disease_key, np.asarray(rows, dtype=np.float64))
+            for disease_key, (positions, rows) in pending.items() if positions
+        }
+        for disease_key, future in futures.items():
+            positions = pending[disease_key][0]
+            try:
+                probas = future.result(timeout=SCORING_TIMEOUT).tolist()
+            except FutureTimeoutError:
+                for other in futures.values():
+                    other.cancel()
+                return jsonify({'error': 'Scoring is overloaded, try again later'}), 503, {'Retry-After': '1'}
             except Exception as e:
-                import traceback
                 tb = traceback.format_exc()
-                results.append({'error': str(e), 'traceback': tb, 'input': item})
+                for i in positions:
+                    results[i] = {'error': str(e), 'traceback': tb, 'input': items[i]}
+                continue
+            for i, proba in zip(positions, probas):
+                results[i] = {'probability': proba}
         return jsonify(results)
     except Exception as e:
-        import traceback
         tb = traceback.format_exc()
         return jsonify({'error': str(e), 'traceback': tb}), 500
 
+@api.route('/predict/forecast', methods=['GET'])
+def predict_forecast():
+    """
+    Weekly case projections for one county and disease.
+
+    Query parameters: county, disease (required), horizon (weeks, 1-8,
+    default 4) and interval (coverage of the bounds, default 0.95).
+    """
+    try:
+        county = request.args.get('county')
+        disease = request.args.get('disease')
+        horizon = request.args.get('horizon', 4, type=int)
+        interval = request.args.get('interval', 0.95, type=float)
+        if not county or not disease:
+            return jsonify({'error': 'county and disease are required'}), 400
+        if not 1 <= horizon <= MAX_HORIZON:
+            return jsonify({'error': f'horizon must be between 1 and {MAX_HORIZON}'}), 400
+        if not 0 < interval < 1:
+            return jsonify({'error': 'interval must be between 0 and 1'}), 400
+        try:
+            result = get_forecast_engine().forecast(county, disease, horizon, interval)
+        except KeyError as e:
+            return jsonify({'error': e.args[0]}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 422
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Append a batch of report rows (JSON array, or {"rows": [...]}) in the CSV schema
+@api.route('/data/ingest', methods=['POST'])
+def ingest_data():
+    try:
+        body = request.get_json(silent=True)
+        rows = body.get('rows') if isinstance(body, dict) else body
+        try:
+            summary = ingest_rows(rows)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(summary), 200 if summary['accepted'] or not summary['rejected'] else 422
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/alerts/detect', methods=['GET'])
+def detect_alerts():
+    """
+    County-weeks flagged by the early-warning detectors (see alerts.py).
+
+    Optional query parameters:
+      - county, disease: comma-separated names (case-insensitive)
+      - week_from, week_to: YYYY-MM-DD, keeps weeks overlapping the range
+      - detectors: comma-separated subset of c1, c2, c3, cusum, zscore
+    """
+    try:
+        county = request.args.get('county')
+        disease = request.args.get('disease')
+        detectors = request.args.get('detectors')
+        detectors = detectors.split(',') if detectors else DETECTORS
+        unknown = [name for name in detectors if name not in THRESHOLDS]
+        if unknown:
+            return jsonify({'error': f'Unknown detector(s): {", ".join(unknown)}'}), 400
+        engine = get_alert_engine()
+        try:
+            alerts = engine.detect(
+                counties=county.split(',') if county else None,
+                diseases=disease.split(',') if disease else None,
+                week_from=request.args.get('week_from'),
+                week_to=request.args.get('week_to'),
+                detectors=detectors,
+            )
+        except ValueError as e:
+            return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+        return jsonify({
+            'dataset_version': engine.store_version,
+            'thresholds': {name: THRESHOLDS[name] for name in detectors},
+            'alerts': alerts,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # --- Analytics API Endpoints ---
-@app.route('/data/monthly_comparison', methods=['GET'])
+@api.route('/data/monthly_comparison', methods=['GET'])
+@versioned(dataset_tag)
 def get_monthly_comparison():
     try:
-        df = get_csv_data()
-        # Group by month (parse from week string if needed)
-        df['month'] = df['week'].str.slice(0, 7)  # e.g., '2023-01'
-        grouped = df.groupby('month')
+        aggregates = get_aggregates()
+        by_month_disease = aggregates.rollup('month', 'disease')
         result = []
-        for month, rows in grouped:
-            cholera = rows[rows['disease'].str.lower() == 'cholera']['cases'].sum()
-            malaria = rows[rows['disease'].str.lower() == 'malaria']['cases'].sum()
-            outbreaks = rows['outbreak'].sum()
+        for (month,), totals in aggregates.rollup('month').items():
+            cholera = by_month_disease.get((month, 'cholera'), {}).get('cases', 0)
+            malaria = by_month_disease.get((month, 'malaria'), {}).get('cases', 0)
             result.append({
                 'month': month,
                 'cholera': int(cholera),
                 'malaria': int(malaria),
-                'outbreaks': int(outbreaks)
+                'outbreaks': int(totals['outbreak'])
             })
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/data/county_data', methods=['GET'])
+@api.route('/data/county_data', methods=['GET'])
+@versioned(dataset_and_models_tag)
 def get_county_data():
     try:
-        df = get_csv_data()
-        grouped = df.groupby('county')
-        palette = ['#ef4444', '#f97316', '#f59e0b', '#eab308', '#94a3b8', '#3b82f6', '#f97316', '#f59e0b']
+        if DATA_MODE == 'chunked':
+            return jsonify(get_dataset().run(CountyRisk()))
+        areas = get_spatial_rollups().map('county')['areas']
         result = []
-        for i, (county, rows) in enumerate(grouped):
-            cases = rows['cases'].sum()
+        for area in areas:
             result.append({
-                'name': county,
-                'cases': int(cases),
-                'color': palette[i % len(palette)]
+                'name': area['county'],
+                'cases': int(area['cases']),
+                'outbreaks': area['outbreaks'],
+                'risk': area['risk'],
+                'color': area['color']
             })
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/data/environmental', methods=['GET'])
+@api.route('/data/map', methods=['GET'])
+@versioned(dataset_and_models_tag)
+def get_map_data():
+    """
+    Cases, outbreaks, mean risk and a risk-quantile colour per area.
+
+    Optional query parameters:
+      - level: county (default) or sub_county
+      - disease: comma-separated names (case-insensitive)
+      - week_from, week_to: YYYY-MM-DD, keeps weeks overlapping the range
+      - month_from, month_to: YYYY-MM, keeps weeks starting in those months
+    """
+    try:
+        level = request.args.get('level', 'county')
+        if level not in LEVELS:
+            return jsonify({'error': f'level must be one of {", ".join(LEVELS)}'}), 400
+        disease = request.args.get('disease')
+        try:
+            payload = get_spatial_rollups().map(
+                level,
+                diseases=disease.split(',') if disease else None,
+                week_from=request.args.get('week_from'),
+                week_to=request.args.get('week_to'),
+                month_from=request.args.get('month_from'),
+                month_to=request.args.get('month_to'),
+            )
+        except ValueError as e:
+            return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+        return jsonify(payload)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/data/environmental', methods=['GET'])
+@versioned(dataset_tag)
 def get_environmental():
     try:
-        df = get_csv_data()
-        # Example: average by disease
-        cholera_rows = df[df['disease'].str.lower() == 'cholera']
-        malaria_rows = df[df['disease'].str.lower() == 'malaria']
-        def safe_mean(series):
-            return float(np.nanmean(series)) if len(series) > 0 else 0
+        by_disease = get_aggregates().rollup('disease')
+        cholera = by_disease.get(('cholera',), {})
+        malaria = by_disease.get(('malaria',), {})
+        def safe_mean(totals, column):
+            mean = totals.get(f'{column}_mean')
+            return mean if mean is not None else 0
         data = [
             {
                 'factor': 'High Temp',
-                'cholera': safe_mean(cholera_rows['avg_temp']),
-                'malaria': safe_mean(malaria_rows['avg_temp'])
+                'cholera': safe_mean(cholera, 'avg_temp'),
+                'malaria': safe_mean(malaria, 'avg_temp')
             },
             {
                 'factor': 'Heavy Rain',
-                'cholera': safe_mean(cholera_rows['avg_rainfall']),
-                'malaria': safe_mean(malaria_rows['avg_rainfall'])
+                'cholera': safe_mean(cholera, 'avg_rainfall'),
+                'malaria': safe_mean(malaria, 'avg_rainfall')
             },
             {
                 'factor': 'Poor Sanitation',
-                'cholera': safe_mean(cholera_rows['unimproved_sanitation_rate']),
-                'malaria': safe_mean(malaria_rows['unimproved_sanitation_rate'])
+                'cholera': safe_mean(cholera, 'unimproved_sanitation_rate'),
+                'malaria': safe_mean(malaria, 'unimproved_sanitation_rate')
             },
             {
                 'factor': 'High NDVI',
-                'cholera': safe_mean(cholera_rows['mean_ndvi']),
-                'malaria': safe_mean(malaria_rows['mean_ndvi'])
+                'cholera': safe_mean(cholera, 'mean_ndvi'),
+                'malaria': safe_mean(malaria, 'mean_ndvi')
             },
         ]
         return jsonify(data)
@@ -286,19 +497,59 @@ def get_environmental():
         return jsonify({'error': str(e)}), 500
 
 # Endpoint to list available reports
-@app.route('/reports/list', methods=['GET'])
+@api.route('/reports/list', methods=['GET'])
+@versioned(manifest_tag)
 def list_reports():
+    """
+    Reports in the catalog (see report_catalog.py), in filename order:
+    `reports` lists the filenames and `items` their type, period, counties,
+    row count, summary and content hash.
+
+    Optional query parameters:
+      - type: comma-separated report types (weekly, monthly)
+      - period_from, period_to: YYYY-MM or YYYY-MM-DD, keeps periods overlapping the range
+      - county: comma-separated names (case-insensitive), keeps reports covering any of them
+      - limit, cursor: page size and the X-Next-Cursor value of the previous page
+    """
     try:
-        files = [f for f in os.listdir(REPORTS_DIR) if f.endswith('.csv') or f.endswith('.pdf')]
-        # Optionally, add metadata extraction here
-        return jsonify({'reports': files})
+        report_type = request.args.get('type')
+        county = request.args.get('county')
+        try:
+            limit = request.args.get('limit', type=int)
+            if limit is not None and limit <= 0:
+                return jsonify({'error': 'limit must be positive'}), 400
+            items, next_cursor = query_reports(
+                types=report_type.split(',') if report_type else None,
+                period_from=request.args.get('period_from'),
+                period_to=request.args.get('period_to'),
+                counties=county.split(',') if county else None,
+                cursor=request.args.get('cursor'),
+                limit=limit,
+            )
+        except ValueError as e:
+            return jsonify({'error': f'Invalid query parameter: {e}'}), 400
+        response = jsonify({'reports': [item['filename'] for item in items], 'items': items})
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Trigger a report rebuild in the background; only changed reports are rewritten
+@api.route('/reports/rebuild', methods=['POST'])
+def rebuild_reports():
+    force = request.args.get('force', 'false').lower() == 'true'
+    started = start_background_build(force=force, on_complete=prerender_reports)
+    return jsonify({'started': started, **build_status}), 202 if started else 409
+
+@api.route('/reports/rebuild', methods=['GET'])
+def rebuild_reports_status():
+    return jsonify(build_status)
+
 # Endpoint to download a specific report by filename
 
 # Download report in CSV or PDF
-@app.route('/reports/download/<filename>', methods=['GET'])
+@api.route('/reports/download/<filename>', methods=['GET'])
 def download_specific_report(filename):
     try:
         safe_filename = os.path.basename(filename)
@@ -314,223 +565,30 @@ def download_specific_report(filename):
         return jsonify({'error': str(e)}), 500
 
 
-# Generate PDF on demand from CSV with professional formatting
-@app.route('/reports/download/<filename>.pdf', methods=['GET'])
+# Serve the PDF rendering of a CSV report, rendered once per report version
+@api.route('/reports/download/<filename>.pdf', methods=['GET'])
 def download_report_pdf(filename):
     import traceback
     try:
-        from reportlab.lib import colors
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak, Image
-        from reportlab.lib.units import inch
-        from reportlab.graphics.shapes import Drawing
-        from reportlab.graphics.charts.barcharts import VerticalBarChart
-        from reportlab.graphics.charts.linecharts import HorizontalLineChart
-        from reportlab.graphics.charts.textlabels import Label
-        import tempfile
-        import matplotlib.pyplot as plt
-        import numpy as np
-
         safe_filename = os.path.basename(filename)
         csv_path = os.path.join(REPORTS_DIR, safe_filename)
         if not os.path.exists(csv_path):
             return jsonify({'error': 'CSV report not found'}), 404
-        # Read summary and data
-        with open(csv_path, encoding='utf-8') as f:
-            lines = f.readlines()
-        summary_lines = [l.strip() for l in lines if l.startswith('#')]
-        data_lines = [l for l in lines if not l.startswith('#')]
-        # Prepare summary as key-value pairs
-        summary = [l[2:].split(':', 1) for l in summary_lines if ':' in l]
-        # Prepare data table
-        if not data_lines:
-            data_table = []
-        else:
-            data_table = [row.strip().split(',') for row in data_lines]
-
-        # Convert data table to DataFrame for analytics/graphs
-        import pandas as pd
-        # Clean and convert numeric columns for plotting
-        df = pd.DataFrame(data_table[1:], columns=data_table[0]) if data_table else pd.DataFrame()
-        if not df.empty:
-            for col in ['cases', 'outbreak', 'predicted_risk']:
-                if col in df.columns:
-                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
-
-        # PDF generation
-        pdf_buffer = io.BytesIO()
-        doc = SimpleDocTemplate(
-            pdf_buffer,
-            pagesize=letter,
-            rightMargin=60,
-            leftMargin=60,
-            topMargin=70,
-            bottomMargin=50
-        )
-        elements = []
-        styles = getSampleStyleSheet()
-        title_style = styles['Title']
-        subtitle_style = styles['Heading2']
-        normal_style = styles['Normal']
-        summary_style = ParagraphStyle('Summary', parent=normal_style, fontSize=10, spaceAfter=6)
-
-        # Branding and title
-        elements.append(Paragraph("Outbreak Early Warning System", title_style))
-        elements.append(Paragraph("Epidemiological Report", subtitle_style))
-        elements.append(Spacer(1, 0.2 * inch))
-        elements.append(Paragraph(f"<b>Report File:</b> {safe_filename}", normal_style))
-        elements.append(Spacer(1, 0.1 * inch))
-
-        # Summary section
-        if summary:
-            # Check for all-zero cases and outbreaks
-            summary_dict = {k.strip(): v.strip() for k, v in summary}
-            zero_cases = summary_dict.get('total_cases', '0') in ['0', '0.0']
-            zero_outbreaks = summary_dict.get('total_outbreaks', '0') in ['0', '0.0']
-            if zero_cases and zero_outbreaks:
-                warning_style = ParagraphStyle('Warning', parent=styles['Normal'], fontSize=12, textColor=colors.red, spaceAfter=12, alignment=1)
-                elements.append(Paragraph("<b>Notice:</b> No cases or outbreaks were reported for this period. All values are zero.", warning_style))
-            elements.append(Paragraph("<b>Summary Statistics</b>", styles['Heading3']))
-            for k, v in summary:
-                elements.append(Paragraph(f"<b>{k.strip()}:</b> {v.strip()}", summary_style))
-            elements.append(Spacer(1, 0.2 * inch))
-
-        # Analytics and Graphs
-        if not df.empty:
-            # Cases by Disease Bar Chart
-            if 'disease' in df.columns and 'cases' in df.columns:
-                cases_by_disease = df.groupby('disease')['cases'].sum()
-                if not cases_by_disease.empty and cases_by_disease.sum() > 0:
-                    plt.figure(figsize=(4, 2.2))
-                    plt.bar(cases_by_disease.index, cases_by_disease.values, color=['#3b82f6', '#ef4444', '#22c55e', '#f59e0b'][:len(cases_by_disease)])
-                    plt.title('Cases by Disease')
-                    plt.ylabel('Cases')
-                    plt.tight_layout()
-                    tmpfile = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-                    plt.savefig(tmpfile.name, dpi=120)
-                    plt.close()
-                    elements.append(Paragraph("<b>Cases by Disease</b>", styles['Heading4']))
-                    elements.append(Image(tmpfile.name, width=3.5*inch, height=2*inch))
-            # Outbreaks by County
-            if 'county' in df.columns and 'outbreak' in df.columns:
-                outbreaks_by_county = df.groupby('county')['outbreak'].sum()
-                if not outbreaks_by_county.empty and outbreaks_by_county.sum() > 0:
-                    plt.figure(figsize=(4, 2.2))
-                    plt.bar(outbreaks_by_county.index, outbreaks_by_county.values, color='#f97316')
-                    plt.title('Outbreaks by County')
-                    plt.ylabel('Outbreaks')
-                    plt.xticks(rotation=30, ha='right', fontsize=7)
-                    plt.tight_layout()
-                    tmpfile2 = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-                    plt.savefig(tmpfile2.name, dpi=120)
-                    plt.close()
-                    elements.append(Paragraph("<b>Outbreaks by County</b>", styles['Heading4']))
-                    elements.append(Image(tmpfile2.name, width=3.5*inch, height=2*inch))
-            elements.append(Spacer(1, 0.2 * inch))
-
-        # Prediction section for special reports
-        if 'special' in safe_filename.lower() or 'assessment' in safe_filename.lower():
-            elements.append(Paragraph("<b>Prediction Analysis</b>", styles['Heading3']))
-            if 'predicted_risk' in df.columns and 'disease' in df.columns:
-                pred_summary = df.groupby('disease')['predicted_risk'].apply(lambda x: np.mean([float(i) for i in x if i not in [None, '', 'nan']])).to_dict()
-                for disease, risk in pred_summary.items():
-                    elements.append(Paragraph(f"<b>{disease} Avg Predicted Risk:</b> {risk:.3f}", summary_style))
-            elements.append(Spacer(1, 0.2 * inch))
-
-        # Data table
-        if data_table:
-            elements.append(Paragraph("<b>Detailed Data</b>", styles['Heading3']))
-            from reportlab.platypus import Paragraph as RLParagraph
-            from reportlab.pdfbase.ttfonts import TTFont
-            from reportlab.pdfbase import pdfmetrics
-            # Use system-wide font (Noto Serif JP if available, else fallback)
-            try:
-                pdfmetrics.registerFont(TTFont('NotoSerifJP', os.path.join(os.path.dirname(__file__), '../src/fonts/NotoSerifJP-Regular.ttf')))
-                font_name = 'NotoSerifJP'
-            except Exception:
-                font_name = 'Helvetica'
-            # Pad all rows to header length
-            header_len = len(data_table[0])
-            padded_table = [row + [''] * (header_len - len(row)) if len(row) < header_len else row[:header_len] for row in data_table]
-            # Use a smaller font and wrap text for long values
-            def format_cell(val):
-                sval = str(val)
-                # Always wrap text for long values
-                if len(sval) > 15 or any(c in sval for c in [',', ' ', '\n']):
-                    return RLParagraph(sval.replace('\n', '<br/>'), ParagraphStyle('tablecell', fontName=font_name, fontSize=7, leading=8))
-                else:
-                    return RLParagraph(sval, ParagraphStyle('tablecell', fontName=font_name, fontSize=7, leading=8))
-            formatted_table = [[format_cell(cell) for cell in row] for row in padded_table]
-            # Auto-size columns based on max content width, but cap at 1.2 inch
-            max_table_width = doc.width
-            num_cols = header_len
-            col_widths = []
-            for col in range(num_cols):
-                maxlen = max([len(str(row[col])) for row in padded_table])
-                width = min(0.11 * inch * maxlen + 0.25 * inch, 1.2 * inch)
-                col_widths.append(width)
-            # If total width exceeds page, scale down proportionally
-            total_width = sum(col_widths)
-            if total_width > max_table_width:
-                scale = max_table_width / total_width
-                col_widths = [w * scale for w in col_widths]
-            table = Table(formatted_table, repeatRows=1, hAlign='LEFT', colWidths=col_widths)
-            # Alternating row background color for readability, highlight outbreak rows
-            table_style = [
-                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e3e3e3')),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#222222')),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), font_name),
-                ('FONTSIZE', (0, 0), (-1, 0), 8),
-                ('FONTSIZE', (0, 1), (-1, -1), 7),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 5),
-                ('TOPPADDING', (0, 0), (-1, 0), 5),
-                ('LEFTPADDING', (0, 0), (-1, -1), 1),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 1),
-                ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#bbbbbb')),
-            ]
-            # Find outbreak column index
-            outbreak_col = None
-            for idx, col in enumerate(data_table[0]):
-                if col.strip().lower() == 'outbreak':
-                    outbreak_col = idx
-                    break
-            for i in range(1, len(formatted_table)):
-                # Highlight outbreak rows
-                if outbreak_col is not None:
-                    val = str(padded_table[i][outbreak_col]).strip()
-                    if val == '1' or val.lower() == 'true':
-                        table_style.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor('#fef3c7')))
-                        table_style.append(('TEXTCOLOR', (0, i), (-1, i), colors.HexColor('#b45309')))
-                elif i % 2 == 1:
-                    table_style.append(('BACKGROUND', (0, i), (-1, i), colors.whitesmoke))
-            table.setStyle(TableStyle(table_style))
-            table._argW = col_widths
-            table.repeatRows = 1
-            table.splitByRow = 1
-            elements.append(table)
-
-        # Footer with page number
-        def add_footer(canvas, doc):
-            canvas.saveState()
-            footer_text = f"Generated by Outbreak Early Warning System | Page {doc.page}"
-            canvas.setFont('Helvetica', 8)
-            canvas.setFillColor(colors.HexColor('#888888'))
-            canvas.drawString(60, 35, footer_text)
-            canvas.restoreState()
-
-        doc.build(elements, onFirstPage=add_footer, onLaterPages=add_footer)
-        pdf_buffer.seek(0)
+        try:
+            pdf_path = get_report_pdf(csv_path, timeout=PDF_RENDER_TIMEOUT)
+        except FutureTimeoutError:
+            # Rendering carries on in the background; a retry gets the cached file
+            return jsonify({'error': 'PDF is still rendering, try again shortly'}), 503, {'Retry-After': '5'}
         pdf_name = safe_filename.replace('.csv', '.pdf')
-        return send_file(pdf_buffer, mimetype='application/pdf', as_attachment=True, download_name=pdf_name)
+        return send_file(pdf_path, mimetype='application/pdf', as_attachment=True, download_name=pdf_name)
     except Exception as e:
         tb = traceback.format_exc()
-        print(f"Error generating PDF for {filename}: {e}\n{tb}")
+        logger.error('Error generating PDF for %s', filename, exc_info=True)
         return jsonify({'error': str(e), 'traceback': tb}), 500
 
     
 # --- Reports Download Endpoint ---
-@app.route('/reports/download', methods=['GET'])
+@api.route('/reports/download', methods=['GET'])
 def download_report():
     """
     Generates a CSV report from outbreak data and serves it as a downloadable file.
@@ -551,5 +609,8 @@ def download_report():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # With the reloader, only the child process that serves requests warms up
+    # and builds reports; the watching parent stays idle
+    serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    create_app(warm=serving, background=serving).run(debug=True)
 
@@ -0,0 +1,88 @@
+"""Peak memory and time of the history-wide builds, in memory versus chunked mode.
+
+For each mode a fresh process, pointed at a synthetic dataset by DATA_DIR,
+builds the materialized aggregates (monthly comparison, environmental), the
+all-time county rollup and every report, then reports its peak RSS. In
+chunked mode, writing the month partitions is timed separately. The
+reports are built with one worker in both modes, so the peaks compare a
+single process.
+
+Usage (from the backend directory):
+    python benchmarks/bench_chunked.py [--scale 100] [--chunk-rows 100000]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def child():
+    """Run the builds in this process; DATA_DIR, REPORTS_DIR and DATA_MODE are already set."""
+    from aggregates import get_aggregates
+    from config import DATA_MODE
+    from report_builder import generate_and_save_reports
+
+    seconds = {}
+    start = time.perf_counter()
+    if DATA_MODE == 'chunked':
+        from partitions import CountyRisk, get_dataset
+        dataset = get_dataset()
+        seconds['partitions'] = time.perf_counter() - start
+
+        def county():
+            return dataset.run(CountyRisk(), workers=1)
+    else:
+        from spatial import get_spatial_rollups
+
+        def county():
+            return get_spatial_rollups().map('county')['areas']
+
+    for name, build in (('aggregates', get_aggregates), ('county', county),
+                        ('reports', lambda: generate_and_save_reports(force=True, workers=1))):
+        start = time.perf_counter()
+        build()
+        seconds[name] = time.perf_counter() - start
+    # ru_maxrss is in kB on Linux
+    print(json.dumps({'seconds': seconds, 'peak_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run(mode, data_dir, chunk_rows):
+    env = dict(os.environ, DATA_DIR=data_dir, REPORTS_DIR=os.path.join(data_dir, f'reports_{mode}'),
+               DATA_MODE=mode, PARTITION_CHUNK_ROWS=str(chunk_rows), LOG_LEVEL='ERROR')
+    out = subprocess.run([sys.executable, __file__, '--child'], cwd=BACKEND_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100, help='copies of the real dataset')
+    parser.add_argument('--chunk-rows', type=int, default=100000, help='PARTITION_CHUNK_ROWS in chunked mode')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    from synthetic import write_synthetic_csv
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = write_synthetic_csv(os.path.join(tmp, 'simulated_outbreak_data_v15.csv'), args.scale)
+        print(f'{rows} rows (scale {args.scale})')
+        print(f"{'mode':>8}  {'partitions s':>12}  {'aggregates s':>12}  {'county s':>8}  {'reports s':>9}  {'peak MiB':>8}")
+        for mode in ('memory', 'chunked'):
+            result = run(mode, tmp, args.chunk_rows)
+            s = result['seconds']
+            print(f"{mode:>8}  {s.get('partitions', 0):>12.2f}  {s['aggregates']:>12.2f}  {s['county']:>8.2f}  "
+                  f"{s['reports']:>9.2f}  {result['peak_mib']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Throughput of POST /predict/batch at several batch sizes.
+
+Usage (from the backend directory):
+    python benchmarks/bench_predict_batch.py [--sizes 1 100 10000] [--seconds 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+
+
+def make_batch(size, seed=0):
+    rng = random.Random(seed)
+    items = []
+    for i in range(size):
+        if i % 2 == 0:
+            items.append({'disease': 'cholera', 'features': {
+                'unimproved_sanitation_rate': rng.random(),
+                'avg_rainfall': rng.uniform(0, 20),
+            }})
+        else:
+            items.append({'disease': 'malaria', 'features': {
+                'mean_ndvi': rng.random(),
+                'avg_temp': rng.uniform(15, 35),
+            }})
+    return items
+
+
+def run(app, size, seconds):
+    client = app.test_client()
+    batch = make_batch(size)
+    # Warm up model loading and Flask internals
+    client.post('/predict/batch', json=batch)
+    requests = 0
+    start = time.perf_counter()
+    while True:
+        resp = client.post('/predict/batch', json=batch)
+        assert resp.status_code == 200, resp.get_data(as_text=True)
+        requests += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            break
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+    app = create_app(warm=True)
+    print(f"{'batch size':>10}  {'req/s':>10}  {'rows/s':>12}")
+    for size in args.sizes:
+        rps = run(app, size, args.seconds)
+        print(f'{size:>10}  {rps:>10.1f}  {rps * size:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Serialization time of the full dataset: to_dict + json versus serializers.py.
+
+"to_dict" is how /data/outbreak used to encode rows: DataFrame chunks turned
+into Python records and then into JSON with the standard library. The other
+rows time the bodies encode_rows() produces for each shape and format.
+
+Usage (from the backend directory):
+    python benchmarks/bench_serialize.py [--scale 100] [--rounds 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_store import DataStore  # noqa: E402
+from serializers import ARROW_STREAM, JSON, NDJSON, arrow_available, encode_rows  # noqa: E402
+from synthetic import make_synthetic_frame  # noqa: E402
+
+# Rows per chunk of the old streamed response
+TO_DICT_CHUNK_ROWS = 1000
+
+
+def to_dict_body(store, rows):
+    chunks = ['[']
+    for start in range(0, len(rows), TO_DICT_CHUNK_ROWS):
+        records = store.to_frame(rows[start:start + TO_DICT_CHUNK_ROWS]).to_dict(orient='records')
+        chunks.append((',' if start else '') + json.dumps(records)[1:-1])
+    chunks.append(']')
+    return ''.join(chunks).encode()
+
+
+def best_time(fn, rounds):
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        body = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, len(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100, help='copies of the real dataset')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    store = DataStore.from_frame(make_synthetic_frame(args.scale))
+    rows = store.rows()
+    cases = [
+        ('to_dict', lambda: to_dict_body(store, rows)),
+        ('records', lambda: b''.join(encode_rows(store, rows, JSON))),
+        ('columnar', lambda: b''.join(encode_rows(store, rows, JSON, shape='columnar'))),
+        ('ndjson', lambda: b''.join(encode_rows(store, rows, NDJSON))),
+    ]
+    if arrow_available():
+        cases.append(('arrow', lambda: b''.join(encode_rows(store, rows, ARROW_STREAM))))
+
+    print(f'{store.n_rows} rows (scale {args.scale})')
+    print(f"{'encoder':>10}  {'seconds':>8}  {'MiB':>8}  {'speedup':>8}")
+    baseline = None
+    for name, fn in cases:
+        seconds, size = best_time(fn, args.rounds)
+        baseline = baseline or seconds
+        print(f'{name:>10}  {seconds:>8.3f}  {size / 2**20:>8.1f}  {baseline / seconds:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
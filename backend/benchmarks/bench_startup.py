@@ -0,0 +1,95 @@
+"""Data-store cold start: CSV parse versus memory-mapped snapshot.
+
+Starts 1 and then 8 worker processes per mode; each one loads the store and
+touches every column, as a worker does when serving /data/* requests. Load
+time is reported per worker. Memory is measured while all workers are alive:
+RSS is summed across them, and PSS (shared pages split between the processes
+that map them) shows what they cost the host together.
+
+Usage (from the backend directory):
+    python benchmarks/bench_startup.py [--scale 100] [--workers 1 8]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_store import DataStore  # noqa: E402
+from snapshot import read_snapshot, write_snapshot  # noqa: E402
+from synthetic import write_synthetic_csv  # noqa: E402
+
+
+def child(mode, path):
+    import pandas as pd
+
+    start = time.perf_counter()
+    if mode == 'csv':
+        store = DataStore.from_frame(pd.read_csv(path))
+    else:
+        store = read_snapshot(path)
+    for values in store.columns.values():
+        values.sum()
+    print(f'{time.perf_counter() - start:.6f}', flush=True)
+    # Stay alive until the parent has measured memory
+    sys.stdin.read()
+
+
+def memory_kb(pid):
+    """(rss, pss) of a process in kB, from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key] = int(rest.split()[0])
+    return values['Rss'], values['Pss']
+
+
+def run(mode, path, workers):
+    procs = [
+        subprocess.Popen([sys.executable, __file__, '--child', mode, path],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(workers)
+    ]
+    try:
+        seconds = [float(p.stdout.readline()) for p in procs]
+        memory = [memory_kb(p.pid) for p in procs]
+    finally:
+        for p in procs:
+            p.stdin.close()
+            p.wait()
+    rss = sum(m[0] for m in memory) / 1024
+    pss = sum(m[1] for m in memory) / 1024
+    return sum(seconds) / len(seconds), max(seconds), rss, pss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100, help='copies of the real dataset')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--child', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'data.csv')
+        rows = write_synthetic_csv(csv_path, args.scale)
+        snapshot_path = write_snapshot(DataStore.from_frame(pd.read_csv(csv_path)), os.path.join(tmp, 'snapshot'))
+        print(f'{rows} rows (scale {args.scale}), CSV {os.path.getsize(csv_path) / 2**20:.1f} MiB')
+        print(f"{'mode':>8}  {'workers':>7}  {'mean load s':>11}  {'max load s':>10}  {'RSS MiB':>9}  {'PSS MiB':>9}")
+        for mode, path in (('csv', csv_path), ('snapshot', snapshot_path)):
+            for workers in args.workers:
+                mean, worst, rss, pss = run(mode, path, workers)
+                print(f'{mode:>8}  {workers:>7}  {mean:>11.4f}  {worst:>10.4f}  {rss:>9.1f}  {pss:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Cold-start import budget of the backend, from python -X importtime.
+
+Imports app and calls create_app() in fresh interpreters, as a serving
+process does before it can answer requests, and fails (exit status 1) if
+  - the total import time of the fastest run exceeds --budget-ms, or
+  - any module of the PDF or model stacks (matplotlib, reportlab, joblib,
+    sklearn, xgboost) was imported: those load on first use (model loads,
+    PDF renders) or on a background thread after startup.
+The slowest imports made directly by app are listed, to show where a
+regression came from. Several runs are made and the fastest kept, as the
+others measure the machine more than the imports.
+
+Usage (from the backend directory):
+    python benchmarks/check_import_time.py [--budget-ms 1200] [--runs 5] [--top 10]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COLD_START = 'import app; app.create_app()'
+DEFERRED_PACKAGES = ('matplotlib', 'reportlab', 'joblib', 'sklearn', 'xgboost')
+# import time:  self [us] | cumulative | imported package
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def measure():
+    """
+    (total microseconds, {module imported by app: cumulative microseconds},
+    every module imported) for one cold start.
+    """
+    env = dict(os.environ, LOG_LEVEL='ERROR')
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', COLD_START], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    total = 0
+    direct = {}
+    modules = set()
+    for line in stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        modules.add(name)
+        # Nested imports are indented two more spaces per level
+        if len(indent) == 1:
+            total += int(cumulative)
+        elif len(indent) == 3:
+            direct[name] = int(cumulative)
+    return total, direct, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=1200, help='maximum total import time')
+    parser.add_argument('--runs', type=int, default=5, help='cold starts measured; the fastest counts')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports of app listed')
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    total, direct, modules = min(runs, key=lambda run: run[0])
+    total_ms = total / 1000
+    print(f'{total_ms:.0f} ms of imports (fastest of {args.runs}), budget {args.budget_ms:.0f} ms')
+    for name, us in sorted(direct.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{us / 1000:>9.1f} ms  {name}')
+
+    failed = False
+    if total_ms > args.budget_ms:
+        print(f'FAIL: imports take {total_ms:.0f} ms, over the {args.budget_ms:.0f} ms budget')
+        failed = True
+    deferred = sorted({name.split('.')[0] for name in modules} & set(DEFERRED_PACKAGES))
+    if deferred:
+        print(f'FAIL: imported at startup: {", ".join(deferred)}')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Latency of each endpoint under 1-64 concurrent clients against a live server.
+
+Each client is a thread with its own keep-alive connection that sends the
+same request back to back. For every endpoint and concurrency level the
+script reports throughput and p50/p99 latency (and errors, if any).
+
+Usage (from the backend directory):
+    # against a running server
+    python benchmarks/load_test.py --url http://127.0.0.1:5000
+    # or start gunicorn with gunicorn.conf.py for the run
+    python benchmarks/load_test.py --start [--clients 1 4 16 64] [--seconds 5] [--json out.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BATCH = [
+    {'disease': 'cholera', 'features': {'unimproved_sanitation_rate': 0.4, 'avg_rainfall': 3.0 + i % 7}}
+    if i % 2 == 0 else
+    {'disease': 'malaria', 'features': {'mean_ndvi': 0.3, 'avg_temp': 18.0 + i % 9}}
+    for i in range(100)
+]
+
+# (name, method, path, JSON body)
+ENDPOINTS = [
+    ('outbreak', 'GET', '/data/outbreak?county=Baringo&limit=100', None),
+    ('monthly_comparison', 'GET', '/data/monthly_comparison', None),
+    ('county_data', 'GET', '/data/county_data', None),
+    ('map', 'GET', '/data/map?level=sub_county&month_from=2024-01&month_to=2024-03', None),
+    ('environmental', 'GET', '/data/environmental', None),
+    ('alerts', 'GET', '/alerts/detect?week_from=2024-06-01', None),
+    ('forecast', 'GET', '/predict/forecast?county=Mandera&disease=cholera&horizon=8', None),
+    ('predict_cholera', 'POST', '/predict/cholera', {'features': [0.4, 3.0]}),
+    ('predict_batch_100', 'POST', '/predict/batch', BATCH),
+    ('reports_list', 'GET', '/reports/list', None),
+]
+
+
+def client(host, port, method, path, body, stop, latencies, errors):
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    payload = json.dumps(body) if body is not None else None
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def send():
+        conn.request(method, path, body=payload, headers=headers)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status < 400
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            try:
+                ok = send()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection; not an error
+                conn.close()
+                ok = send()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        if not ok:
+            errors.append(1)
+    conn.close()
+
+
+def measure(host, port, endpoint, clients, seconds):
+    _, method, path, body = endpoint
+    stop = threading.Event()
+    per_thread = [([], []) for _ in range(clients)]
+    threads = [
+        threading.Thread(target=client, args=(host, port, method, path, body, stop, lat, err), daemon=True)
+        for lat, err in per_thread
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    latencies = np.array([x for lat, _ in per_thread for x in lat]) * 1000
+    errors = sum(len(err) for _, err in per_thread)
+    if len(latencies) == 0:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': int(len(latencies)),
+        'errors': int(errors),
+        'rps': len(latencies) / seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+
+def start_server(port):
+    env = dict(os.environ, GUNICORN_BIND=f'127.0.0.1:{port}', BUILD_REPORTS_ON_START='0')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                            cwd=BACKEND_DIR, env=env)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError('gunicorn exited during startup')
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError('gunicorn did not start within 120 s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--start', action='store_true', help='start gunicorn (gunicorn.conf.py) for the run')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--seconds', type=float, default=5.0, help='duration of each measurement')
+    parser.add_argument('--endpoints', nargs='+', help='subset of endpoint names')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    proc = start_server(port) if args.start else None
+    endpoints = [e for e in ENDPOINTS if not args.endpoints or e[0] in args.endpoints]
+    results = []
+    try:
+        print(f"{'endpoint':<20} {'clients':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for endpoint in endpoints:
+            for clients in args.clients:
+                r = measure(host, port, endpoint, clients, args.seconds)
+                results.append(dict(endpoint=endpoint[0], clients=clients, **r))
+                if r['requests']:
+                    print(f"{endpoint[0]:<20} {clients:>7} {r['rps']:>9.1f} {r['p50_ms']:>9.2f} "
+                          f"{r['p99_ms']:>9.2f} {r['errors']:>7}")
+                else:
+                    print(f"{endpoint[0]:<20} {clients:>7} {'-':>9} {'-':>9} {'-':>9} {r['errors']:>7}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Benchmark suite over synthetic datasets at several scales, with JSON results.
+
+For each scale (copies of simulated_outbreak_data_v15.csv, see synthetic.py)
+the dataset is written to its own directory and a child process runs every
+benchmark against it, with DATA_DIR and REPORTS_DIR pointing there:
+
+  - get_csv_data: cold load of the CSV into a DataFrame
+  - warm_up: everything create_app(warm=True) builds (store, rollups, ...)
+  - data: GET of each /data/* endpoint through the Flask test client, with
+    the HTTP body cache cleared before each round; data_cached times the
+    same requests answered from that cache
+  - predict_batch: POST /predict/batch with fresh features every round, so
+    every row misses the prediction cache
+  - reports: generate_and_save_reports(force=True)
+  - pdf: GET /reports/download/<report>.csv.pdf with the PDF cache cleared
+    before each round
+
+Each benchmark runs --rounds times (after one untimed call for the request
+benchmarks) and records min/median/mean/max seconds. Results are written
+with the machine and git commit, and --compare prints the change against an
+earlier results file, flagging slowdowns beyond --threshold.
+
+Scale 10,000 (12.7M rows, a 1.8 GB CSV) needs about 16 GB of memory, so it
+is not in the default scales. Report and PDF builds stop at --max-report-scale,
+since the number of reports grows with the weeks of history.
+
+Usage (from the backend directory):
+    python benchmarks/suite.py [--scales 1 100 10000] [--rounds 5] [--only data predict_batch]
+                               [--json results.json] [--compare baseline.json] [--data-dir DIR]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+BENCHMARKS = ['get_csv_data', 'warm_up', 'data', 'predict_batch', 'reports', 'pdf']
+BATCH_SIZES = [1, 10, 100, 1000, 10000]
+# Query strings per /data/* route; routes not listed run without one
+DATA_QUERIES = {
+    '/data/outbreak': ['', '?shape=columnar', '?limit=1000', '?county=Baringo&disease=cholera'],
+    '/data/map': ['', '?level=sub_county', '?level=sub_county&month_from=2023-01&month_to=2023-03'],
+}
+
+
+def summarize(name, scale, seconds, **params):
+    return {
+        'benchmark': name,
+        'scale': scale,
+        'params': params,
+        'rounds': len(seconds),
+        'min': min(seconds),
+        'median': statistics.median(seconds),
+        'mean': statistics.fmean(seconds),
+        'max': max(seconds),
+    }
+
+
+def timed(fn, rounds, setup=None):
+    seconds = []
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def request(client, method, path, **kwargs):
+    def send():
+        resp = client.open(path, method=method, **kwargs)
+        resp.get_data()
+        resp.close()
+        assert resp.status_code < 400, f'{method} {path}: {resp.status_code}'
+    return send
+
+
+def child(scale, rounds, only, max_report_scale):
+    """Run the benchmarks in this process; DATA_DIR and REPORTS_DIR are already set."""
+    import model_utils
+    from app import create_app, warm_up
+    from bench_predict_batch import make_batch
+    from report_builder import REPORTS_DIR, generate_and_save_reports
+    from pdf_reports import PDF_CACHE_DIR
+    from http_cache import body_cache
+
+    results = []
+
+    def add(name, seconds, **params):
+        results.append(summarize(name, scale, seconds, **params))
+        print(f"{name:<14} {json.dumps(params):<60} {statistics.median(seconds) * 1000:>12.2f} ms", flush=True)
+
+    if 'get_csv_data' in only:
+        def reset():
+            model_utils._csv_data = None
+        add('get_csv_data', timed(model_utils.get_csv_data, rounds, setup=reset))
+
+    app = create_app()
+    client = app.test_client()
+    if 'warm_up' in only:
+        add('warm_up', timed(warm_up, 1))
+    else:
+        warm_up()
+
+    if 'data' in only:
+        routes = sorted({rule.rule for rule in app.url_map.iter_rules()
+                         if rule.rule.startswith('/data/') and 'GET' in rule.methods})
+        for route in routes:
+            for query in DATA_QUERIES.get(route, ['']):
+                send = request(client, 'GET', route + query)
+                send()
+                add('data', timed(send, rounds, setup=body_cache.clear), path=route + query)
+                send()
+                add('data_cached', timed(send, rounds), path=route + query)
+
+    if 'predict_batch' in only:
+        for size in BATCH_SIZES:
+            batches = iter([make_batch(size, seed=seed) for seed in range(rounds + 1)])
+            client.post('/predict/batch', json=next(batches))
+            add('predict_batch', timed(lambda: request(client, 'POST', '/predict/batch', json=next(batches))(), rounds),
+                size=size)
+
+    if scale > max_report_scale:
+        return results
+    if 'reports' in only:
+        add('reports', timed(lambda: generate_and_save_reports(force=True), min(rounds, 3)))
+    if 'pdf' in only:
+        if not os.path.isdir(REPORTS_DIR):
+            generate_and_save_reports()
+        reports = sorted(f for f in os.listdir(REPORTS_DIR) if f.endswith('.csv'))
+        # The first and the largest file of each report type
+        picks = {}
+        for kind in ('weekly', 'monthly'):
+            of_kind = [f for f in reports if f.startswith(f'{kind}_')]
+            if of_kind:
+                picks[f'{kind}_first'] = of_kind[0]
+                picks[f'{kind}_largest'] = max(of_kind, key=lambda f: os.path.getsize(os.path.join(REPORTS_DIR, f)))
+        for label, fname in picks.items():
+            send = request(client, 'GET', f'/reports/download/{fname}.pdf')
+            with open(os.path.join(REPORTS_DIR, fname)) as f:
+                rows = sum(1 for _ in f) - 1
+            add('pdf', timed(send, rounds, setup=lambda: shutil.rmtree(PDF_CACHE_DIR, ignore_errors=True)),
+                report=label, rows=rows)
+    return results
+
+
+def run_scale(scale, args, data_root):
+    from synthetic import write_synthetic_csv
+
+    data_dir = os.path.join(data_root, f'scale_{scale}')
+    csv_path = os.path.join(data_dir, 'simulated_outbreak_data_v15.csv')
+    os.makedirs(data_dir, exist_ok=True)
+    if not os.path.exists(csv_path):
+        start = time.perf_counter()
+        rows = write_synthetic_csv(csv_path + '.tmp', scale)
+        os.replace(csv_path + '.tmp', csv_path)
+        print(f'scale {scale}: wrote {rows} rows in {time.perf_counter() - start:.1f} s', flush=True)
+    env = dict(os.environ, DATA_DIR=data_dir, REPORTS_DIR=os.path.join(data_dir, 'reports'),
+               LOG_LEVEL='ERROR')
+    out_path = os.path.join(data_dir, 'results.json')
+    subprocess.run([sys.executable, __file__, '--child', str(scale), out_path,
+                    '--rounds', str(args.rounds), '--only', *args.only,
+                    '--max-report-scale', str(args.max_report_scale)],
+                   cwd=BACKEND_DIR, env=env, check=True)
+    with open(out_path) as f:
+        return json.load(f)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return result['benchmark'], result['scale'], json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline_path, threshold):
+    """Print the median change of every benchmark also in the baseline; returns the regressions."""
+    with open(baseline_path) as f:
+        baseline = {result_key(r): r for r in json.load(f)['results']}
+    regressions = []
+    print(f"\n{'benchmark':<14} {'scale':>6} {'params':<50} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None:
+            continue
+        change = result['median'] / before['median'] - 1
+        flag = ' !' if change > threshold else ''
+        print(f"{result['benchmark']:<14} {result['scale']:>6} {json.dumps(result['params']):<50} "
+              f"{before['median'] * 1000:>10.2f} {result['median'] * 1000:>10.2f} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--only', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--max-report-scale', type=int, default=100,
+                        help='largest scale at which reports and PDFs are benchmarked')
+    parser.add_argument('--data-dir', help='keep the synthetic datasets here and reuse them (default: temporary)')
+    parser.add_argument('--json', default='benchmark_results.json', help='results file')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='median slowdown reported as a regression')
+    parser.add_argument('--child', nargs=2, metavar=('SCALE', 'OUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        scale, out_path = int(args.child[0]), args.child[1]
+        results = child(scale, args.rounds, args.only, args.max_report_scale)
+        with open(out_path, 'w') as f:
+            json.dump(results, f)
+        return
+
+    data_root = args.data_dir or tempfile.mkdtemp(prefix='outbreak-bench-')
+    results = []
+    try:
+        for scale in args.scales:
+            print(f'\n== scale {scale} ==', flush=True)
+            results.extend(run_scale(scale, args, data_root))
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    with open(args.json, 'w') as f:
+        json.dump({
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'machine': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'results': results,
+        }, f, indent=1)
+    print(f'\nResults written to {args.json}')
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Synthetic outbreak datasets in the CSV schema, for benchmarks.
+
+A dataset at scale N is the real CSV repeated N times. Each copy is moved
+later in time by the span of the original weeks, so history (and the number
+of week/month categories) grows with N the way it would in production.
+Report ids stay unique and the numeric columns get a little noise.
+
+write_synthetic_csv() writes large scales a block of copies at a time, so a
+10,000x file never has to fit in memory as one frame.
+"""
+import numpy as np
+import pandas as pd
+
+from model_utils import CSV_DATA_PATH
+
+# Copies generated per block by write_synthetic_csv
+COPIES_PER_BLOCK = 100
+
+
+def make_synthetic_frame(scale, seed=0, base=None, first_copy=0):
+    """Copies first_copy .. first_copy + scale - 1 of `base` (the real CSV by default)."""
+    base = pd.read_csv(CSV_DATA_PATH) if base is None else base
+    scale = int(scale)
+    weeks = base['week'].astype(str)
+    start = weeks.str.split('/').str[0].to_numpy(dtype='datetime64[D]')
+    end = weeks.str.split('/').str[-1].to_numpy(dtype='datetime64[D]')
+    # Whole weeks, so every copy starts on the same weekday
+    span = ((end.max() - start.min()).astype(int) // 7 + 1) * 7
+
+    copy = np.repeat(np.arange(first_copy, first_copy + scale), len(base))
+    shift = (copy * span).astype('timedelta64[D]')
+    start = np.tile(start, scale) + shift
+    end = np.tile(end, scale) + shift
+    week = np.char.add(np.char.add(start.astype(str), '/'), end.astype(str))
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({column: np.tile(base[column].to_numpy(), scale) for column in base.columns})
+    df['report_id'] = np.arange(1, len(df) + 1, dtype=np.int64) + first_copy * len(base)
+    df['year'] = end.astype('datetime64[Y]').astype(int) + 1970
+    df['week'] = week
+    for column, sigma in (('avg_rainfall', 0.5), ('avg_temp', 0.3), ('mean_ndvi', 0.01)):
+        values = df[column].to_numpy(dtype=np.float64)
+        noisy = values + rng.normal(0.0, sigma, len(df)) * (copy > 0)
+        df[column] = np.clip(noisy, 0.0, None) if column != 'avg_temp' else noisy
+    return df
+
+
+def write_synthetic_csv(path, scale, seed=0):
+    """Write the dataset at `scale` to `path`; returns the number of rows."""
+    base = pd.read_csv(CSV_DATA_PATH)
+    rows = 0
+    with open(path, 'w', newline='') as f:
+        for first in range(0, int(scale), COPIES_PER_BLOCK):
+            copies = min(COPIES_PER_BLOCK, int(scale) - first)
+            df = make_synthetic_frame(copies, seed=seed + first, base=base, first_copy=first)
+            df.to_csv(f, index=False, header=first == 0)
+            rows += len(df)
+    return rows
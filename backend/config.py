@@ -1,2 +1,60 @@
-# This file will be used for configuration (if needed) for the Flask backend.
-# Implementation will be added if required.
+# Configuration for the Flask backend, overridable through environment variables.
+
+import os
+
+# Seconds between checks of the model pickles for a retrained version
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '10'))
+
+# Exact lookup tables for interactive what-if queries (?mode=grid), read
+# from the models' threshold grids (see risk_grid.py)
+RISK_GRID_ENABLED = os.environ.get('RISK_GRID_ENABLED', '1') == '1'
+
+# LRU cache shared by the prediction endpoints
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', '100000'))
+# Seconds an entry stays valid; unset or 0 keeps entries until evicted
+PREDICTION_CACHE_TTL = float(os.environ.get('PREDICTION_CACHE_TTL', '0')) or None
+# Features closer than this share a cache entry
+PREDICTION_CACHE_QUANTUM = float(os.environ.get('PREDICTION_CACHE_QUANTUM', '1e-6'))
+# Larger batches skip the cache: per-row lookups cost more than the vectorized kernel
+PREDICTION_CACHE_MAX_BATCH = int(os.environ.get('PREDICTION_CACHE_MAX_BATCH', '64'))
+
+# Processes used to fit forecasts for many series at once (0 = CPU count)
+FORECAST_WORKERS = int(os.environ.get('FORECAST_WORKERS', '0'))
+
+# Threads scoring /predict/batch requests, and how long a request waits for
+# its turn before answering 503
+SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS', '4'))
+SCORING_TIMEOUT = float(os.environ.get('SCORING_TIMEOUT', '30'))
+# Seconds a PDF download waits for an uncached render before answering 503
+PDF_RENDER_TIMEOUT = float(os.environ.get('PDF_RENDER_TIMEOUT', '60'))
+# Import matplotlib and reportlab on a background thread once a serving
+# process has started, rather than on its first PDF download
+PRELOAD_PDF_STACK = os.environ.get('PRELOAD_PDF_STACK', '1') == '1'
+
+# Level of the backend's logs (written to stderr off the request thread)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Fraction of successful requests logged; errors and slow requests always are
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('REQUEST_LOG_SAMPLE_RATE', '0.01'))
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '1.0'))
+# Per-request profiling with an X-Profile header (never enable on a public server)
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles'))
+
+# Conditional GETs on the polled /data/* and /reports/list endpoints:
+# seconds clients may reuse a response without revalidating (0 = always
+# revalidate), and memory for cached (and compressed) response bodies
+HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', '0'))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('HTTP_CACHE_MAX_BYTES', str(128 * 2**20)))
+# Bodies smaller than this are sent uncompressed
+HTTP_COMPRESS_MIN_BYTES = int(os.environ.get('HTTP_COMPRESS_MIN_BYTES', '1024'))
+# /data/outbreak selections with more rows are streamed instead of cached
+OUTBREAK_CACHE_MAX_ROWS = int(os.environ.get('OUTBREAK_CACHE_MAX_ROWS', '200000'))
+
+# How reports, the monthly/environmental aggregates and the county rollup
+# read the history: 'memory' (the whole dataset at once) or 'chunked' (one
+# month partition at a time, see partitions.py)
+DATA_MODE = os.environ.get('DATA_MODE', 'memory')
+# Rows read from a CSV at a time while writing the partitions
+PARTITION_CHUNK_ROWS = int(os.environ.get('PARTITION_CHUNK_ROWS', '500000'))
+# Processes scanning partitions at once in chunked mode (0 = CPU count)
+CHUNKED_WORKERS = int(os.environ.get('CHUNKED_WORKERS', '0'))
@@ -0,0 +1,288 @@
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Column layout of the outbreak CSVs, in file order
+COLUMNS = [
+    'report_id', 'year', 'week', 'county', 'sub_county', 'disease',
+    'unimproved_sanitation_rate', 'avg_rainfall', 'mean_ndvi', 'avg_temp',
+    'cases', 'outbreak',
+]
+CATEGORICAL_COLUMNS = ['week', 'county', 'sub_county', 'disease']
+FLOAT_COLUMNS = ['unimproved_sanitation_rate', 'avg_rainfall', 'mean_ndvi', 'avg_temp', 'cases']
+INT_COLUMNS = ['report_id', 'year', 'outbreak']
+# Integer columns that need more than int32
+INT_DTYPES = {'report_id': np.int64}
+# Categorical columns computed from the others (see DataStore._prepare)
+DERIVED_COLUMNS = ['month']
+# Columns with a precomputed row index
+INDEXED_COLUMNS = ['disease', 'county', 'week', 'month']
+
+
+_EMPTY_ROWS = np.zeros(0, dtype=np.int64)
+
+
+def _build_index(codes, n_categories):
+    """Map each category code to the sorted row ids holding it."""
+    order = np.argsort(codes, kind='stable').astype(np.int64)
+    bounds = np.searchsorted(codes[order], np.arange(n_categories + 1))
+    return index_from_bounds(order, bounds)
+
+
+def index_from_bounds(order, bounds):
+    """Index whose category c holds order[bounds[c]:bounds[c + 1]] (views, no copies)."""
+    return [order[bounds[c]:bounds[c + 1]] for c in range(len(bounds) - 1)]
+
+
+def index_to_bounds(index):
+    """Inverse of index_from_bounds: (order, bounds) arrays for an index."""
+    order = np.concatenate(index) if index else _EMPTY_ROWS
+    bounds = np.concatenate([[0], np.cumsum([len(rows) for rows in index])]).astype(np.int64)
+    return order.astype(np.int64, copy=False), bounds
+
+
+class DataStore:
+    """
+    Immutable, column-oriented copy of the outbreak dataset.
+
+    String columns (plus the derived month) are stored as int32 category
+    codes, with categories sorted so week and month codes are chronological;
+    numeric columns as float32/int32 arrays (int64 for report_id). Row
+    indexes per disease, county, week and month turn the usual
+    `df[df['disease'].str.lower() == ...]` filters into array lookups.
+    """
+
+    def __init__(self, columns, categories, indexes=None, version=0, fingerprint=None, path=None):
+        self.columns = columns
+        self.categories = categories
+        self.n_rows = len(columns['report_id'])
+        # Snapshot directory the columns are mapped from, if any
+        self.path = path
+        # Bumped by every append; lets caches key on the dataset contents
+        self.version = version
+        self._fingerprint = fingerprint
+
+        weeks = categories['week']
+        self.week_start = np.array([w.split('/')[0] for w in weeks], dtype='datetime64[D]')
+        self.week_end = np.array([w.split('/')[-1] for w in weeks], dtype='datetime64[D]')
+
+        self._lookup = {
+            name: {str(value).lower(): code for code, value in enumerate(values)}
+            for name, values in self.categories.items()
+        }
+        if indexes is None:
+            indexes = {
+                name: _build_index(self.columns[name], len(self.categories[name]))
+                for name in INDEXED_COLUMNS
+            }
+        self.indexes = indexes
+        self._sorted_report_ids = None
+
+    @property
+    def fingerprint(self):
+        """
+        Hash of the contents. Unlike `version`, which restarts at 0 in every
+        process, equal fingerprints mean equal data across processes and
+        restarts. Computed on first use unless given (snapshots store it).
+        """
+        if self._fingerprint is None:
+            h = hashlib.sha256()
+            for name in sorted(self.columns):
+                h.update(name.encode())
+                h.update(np.ascontiguousarray(self.columns[name]).tobytes())
+                if name in self.categories:
+                    h.update('\0'.join(self.categories[name]).encode())
+            self._fingerprint = h.hexdigest()[:16]
+        return self._fingerprint
+
+    @staticmethod
+    def _prepare(df):
+        # Month of a week is the month its first day falls in, e.g. '2023-01'
+        week = df['week'].astype(str)
+        return df.assign(week=week, month=week.str[:7])
+
+    @classmethod
+    def from_frame(cls, df):
+        df = cls._prepare(df)
+        columns = {}
+        categories = {}
+        for name in CATEGORICAL_COLUMNS + DERIVED_COLUMNS:
+            cat = pd.Categorical(df[name].astype(str))
+            columns[name] = cat.codes.astype(np.int32)
+            categories[name] = [str(c) for c in cat.categories]
+        for name in FLOAT_COLUMNS:
+            columns[name] = df[name].to_numpy(dtype=np.float32)
+        for name in INT_COLUMNS:
+            columns[name] = df[name].to_numpy(dtype=INT_DTYPES.get(name, np.int32))
+        return cls(columns, categories)
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Like from_frame, from a dict of column arrays (strings for the
+        categorical columns), without building a DataFrame first.
+        """
+        arrays = dict(arrays, month=np.asarray(arrays['week'], dtype=str).astype('<U7'))
+        columns = {}
+        categories = {}
+        for name in CATEGORICAL_COLUMNS + DERIVED_COLUMNS:
+            values, codes = np.unique(np.asarray(arrays[name], dtype=str), return_inverse=True)
+            columns[name] = codes.astype(np.int32)
+            categories[name] = values.tolist()
+        for name in FLOAT_COLUMNS:
+            columns[name] = np.asarray(arrays[name], dtype=np.float32)
+        for name in INT_COLUMNS:
+            columns[name] = np.asarray(arrays[name], dtype=INT_DTYPES.get(name, np.int32))
+        return cls(columns, categories)
+
+    def append(self, df):
+        """
+        Return a new store with the rows of `df` appended. Existing columns are
+        extended rather than rebuilt: category codes are only remapped when new
+        categories appear (to keep them sorted), and indexes only gain the new
+        row ids of the categories those rows touch.
+        """
+        df = self._prepare(df)
+        new_ids = np.arange(self.n_rows, self.n_rows + len(df), dtype=np.int64)
+        columns = {}
+        categories = {}
+        indexes = {}
+        for name in CATEGORICAL_COLUMNS + DERIVED_COLUMNS:
+            old_categories = self.categories[name]
+            values = df[name].to_numpy(dtype=object)
+            merged = sorted(set(old_categories).union(pd.unique(values).tolist()))
+            old_codes = self.columns[name]
+            remap = None
+            if len(merged) != len(old_categories):
+                position = {value: code for code, value in enumerate(merged)}
+                remap = np.array([position[value] for value in old_categories], dtype=np.int32)
+                old_codes = remap[old_codes]
+            added_codes = pd.Categorical(values, categories=merged).codes.astype(np.int32)
+            columns[name] = np.concatenate([old_codes, added_codes])
+            categories[name] = merged
+            if name in INDEXED_COLUMNS:
+                index = [_EMPTY_ROWS] * len(merged)
+                for code, rows in enumerate(self.indexes[name]):
+                    index[code if remap is None else remap[code]] = rows
+                for code in np.unique(added_codes).tolist():
+                    index[code] = np.concatenate([index[code], new_ids[added_codes == code]])
+                indexes[name] = index
+        for name in FLOAT_COLUMNS:
+            columns[name] = np.concatenate([self.columns[name], df[name].to_numpy(dtype=np.float32)])
+        for name in INT_COLUMNS:
+            dtype = INT_DTYPES.get(name, np.int32)
+            columns[name] = np.concatenate([self.columns[name], df[name].to_numpy(dtype=dtype)])
+        # Chained from this store's fingerprint, so appending costs a hash of
+        # the new rows only
+        h = hashlib.sha256(self.fingerprint.encode())
+        h.update(pd.util.hash_pandas_object(df[COLUMNS], index=False).to_numpy().tobytes())
+        store = DataStore(columns, categories, indexes, version=self.version + 1, fingerprint=h.hexdigest()[:16])
+        if self._sorted_report_ids is not None:
+            added_ids = np.sort(columns['report_id'][self.n_rows:])
+            store._sorted_report_ids = np.insert(
+                self._sorted_report_ids, np.searchsorted(self._sorted_report_ids, added_ids), added_ids)
+        return store
+
+    def sorted_report_ids(self):
+        if self._sorted_report_ids is None:
+            self._sorted_report_ids = np.sort(self.columns['report_id'])
+        return self._sorted_report_ids
+
+    def has_report_ids(self, report_ids):
+        """Boolean mask of which `report_ids` are already in the store."""
+        return isin_sorted(self.sorted_report_ids(), report_ids)
+
+    def code(self, column, value):
+        """Category code of `value` (case-insensitive), or None if absent."""
+        return self._lookup[column].get(str(value).lower())
+
+    def rows(self, **filters):
+        """
+        Sorted row ids matching every `column=value` filter on an indexed
+        column. A value may be a single category or a list of categories.
+        """
+        result = None
+        for column, value in filters.items():
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            # Values may repeat or differ only in case; each index is disjoint
+            # from the others, so one per distinct code keeps the rows unique
+            codes = {self.code(column, v) for v in values} - {None}
+            parts = [self.indexes[column][code] for code in sorted(codes)]
+            if not parts:
+                return np.zeros(0, dtype=np.int64)
+            matched = parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+            result = matched if result is None else np.intersect1d(result, matched, assume_unique=True)
+        if result is None:
+            return np.arange(self.n_rows, dtype=np.int64)
+        return result
+
+    def weeks_between(self, start=None, end=None):
+        """Week categories overlapping the inclusive date range [start, end]."""
+        overlaps = np.ones(len(self.week_start), dtype=bool)
+        if start:
+            overlaps &= self.week_end >= np.datetime64(start, 'D')
+        if end:
+            overlaps &= self.week_start <= np.datetime64(end, 'D')
+        return [self.categories['week'][code] for code in np.flatnonzero(overlaps)]
+
+    def group_sum(self, key, column, rows=None):
+        """Per-category sums of `column` grouped by the categorical `key`."""
+        codes = self.columns[key]
+        values = self.columns[column]
+        if rows is not None:
+            codes = codes[rows]
+            values = values[rows]
+        return np.bincount(codes, weights=values.astype(np.float64), minlength=len(self.categories[key]))
+
+    def group_count(self, key, rows=None):
+        codes = self.columns[key] if rows is None else self.columns[key][rows]
+        return np.bincount(codes, minlength=len(self.categories[key]))
+
+    def to_frame(self, rows=None):
+        """Rebuild a DataFrame in the original CSV schema for the given rows."""
+        data = {}
+        for name in COLUMNS:
+            values = self.columns[name] if rows is None else self.columns[name][rows]
+            if name in CATEGORICAL_COLUMNS:
+                values = np.asarray(self.categories[name], dtype=object)[values]
+            data[name] = values
+        return pd.DataFrame(data, columns=COLUMNS)
+
+
+def isin_sorted(sorted_ids, report_ids):
+    """Boolean mask of which `report_ids` are in the sorted array `sorted_ids`."""
+    ids = np.asarray(report_ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.zeros(len(ids), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return sorted_ids[pos] == ids
+
+
+_data_store = None
+_data_store_lock = threading.Lock()
+
+
+def publish_data_store(store):
+    """Make `store` the current store; readers holding the previous one are unaffected."""
+    global _data_store
+    _data_store = store
+
+
+def loaded_data_store():
+    """The current store if this process has loaded one, else None (never loads it)."""
+    return _data_store
+
+
+def get_data_store():
+    global _data_store
+    if _data_store is None:
+        with _data_store_lock:
+            if _data_store is None:
+                # Memory-mapped from the snapshot when one matches the CSVs
+                from snapshot import load_snapshot
+                _data_store = load_snapshot()
+    return _data_store
@@ -0,0 +1,200 @@
+"""
+Multi-week case forecasts for every (county, disease) weekly series.
+
+Each series is modelled on log1p(cases) with damped-trend exponential
+smoothing: the error-correction form of ETS(A,Ad,N). The smoothing
+parameters are fitted per series by picking the best one-step squared error
+over PARAM_GRID. The recursion runs for all series and all grid points at
+once as (series, grid) arrays, one vectorized step per week. Full refits
+of many series are split across a process pool.
+
+The fitted state (level, trend, error sums) is kept together with a
+checkpoint taken just before the last week. Appending a new week, or more
+rows for the latest week, resumes from that checkpoint instead of refitting
+the whole history. Forecast intervals use the ETS h-step variance and are
+mapped back through expm1, so they are never negative.
+"""
+import itertools
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from statistics import NormalDist
+
+import numpy as np
+
+from config import FORECAST_WORKERS
+from data_store import get_data_store
+from weekly_series import WeeklySeries
+
+# Damping of the trend per week ahead
+PHI = 0.9
+# (alpha, beta) candidates; beta is a fraction of alpha so the trend never
+# reacts faster than the level
+PARAM_GRID = np.array([
+    (alpha, alpha * fraction)
+    for alpha, fraction in itertools.product([0.1, 0.2, 0.3, 0.5, 0.7, 0.9], [0.0, 0.05, 0.1, 0.2])
+])
+MAX_HORIZON = 8
+# Weeks with reports a series needs before it gets forecasts
+MIN_FIT_WEEKS = 8
+# Full refits of at least this many series go through the process pool
+PARALLEL_MIN_SERIES = 512
+
+STATE_FIELDS = ('level', 'trend', 'sse', 'n', 'started')
+
+
+def initial_state(n_series):
+    shape = (n_series, len(PARAM_GRID))
+    return {
+        'level': np.zeros(shape),
+        'trend': np.zeros(shape),
+        'sse': np.zeros(shape),
+        'n': np.zeros(shape, dtype=np.int64),
+        'started': np.zeros(shape, dtype=bool),
+    }
+
+
+def run(state, Y):
+    """Advance `state` through the columns of Y (log1p cases, NaN = no reports)."""
+    state = {name: values.copy() for name, values in state.items()}
+    alpha = PARAM_GRID[:, 0]
+    beta = PARAM_GRID[:, 1]
+    for t in range(Y.shape[1]):
+        y = Y[:, t, None]
+        observed = ~np.isnan(y)
+        started = state['started']
+        update = observed & started
+        init = observed & ~started
+        predicted = state['level'] + PHI * state['trend']
+        error = np.where(update, y - predicted, 0.0)
+        state['sse'] += error ** 2
+        state['n'] += update
+        # Without an observation the level follows the damped trend
+        state['level'] = np.where(init, y, predicted + alpha * error)
+        state['trend'] = np.where(init, 0.0, PHI * state['trend'] + beta * error)
+        state['started'] = started | observed
+    return state
+
+
+def fit(Y, state=None):
+    """
+    Run the recursion over all of Y from `state` (the initial state if None).
+    Returns (checkpoint, state), where checkpoint is the state before the
+    last column.
+    """
+    state = initial_state(len(Y)) if state is None else state
+    checkpoint = run(state, Y[:, :-1])
+    return checkpoint, run(checkpoint, Y[:, -1:])
+
+
+def _fit_parallel(Y, workers):
+    chunks = np.array_split(np.arange(len(Y)), workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(fit, [Y[rows] for rows in chunks]))
+    return tuple(
+        {name: np.concatenate([part[i][name] for part in parts]) for name in STATE_FIELDS}
+        for i in (0, 1)
+    )
+
+
+class ForecastEngine:
+    """Fitted smoothing state of every series, kept in step with the data store."""
+
+    def __init__(self, workers=None):
+        self.data = WeeklySeries()
+        self.workers = workers or FORECAST_WORKERS or os.cpu_count() or 1
+        self.state = None
+        self.checkpoint = None
+        self._lock = threading.Lock()
+
+    @property
+    def store_version(self):
+        return self.data.store_version
+
+    def update(self, store):
+        with self._lock:
+            n_weeks = len(self.data.weeks)
+            n_series = len(self.data.series)
+            change = self.data.sync(store)
+            if change is None:
+                return
+            first, moved = change
+            Y = np.log1p(self.data.values())
+            # Weeks only appended after the old axis, same series: resume
+            # from the checkpoint before the previous last week
+            resumable = (
+                self.state is not None and n_weeks and first >= n_weeks - 1
+                and len(self.data.series) == n_series
+                and (moved is None or np.array_equal(moved[1], np.arange(n_weeks)))
+            )
+            if resumable:
+                self.checkpoint, self.state = fit(Y[:, n_weeks - 1:], self.checkpoint)
+            elif self.workers > 1 and len(Y) >= PARALLEL_MIN_SERIES:
+                self.checkpoint, self.state = _fit_parallel(Y, min(self.workers, len(Y)))
+            else:
+                self.checkpoint, self.state = fit(Y)
+
+    def forecast(self, county, disease, horizon=4, interval=0.95):
+        """
+        Projections for the `horizon` weeks after the last week in the data.
+        Raises KeyError for an unknown series and ValueError when it has too
+        little history.
+        """
+        with self._lock:
+            data = self.data
+            key = next((k for k in data.series if k[0].lower() == county.lower() and k[1] == disease.lower()), None)
+            if key is None:
+                raise KeyError(f'No data for {county} / {disease}')
+            i = data.series.index(key)
+            n = int(self.state['n'][i, 0])
+            if n + 1 < MIN_FIT_WEEKS:
+                raise ValueError(f'{county} / {disease} has only {n + 1} weeks with reports')
+            g = int(np.argmin(self.state['sse'][i]))
+            alpha, beta = PARAM_GRID[g]
+            level = self.state['level'][i, g]
+            trend = self.state['trend'][i, g]
+            sigma2 = self.state['sse'][i, g] / max(n - 2, 1)
+            last_end = data.week_end[-1].astype(object)
+            last_week = data.weeks[-1]
+
+        h = np.arange(1, horizon + 1)
+        damped = np.cumsum(PHI ** h)
+        mean = level + damped * trend
+        # h-step variance of ETS(A,Ad,N): sigma^2 (1 + sum_{j<h} c_j^2)
+        c = alpha + beta * PHI * (1 - PHI ** h[:-1]) / (1 - PHI)
+        sd = np.sqrt(sigma2 * (1 + np.concatenate([[0.0], np.cumsum(c ** 2)])))
+        z = NormalDist().inv_cdf(0.5 + interval / 2)
+        points = []
+        for step, m, s in zip(h.tolist(), mean.tolist(), sd.tolist()):
+            start = last_end + timedelta(days=7 * step - 6)
+            end = last_end + timedelta(days=7 * step)
+            points.append({
+                'week': f'{start.isoformat()}/{end.isoformat()}',
+                'cases': round(float(np.expm1(max(m, 0.0))), 2),
+                'lower': round(float(np.expm1(max(m - z * s, 0.0))), 2),
+                'upper': round(float(np.expm1(max(m + z * s, 0.0))), 2),
+            })
+        return {
+            'county': key[0],
+            'disease': key[1],
+            'last_week': last_week,
+            'interval': interval,
+            'model': {'alpha': round(float(alpha), 4), 'beta': round(float(beta), 4), 'phi': PHI, 'weeks_fitted': n + 1},
+            'forecast': points,
+        }
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_forecast_engine():
+    """The shared engine, caught up with the current data store."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ForecastEngine()
+    _engine.update(get_data_store())
+    return _engine
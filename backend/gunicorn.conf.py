@@ -0,0 +1,36 @@
+# Gunicorn settings for the Flask backend; see wsgi.py.
+# Every value can be overridden through the environment.
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Threads per worker handle concurrent requests; NumPy scoring and file I/O
+# release the GIL, and slow work is bounded by the scoring and PDF pools
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+# Load models and data once in the master, shared copy-on-write by workers
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+# Restart workers now and then to bound any slow growth in memory
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def when_ready(server):
+    # Build reports (and their PDFs) once, in a separate process, instead of
+    # in every worker
+    if os.environ.get('BUILD_REPORTS_ON_START', '1') == '1':
+        subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, 'report_builder.py'), '--pdf'], cwd=BACKEND_DIR)
+
+
+def post_fork(server, worker):
+    # Threads don't survive fork, so each worker starts its own model watcher
+    from app import start_background_tasks
+    start_background_tasks(build_reports=False)
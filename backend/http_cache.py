@@ -0,0 +1,173 @@
+"""
+Conditional GETs and compressed response bodies cached per data version.
+
+@versioned(tag) wraps a view whose body depends only on its URL and a
+version string tag() (e.g. the dataset version, or the report manifest
+version). Responses get a strong ETag built from that version and
+Cache-Control; a request whose If-None-Match still matches is answered 304
+before the view runs. Successful bodies are kept in memory per URL and
+representation, and gzip/brotli variants are compressed once per version,
+so repeated polls never rebuild or recompress the same body.
+
+Streamed responses are passed through with their ETag but not cached; views
+stream only bodies too large to keep (see OUTBREAK_CACHE_MAX_ROWS). A body
+rendered while the version changed is neither tagged nor cached.
+"""
+import functools
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request, make_response
+
+from config import DATA_MODE, HTTP_CACHE_MAX_AGE, HTTP_CACHE_MAX_BYTES, HTTP_COMPRESS_MIN_BYTES
+from data_store import get_data_store
+from model_utils import MODEL_FEATURES, model_registry
+from partitions import get_dataset
+from report_catalog import manifest_version
+
+try:
+    import brotli
+except ImportError:  # Optional; gzip only without it
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def _encodings():
+    return (['br'] if brotli is not None else []) + ['gzip']
+
+
+class BodyCache:
+    """LRU of encoded response bodies, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, etag, value):
+        if len(value[0]) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1][0])
+            self._entries[key] = (etag, value)
+            self._size += len(value[0])
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+body_cache = BodyCache(HTTP_CACHE_MAX_BYTES)
+
+
+def dataset_tag():
+    """
+    Version of the current data store. In chunked mode, that of the
+    partitions, so computing it never loads the full store.
+    """
+    if DATA_MODE == 'chunked':
+        dataset = get_dataset()
+        return f'p{dataset.version}-{dataset.fingerprint}'
+    store = get_data_store()
+    return f'd{store.version}-{store.fingerprint}'
+
+
+def dataset_and_models_tag():
+    """Version of the data store and of the models (for responses with risk scores)."""
+    models = '.'.join(model_registry.version(name)[:8] for name in MODEL_FEATURES)
+    return f'{dataset_tag()}-m{models}'
+
+
+def manifest_tag():
+    version, digest = manifest_version()
+    return f'r{version}-{digest}'
+
+
+def _caching_headers(response, etag, vary):
+    response.headers['ETag'] = f'"{etag}"'
+    response.headers['Cache-Control'] = f'max-age={HTTP_CACHE_MAX_AGE}' if HTTP_CACHE_MAX_AGE else 'no-cache'
+    response.vary.update(vary)
+    return response
+
+
+def versioned(tag, variant=None):
+    """
+    Serve the decorated view through the body cache. `tag()` is the version
+    the response depends on; `variant()`, if given, names the representation
+    chosen for the request (e.g. from its Accept header) and may return None
+    to let the view answer on its own (e.g. with an error).
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            name = variant() if variant is not None else ''
+            if name is None:
+                return view(*args, **kwargs)
+            accepted = request.accept_encodings
+            encoding = next((e for e in _encodings() if accepted[e]), None)
+            version = tag()
+            base = version + (f'-{name}' if name else '')
+            vary = ['Accept-Encoding'] + (['Accept'] if variant is not None else [])
+
+            etag = base + (f'-{encoding}' if encoding else '')
+            # The client's copy is current whichever encoding it came in
+            if request.if_none_match.contains_weak(etag) or request.if_none_match.contains_weak(base):
+                return _caching_headers(make_response('', 304), etag, vary)
+
+            key = (request.full_path, name)
+            cached = body_cache.get((key, None), base)
+            if cached is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if tag() != version:
+                    # The data changed while the view ran, so the body may be
+                    # of either version: send it without an ETag, uncached
+                    return response
+                if response.is_streamed:
+                    return _caching_headers(response, base, vary)
+                # Headers set by the view (e.g. X-Next-Cursor) are replayed with the body
+                headers = [(k, v) for k, v in response.headers if k not in ('Content-Type', 'Content-Length')]
+                cached = (response.get_data(), response.mimetype, headers)
+                body_cache.put((key, None), base, cached)
+            body, mimetype, headers = cached
+
+            if encoding and len(body) >= HTTP_COMPRESS_MIN_BYTES:
+                compressed = body_cache.get((key, encoding), base)
+                if compressed is None:
+                    compressed = (_compress(body, encoding),)
+                    body_cache.put((key, encoding), base, compressed)
+                response = make_response(compressed[0])
+                response.headers['Content-Encoding'] = encoding
+            else:
+                etag = base
+                response = make_response(body)
+            response.mimetype = mimetype
+            response.headers.extend(headers)
+            return _caching_headers(response, etag, vary)
+        return wrapper
+    return decorate
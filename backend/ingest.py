@@ -0,0 +1,139 @@
+"""
+Append-only ingestion of report rows.
+
+A batch is validated, deduplicated on report_id, appended to INGEST_LOG_DIR
+and then applied in memory without reloading anything: a new DataStore is
+built by appending to the current one, the aggregates fold in only the new
+rows under their own lock, and in chunked mode the rows also join their
+month partitions in memory. The new store is published with a single
+reference swap after everything derived from it, and the partitions'
+version changes last, so a reader that sees the new dataset version also
+sees everything derived from it. Batches are applied one at a time.
+
+In chunked mode batches are deduplicated against the partitions' report
+ids, and the full store is only appended to if this process has loaded it
+(e.g. for /data/outbreak); otherwise it is built from the ingest log when
+first needed.
+"""
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from aggregates import get_aggregates
+from config import DATA_MODE
+from data_store import (COLUMNS, CATEGORICAL_COLUMNS, FLOAT_COLUMNS, INT_COLUMNS, DataStore, get_data_store,
+                        loaded_data_store, publish_data_store)
+from model_utils import INGEST_LOG_DIR, append_csv_data
+from partitions import add_ingested, get_dataset
+
+WEEK_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}/\d{4}-\d{2}-\d{2}$')
+
+_ingest_lock = threading.Lock()
+
+
+class IngestError(ValueError):
+    """The batch as a whole is malformed."""
+
+
+def validate_rows(rows):
+    """
+    Split a list of row dicts into a DataFrame of valid rows (in COLUMNS
+    order) and a list of {'index', 'error'} entries for rejected rows.
+    """
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise IngestError('Expected a JSON array of row objects')
+    df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+    errors = np.full(len(df), None, dtype=object)
+    rejected = np.zeros(len(df), dtype=bool)
+
+    def reject(mask, message):
+        mask = np.asarray(mask, dtype=bool) & ~rejected
+        errors[mask] = message
+        rejected[mask] = True
+
+    for name in COLUMNS:
+        reject(df[name].isna(), f'Missing {name}')
+    for name in INT_COLUMNS + FLOAT_COLUMNS:
+        values = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=np.float64)
+        reject(np.isnan(values), f'{name} must be a number')
+        df[name] = values
+    for name in INT_COLUMNS:
+        reject(df[name].to_numpy() % 1 != 0, f'{name} must be an integer')
+    reject(~np.isin(df['outbreak'].to_numpy(), [0, 1]), 'outbreak must be 0 or 1')
+    # String checks run once per distinct value rather than once per row
+    for name in CATEGORICAL_COLUMNS:
+        codes, uniques = pd.factorize(df[name])
+        cleaned = np.array([str(u).strip() for u in uniques] + [''], dtype=object)
+        df[name] = cleaned[codes]
+        reject(cleaned[codes] == '', f'{name} must not be empty')
+        if name == 'week':
+            malformed = np.array([not WEEK_PATTERN.match(u) for u in cleaned])
+            reject(malformed[codes], 'week must look like YYYY-MM-DD/YYYY-MM-DD')
+
+    valid = df[~rejected].copy()
+    for name in INT_COLUMNS:
+        valid[name] = valid[name].astype(np.int64)
+    return valid.reset_index(drop=True), [
+        {'index': int(i), 'error': errors[i]} for i in np.flatnonzero(rejected)
+    ]
+
+
+def append_to_log(df):
+    """
+    Persist a batch as the next numbered segment in INGEST_LOG_DIR. Segments
+    are uncompressed .npz column sets: writing one costs a memcpy per column,
+    not per-value text formatting.
+    """
+    os.makedirs(INGEST_LOG_DIR, exist_ok=True)
+    segments = sorted(f for f in os.listdir(INGEST_LOG_DIR) if f.endswith('.npz'))
+    number = int(segments[-1][:-4]) + 1 if segments else 1
+    path = os.path.join(INGEST_LOG_DIR, f'{number:08d}.npz')
+    tmp_path = f'{path}.tmp'
+    arrays = {name: df[name].to_numpy(dtype=str if name in CATEGORICAL_COLUMNS else None) for name in COLUMNS}
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def ingest_rows(rows):
+    """Validate, deduplicate and apply one batch. Returns a summary dict."""
+    valid, rejected = validate_rows(rows)
+    with _ingest_lock:
+        if DATA_MODE == 'chunked':
+            store = loaded_data_store()
+            dataset = get_dataset()
+        else:
+            store = dataset = get_data_store()
+        duplicate = valid['report_id'].duplicated().to_numpy() | dataset.has_report_ids(valid['report_id'])
+        new_rows = valid[~duplicate].reset_index(drop=True)
+        if len(new_rows):
+            append_to_log(new_rows)
+            if store is not None:
+                new_store = store.append(new_rows)
+                added = np.arange(store.n_rows, new_store.n_rows)
+            else:
+                new_store = DataStore.from_frame(new_rows)
+                added = np.arange(new_store.n_rows)
+            get_aggregates().add_rows(new_store, added)
+            append_csv_data(new_rows)
+            # Last: the dataset version (the store's, or in chunked mode the
+            # partitions') is what cached responses are tagged with, so it
+            # must not change before what they read from has
+            if store is not None:
+                publish_data_store(new_store)
+            add_ingested(new_rows)
+        if DATA_MODE != 'chunked':
+            dataset = get_data_store()
+        version, total_rows = dataset.version, dataset.n_rows
+    return {
+        'accepted': int(len(new_rows)),
+        'duplicates': int(duplicate.sum()),
+        'rejected': rejected,
+        'dataset_version': version,
+        'total_rows': total_rows,
+    }
@@ -0,0 +1,162 @@
+"""
+Request timing, sampled request logs and the per-request profiler hook.
+
+instrument(app) records every request in http_request_duration_seconds
+once its body has been sent (so streamed responses count in full) and the
+time spent serializing JSON bodies in response_encode_seconds. Errors and
+slow requests are always logged; other requests are logged at
+REQUEST_LOG_SAMPLE_RATE.
+
+With PROFILING_ENABLED, a request carrying `X-Profile: 1` runs under
+cProfile (`X-Profile: pyinstrument` uses pyinstrument if it is installed).
+The profile is written to PROFILE_DIR, its path returned in the
+X-Profile-Path header and its top functions logged. Only one request is
+profiled at a time, and a streamed body is not part of the profile.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+from config import PROFILING_ENABLED, PROFILE_DIR, REQUEST_LOG_SAMPLE_RATE, SLOW_REQUEST_SECONDS
+from metrics import HTTP_REQUEST_SECONDS, RESPONSE_ENCODE_SECONDS
+from serializers import FastJSONProvider
+
+logger = logging.getLogger(__name__)
+
+# Functions listed in the log line of a profiled request
+PROFILE_TOP_FUNCTIONS = 15
+
+_profile_lock = threading.Lock()
+
+
+def endpoint_label():
+    """Route pattern of the current request, so label values stay few."""
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+class TimedJSONProvider(FastJSONProvider):
+    """FastJSONProvider, timing every JSON response it builds."""
+
+    def response(self, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().response(*args, **kwargs)
+        RESPONSE_ENCODE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint_label())
+        return response
+
+
+def timed_body(chunks):
+    """Yield from a streamed body, observing the time spent producing it once it ends."""
+    endpoint = endpoint_label()
+    seconds = 0.0
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        seconds += time.perf_counter() - start
+        if chunk is None:
+            break
+        yield chunk
+    RESPONSE_ENCODE_SECONDS.observe(seconds, endpoint=endpoint)
+
+
+def _request_finished(endpoint, method, path, status, start):
+    elapsed = time.perf_counter() - start
+    HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=method, status=status)
+    slow = elapsed >= SLOW_REQUEST_SECONDS
+    if status >= 500 or slow or random.random() < REQUEST_LOG_SAMPLE_RATE:
+        fields = {'method': method, 'path': path, 'status': status, 'ms': round(elapsed * 1000, 2)}
+        logger.log(logging.WARNING if status >= 500 or slow else logging.INFO, 'request', extra={'fields': fields})
+
+
+def _start_profile():
+    mode = request.headers.get('X-Profile')
+    if not mode or not _profile_lock.acquire(blocking=False):
+        return
+    try:
+        if mode == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+                profiler = Profiler()
+                profiler.start()
+                g.profile = ('pyinstrument', profiler)
+                return
+            except ImportError:
+                logger.warning('pyinstrument is not installed; profiling with cProfile')
+        profiler = cProfile.Profile()
+        profiler.enable()
+        g.profile = ('cprofile', profiler)
+    except BaseException:
+        _profile_lock.release()
+        raise
+
+
+def _stop_profile():
+    """Stop the request's profiler, if any; returns the file it was saved to."""
+    kind, profiler = g.pop('profile', (None, None))
+    if profiler is None:
+        return None
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = '{}-{}-{}'.format(
+            datetime.now().strftime('%Y%m%dT%H%M%S'),
+            endpoint_label().strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'index',
+            threading.get_ident(),
+        )
+        if kind == 'pyinstrument':
+            profiler.stop()
+            path = os.path.join(PROFILE_DIR, stem + '.html')
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+            summary = profiler.output_text()
+        else:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, stem + '.prof')
+            profiler.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            summary = out.getvalue()
+    finally:
+        _profile_lock.release()
+    logger.info('profile', extra={'fields': {'path': request.path, 'file': path, 'stats': summary}})
+    return path
+
+
+def instrument(app):
+    """Install the timing hooks, the timed JSON provider and the profiler hook on `app`."""
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        if PROFILING_ENABLED:
+            _start_profile()
+
+    @app.after_request
+    def record_request(response):
+        if PROFILING_ENABLED:
+            path = _stop_profile()
+            if path is not None:
+                response.headers['X-Profile-Path'] = path
+        start = g.get('request_start')
+        if start is not None:
+            # The request context is gone by the time the body is closed
+            args = (endpoint_label(), request.method, request.path, response.status_code, start)
+            response.call_on_close(lambda: _request_finished(*args))
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc=None):
+        # A request that failed before after_request still releases the profiler
+        if PROFILING_ENABLED and 'profile' in g:
+            _stop_profile()
+
+    return app
@@ -0,0 +1,91 @@
+"""
+Leveled logging that never blocks a request on stderr.
+
+Loggers only put records on an in-memory queue; a listener thread formats
+them as one key=value line each and writes them out. Extra fields go in
+`extra={'fields': {...}}`.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL
+
+_handler = None
+_listener = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _quote(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "=\n'):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    return text
+
+
+class KeyValueFormatter(logging.Formatter):
+    """`ts=... level=... logger=... msg=...` followed by the record's fields."""
+
+    def format(self, record):
+        parts = [
+            ('ts', datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')),
+            ('level', record.levelname.lower()),
+            ('logger', record.name),
+            ('msg', record.getMessage()),
+        ]
+        parts.extend(getattr(record, 'fields', {}).items())
+        if record.exc_text:
+            parts.append(('exc', record.exc_text))
+        return ' '.join(f'{key}={_quote(value)}' for key, value in parts)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Like QueueHandler.prepare, but the traceback stays out of the
+        # message so the formatter can put it in a field of its own
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Route the root logger through the queue. Safe to call repeatedly; in a
+    forked worker it starts a listener of its own, since the parent's thread
+    did not survive the fork.
+    """
+    global _handler, _listener, _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        root = logging.getLogger()
+        if _handler is not None:
+            root.removeHandler(_handler)
+        records = queue.SimpleQueue()
+        output = logging.StreamHandler()
+        output.setFormatter(KeyValueFormatter())
+        _listener = QueueListener(records, output)
+        _listener.start()
+        _handler = _QueueHandler(records)
+        root.addHandler(_handler)
+        root.setLevel(level)
+        if _pid is None:
+            atexit.register(_flush)
+        _pid = os.getpid()
+
+
+def _flush():
+    """Write out what is still queued (at interpreter exit)."""
+    with _lock:
+        if _listener is not None and _pid == os.getpid():
+            _listener.stop()
@@ -0,0 +1,185 @@
+"""
+Process-local metrics, exposed in the Prometheus text format (0.0.4) by
+GET /metrics.
+
+Counters and histograms are updated on the hot path, so an update is one
+dict lookup and a few additions under a lock; nothing is formatted until a
+scrape. Values that other modules already track (e.g. the prediction cache
+counters) are read at scrape time through collectors instead of being
+mirrored here.
+
+Every gunicorn worker keeps its own values; a scrape sees the worker that
+answered it, identified by the `pid` in process_info.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; spans a cached prediction (~100 us) to a cold PDF render
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + pairs + '}'
+
+
+def _value_text(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, tuple(zip(self.labels, key)), value
+
+
+class Histogram:
+    """Bucketed observations (cumulative on output) plus their sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label key -> [per-bucket counts (last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the `with` block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('le', _value_text(float(bound))),), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collect):
+        """
+        Register `collect()`, called on every scrape. It returns an iterable
+        of (name, type, help, samples) with samples as (labels dict, value).
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_label_text(labels)} {_value_text(value)}')
+        for collect in collectors:
+            for name, kind, help, samples in collect():
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_label_text(sorted(labels.items()))} {_value_text(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time from request start until the response body was sent.',
+    ('endpoint', 'method', 'status'))
+RESPONSE_ENCODE_SECONDS = REGISTRY.histogram(
+    'response_encode_seconds', 'Time spent serializing JSON response bodies.', ('endpoint',))
+MODEL_INFERENCE_SECONDS = REGISTRY.histogram(
+    'model_inference_seconds', 'Time spent in one model scoring call.', ('model', 'backend'))
+MODEL_INFERENCE_ROWS = REGISTRY.counter(
+    'model_inference_rows_total', 'Feature rows scored by the models.', ('model',))
+PREDICT_BATCH_SIZE = REGISTRY.histogram(
+    'predict_batch_size', 'Items per /predict/batch request.', buckets=SIZE_BUCKETS)
+DATA_LOAD_SECONDS = REGISTRY.histogram(
+    'data_load_seconds', 'Time to load the dataset into memory.', ('source',))
+REPORT_BUILD_SECONDS = REGISTRY.histogram(
+    'report_build_seconds', 'Time of one CSV report build.')
+REPORTS_WRITTEN = REGISTRY.counter(
+    'reports_written_total', 'CSV reports rewritten by report builds.')
+PDF_RENDER_SECONDS = REGISTRY.histogram(
+    'pdf_render_seconds', 'Time to render one PDF report.')
+
+
+def _process_info():
+    yield 'process_info', 'gauge', 'Serving process; pid tells gunicorn workers apart.', [({'pid': os.getpid()}, 1)]
+
+
+REGISTRY.add_collector(_process_info)
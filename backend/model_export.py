@@ -0,0 +1,250 @@
+"""
+Compiles fitted binary classifiers into NumPy-only scoring kernels.
+
+A kernel is a callable mapping a 2-D feature matrix to P(class 1), the same
+values as `model.predict_proba(X)[:, 1]`, without going through sklearn's or
+XGBoost's input validation:
+
+  - linear/logistic models become a coefficient vector and an intercept;
+  - tree ensembles (XGBoost gbtree, sklearn decision trees and forests)
+    become flattened node arrays walked for all rows at once;
+  - tree ensembles over few features are further tabulated: every split
+    threshold of a feature cuts its axis into bins, the ensemble is constant
+    on each cell of the resulting grid, so scoring is one searchsorted per
+    feature plus a table lookup.
+
+Usage (from the backend directory) to check parity on the full CSV:
+    python model_export.py
+"""
+import json
+import sys
+
+import numpy as np
+
+# Tabulate tree ensembles whose threshold grid has at most this many cells
+MAX_TABLE_CELLS = 1 << 22
+# Rows walked through the trees per chunk, bounding the (rows, trees) arrays
+TRAVERSAL_CHUNK_ROWS = 1 << 15
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class LinearKernel:
+    def __init__(self, coef, intercept):
+        self.coef = np.asarray(coef, dtype=np.float64).ravel()
+        self.intercept = float(intercept)
+
+    def __call__(self, X):
+        return _sigmoid(np.asarray(X, dtype=np.float64) @ self.coef + self.intercept)
+
+
+class TreeEnsembleKernel:
+    """
+    All trees of an ensemble flattened into shared node arrays.
+
+    Leaves point at themselves through an infinite threshold, so every row
+    takes exactly `depth` steps and no per-step leaf masks are needed. Leaf
+    outputs are either summed into a logistic margin (boosting) or averaged
+    as probabilities (forests).
+    """
+
+    def __init__(self, feature, threshold, left, right, default_left, value, roots, depth,
+                 n_features, base_margin=0.0, link='logistic', strict=True, input_dtype=np.float32):
+        self.feature = np.asarray(feature, dtype=np.intp)
+        self.threshold = np.asarray(threshold)
+        self.left = np.asarray(left, dtype=np.intp)
+        self.right = np.asarray(right, dtype=np.intp)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.depth = int(depth)
+        self.n_features = int(n_features)
+        self.base_margin = float(base_margin)
+        self.link = link
+        # XGBoost sends x < threshold left, sklearn x <= threshold
+        self.strict = strict
+        self.input_dtype = input_dtype
+
+    def _walk(self, X):
+        node = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            x = np.take_along_axis(X, self.feature[node], axis=1)
+            threshold = self.threshold[node]
+            go_left = x < threshold if self.strict else x <= threshold
+            go_left = np.where(np.isnan(x), self.default_left[node], go_left)
+            node = np.where(go_left, self.left[node], self.right[node])
+        total = self.value[node].sum(axis=1)
+        if self.link == 'logistic':
+            return _sigmoid(total + self.base_margin)
+        return total / len(self.roots)
+
+    def __call__(self, X):
+        X = np.asarray(X, dtype=self.input_dtype)
+        out = np.empty(len(X))
+        for start in range(0, len(X), TRAVERSAL_CHUNK_ROWS):
+            out[start:start + TRAVERSAL_CHUNK_ROWS] = self._walk(X[start:start + TRAVERSAL_CHUNK_ROWS])
+        return out
+
+    def tabulate(self, max_cells=MAX_TABLE_CELLS):
+        """Return an equivalent TableKernel, or None if its grid would be too large."""
+        internal = self.left != np.arange(len(self.left))
+        cuts = [np.unique(self.threshold[internal & (self.feature == f)]) for f in range(self.n_features)]
+        if np.prod([len(c) + 1 for c in cuts], dtype=np.float64) > max_cells:
+            return None
+        # One representative input per bin, exactly representable in the
+        # input dtype: with strict splits bin b holds cuts[b-1] <= x < cuts[b]
+        # (take the lower edge), otherwise cuts[b-1] < x <= cuts[b] (the upper)
+        reps = []
+        for c in cuts:
+            r = c.astype(self.input_dtype)
+            if self.strict:
+                r = np.where(r < c, np.nextafter(r, self.input_dtype(np.inf)), r)
+                reps.append(np.concatenate([[-np.inf], r]).astype(self.input_dtype))
+            else:
+                r = np.where(r > c, np.nextafter(r, self.input_dtype(-np.inf)), r)
+                reps.append(np.concatenate([r, [np.inf]]).astype(self.input_dtype))
+        grid = np.stack([g.ravel() for g in np.meshgrid(*reps, indexing='ij')], axis=1)
+        table = self(grid)
+        return TableKernel(cuts, table, self)
+
+
+class TableKernel:
+    """Tree ensemble precomputed on its threshold grid; NaN rows fall back to `exact`."""
+
+    def __init__(self, cuts, table, exact):
+        self.cuts = cuts
+        self.shape = tuple(len(c) + 1 for c in cuts)
+        self.table = table
+        self.exact = exact
+        self.side = 'right' if exact.strict else 'left'
+        self.input_dtype = exact.input_dtype
+
+    def __call__(self, X):
+        X = np.asarray(X, dtype=self.input_dtype)
+        if X.ndim != 2 or X.shape[1] != len(self.cuts):
+            raise ValueError(f'Expected {len(self.cuts)} features, got shape {X.shape}')
+        bins = [np.searchsorted(c, X[:, f], side=self.side) for f, c in enumerate(self.cuts)]
+        out = self.table[np.ravel_multi_index(bins, self.shape)]
+        missing = np.isnan(X).any(axis=1)
+        if missing.any():
+            out[missing] = self.exact(X[missing])
+        return out
+
+
+def _tree_depths(left, right):
+    depth = np.zeros(len(left), dtype=np.intp)
+    for node in range(len(left)):
+        for child in (left[node], right[node]):
+            if child >= 0:
+                depth[child] = depth[node] + 1
+    return int(depth.max())
+
+
+def _flatten(trees, n_features, **kwargs):
+    """Join per-tree (feature, threshold, left, right, default_left, value) arrays."""
+    parts = {k: [] for k in ('feature', 'threshold', 'left', 'right', 'default_left', 'value')}
+    roots = []
+    depth = 0
+    offset = 0
+    for feature, threshold, left, right, default_left, value in trees:
+        n = len(left)
+        depth = max(depth, _tree_depths(left, right))
+        leaf = left < 0
+        own = np.arange(n) + offset
+        parts['feature'].append(np.where(leaf, 0, feature))
+        parts['threshold'].append(np.where(leaf, np.inf, threshold))
+        parts['left'].append(np.where(leaf, own, left + offset))
+        parts['right'].append(np.where(leaf, own, right + offset))
+        parts['default_left'].append(np.where(leaf, True, default_left))
+        parts['value'].append(np.where(leaf, value, 0.0))
+        roots.append(offset)
+        offset += n
+    arrays = {k: np.concatenate(v) for k, v in parts.items()}
+    return TreeEnsembleKernel(roots=roots, depth=depth, n_features=n_features, **arrays, **kwargs)
+
+
+def export_xgboost(model):
+    learner = json.loads(model.get_booster().save_raw('json'))['learner']
+    if learner['objective']['name'] != 'binary:logistic' or learner['gradient_booster']['name'] != 'gbtree':
+        raise TypeError('Only binary:logistic gbtree XGBoost models can be exported')
+    booster = learner['gradient_booster']['model']
+    trees = booster['trees']
+    best_iteration = getattr(model, 'best_iteration', None)
+    if best_iteration is not None:
+        trees = trees[:booster['iteration_indptr'][best_iteration + 1]]
+    flat = []
+    for tree in trees:
+        if any(tree['split_type']):
+            raise TypeError('Categorical splits are not supported')
+        # Leaf outputs are stored in split_conditions
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        flat.append((
+            np.asarray(tree['split_indices']), conditions,
+            np.asarray(tree['left_children']), np.asarray(tree['right_children']),
+            np.asarray(tree['default_left'], dtype=bool), conditions.astype(np.float64),
+        ))
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    n_features = int(learner['learner_model_param']['num_feature'])
+    return _flatten(flat, n_features, base_margin=np.log(base_score / (1.0 - base_score)),
+                    link='logistic', strict=True, input_dtype=np.float32)
+
+
+def _sklearn_tree_arrays(tree):
+    value = tree.value[:, 0, :]
+    proba = value[:, 1] / value.sum(axis=1)
+    default_left = getattr(tree, 'missing_go_to_left', np.ones(tree.node_count, dtype=bool))
+    return (tree.feature, tree.threshold, tree.children_left, tree.children_right,
+            np.asarray(default_left, dtype=bool), proba)
+
+
+def export_sklearn_trees(model):
+    estimators = model.estimators_ if hasattr(model, 'estimators_') else [model]
+    if any(len(getattr(e, 'classes_', model.classes_)) != 2 for e in estimators):
+        raise TypeError('Only binary tree classifiers can be exported')
+    flat = [_sklearn_tree_arrays(e.tree_) for e in estimators]
+    return _flatten(flat, model.n_features_in_, link='mean', strict=False, input_dtype=np.float32)
+
+
+def export_model(model):
+    """Compile `model` into a NumPy scoring kernel; raises TypeError if unsupported."""
+    if hasattr(model, 'get_booster'):
+        kernel = export_xgboost(model)
+    elif hasattr(model, 'coef_') and hasattr(model, 'intercept_'):
+        coef = np.asarray(model.coef_)
+        if coef.ndim == 2 and coef.shape[0] != 1:
+            raise TypeError('Only binary linear classifiers can be exported')
+        return LinearKernel(coef, np.ravel(model.intercept_)[0])
+    elif hasattr(model, 'tree_') or (isinstance(getattr(model, 'estimators_', None), list)
+                                     and all(hasattr(e, 'tree_') for e in model.estimators_)):
+        kernel = export_sklearn_trees(model)
+    else:
+        raise TypeError(f'Cannot export {type(model).__name__}')
+    return kernel.tabulate() or kernel
+
+
+def max_abs_error(model, kernel, X):
+    """Largest |kernel(X) - predict_proba(X)[:, 1]| over the rows of X."""
+    expected = model.predict_proba(X)[:, 1]
+    return float(np.max(np.abs(kernel(X) - expected))) if len(X) else 0.0
+
+
+def main():
+    from model_utils import get_csv_data, model_registry, KERNEL_TOLERANCE, MODEL_FEATURES
+
+    df = get_csv_data()
+    failed = False
+    for name, columns in MODEL_FEATURES.items():
+        entry = model_registry.entry(name)
+        X = df[columns].to_numpy(dtype=np.float64)
+        kernel = export_model(entry.model)
+        error = max_abs_error(entry.model, kernel, X)
+        status = 'ok' if error <= KERNEL_TOLERANCE else 'MISMATCH'
+        failed |= error > KERNEL_TOLERANCE
+        print(f'{name}: {type(kernel).__name__}, {len(X)} rows, max abs error {error:.3g} [{status}]')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
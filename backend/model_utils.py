@@ -1,44 +1,247 @@
 
+import hashlib
+import io
+import logging
 import os
+import threading
+import time
+
+import numpy as np
 import pandas as pd
-import joblib
+
+from metrics import DATA_LOAD_SECONDS, MODEL_INFERENCE_ROWS, MODEL_INFERENCE_SECONDS
+from model_export import export_model, max_abs_error
+
+logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 CHOLERA_MODEL_PATH = os.path.join(BASE_DIR, 'cholera_model.pkl')
 MALARIA_MODEL_PATH = os.path.join(BASE_DIR, 'malaria_model.pkl')
 
-CSV_DATA_PATH = os.path.join(BASE_DIR, 'simulated_outbreak_data_v15.csv')
-ADDED_CSV_DATA_PATH = os.path.join(BASE_DIR, 'added_county_data.csv')
+# Input columns of each model, in the order the model expects them
+MODEL_FEATURES = {
+	'cholera': ['unimproved_sanitation_rate', 'avg_rainfall'],
+	'malaria': ['mean_ndvi', 'avg_temp'],
+}
+
+# Directory of the dataset and everything derived from it; the models stay
+# in BASE_DIR (the benchmarks point this at synthetic datasets)
+DATA_DIR = os.environ.get('DATA_DIR', BASE_DIR)
+
+CSV_DATA_PATH = os.path.join(DATA_DIR, 'simulated_outbreak_data_v15.csv')
+ADDED_CSV_DATA_PATH = os.path.join(DATA_DIR, 'added_county_data.csv')
+# Rows accepted by POST /data/ingest, one .npz segment per batch
+INGEST_LOG_DIR = os.path.join(DATA_DIR, 'ingest_log')
+# Memory-mappable column snapshots of the above (see snapshot.py)
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshot')
+
+# Largest difference from predict_proba tolerated for a compiled kernel
+KERNEL_TOLERANCE = 1e-6
 
-_cholera_model = None
-_malaria_model = None
 _csv_data = None
+_csv_pending = []
+_csv_lock = threading.Lock()
+
+class ModelEntry:
+	"""A loaded model plus the metadata of the pickle it came from."""
+
+	def __init__(self, name, path, model, kernel, version, mtime_ns, load_seconds, warmup_seconds):
+		self.name = name
+		self.path = path
+		self.model = model
+		# NumPy-only scoring kernel from model_export, or None to use predict_proba
+		self.kernel = kernel
+		self.version = version
+		self.mtime_ns = mtime_ns
+		self.load_seconds = load_seconds
+		self.warmup_seconds = warmup_seconds
+		self.loaded_at = time.time()
+
+	def info(self):
+		return {
+			'path': self.path,
+			'version': self.version,
+			'loaded_at': self.loaded_at,
+			'load_seconds': self.load_seconds,
+			'warmup_seconds': self.warmup_seconds,
+			'kernel': type(self.kernel).__name__ if self.kernel is not None else None,
+		}
+
+class ModelRegistry:
+	"""
+	Holds the loaded models by name. Each model is warmed up with a dummy
+	predict_proba when loaded. A changed pickle (mtime, then content hash) is
+	loaded next to the old one and swapped in with a single reference
+	assignment, so requests already holding the old model finish with it.
+	"""
+
+	def __init__(self, paths):
+		self.paths = dict(paths)
+		self._entries = {}
+		self._load_lock = threading.Lock()
+		self._watcher = None
+
+	def _load(self, name):
+		path = self.paths[name]
+		mtime_ns = os.stat(path).st_mtime_ns
+		start = time.perf_counter()
+		with open(path, 'rb') as f:
+			raw = f.read()
+		# Imported here: unpickling pulls in sklearn/xgboost, which only model loads need
+		import joblib
+		model = joblib.load(io.BytesIO(raw))
+		load_seconds = time.perf_counter() - start
+		start = time.perf_counter()
+		model.predict_proba(np.zeros((1, getattr(model, 'n_features_in_', 2))))
+		warmup_seconds = time.perf_counter() - start
+		version = hashlib.sha256(raw).hexdigest()[:12]
+		return ModelEntry(name, path, model, self._compile(model), version, mtime_ns, load_seconds, warmup_seconds)
+
+	@staticmethod
+	def _compile(model):
+		"""Export a NumPy kernel for `model`, kept only if it agrees with predict_proba on a probe."""
+		try:
+			kernel = export_model(model)
+		except (TypeError, ValueError, KeyError) as e:
+			logger.warning('Model %s not compiled: %s', type(model).__name__, e)
+			return None
+		rng = np.random.default_rng(0)
+		n_features = getattr(model, 'n_features_in_', 2)
+		probe = np.vstack([np.zeros((1, n_features)), rng.uniform(0, 40, (256, n_features)), rng.uniform(0, 1, (256, n_features))])
+		if max_abs_error(model, kernel, probe) > KERNEL_TOLERANCE:
+			logger.warning('Model %s kernel disagrees with predict_proba; not compiled', type(model).__name__)
+			return None
+		return kernel
+
+	def entry(self, name):
+		entry = self._entries.get(name)
+		if entry is None:
+			with self._load_lock:
+				entry = self._entries.get(name)
+				if entry is None:
+					entry = self._entries[name] = self._load(name)
+		return entry
+
+	def get(self, name):
+		return self.entry(name).model
+
+	def version(self, name):
+		return self.entry(name).version
+
+	def score(self, name, X):
+		"""P(outbreak) for each row of the feature matrix X."""
+		entry = self.entry(name)
+		start = time.perf_counter()
+		if entry.kernel is not None:
+			proba = entry.kernel(X)
+			backend = 'kernel'
+		else:
+			proba = entry.model.predict_proba(X)[:, 1]
+			backend = 'predict_proba'
+		MODEL_INFERENCE_SECONDS.observe(time.perf_counter() - start, model=name, backend=backend)
+		MODEL_INFERENCE_ROWS.inc(len(X), model=name)
+		return proba
+
+	def warm_up(self):
+		"""Load every registered model now instead of on first use."""
+		for name in self.paths:
+			self.entry(name)
+
+	def reload_changed(self):
+		"""Swap in models whose pickle changed on disk. Returns the reloaded names."""
+		reloaded = []
+		with self._load_lock:
+			for name, path in self.paths.items():
+				current = self._entries.get(name)
+				if current is None or os.stat(path).st_mtime_ns == current.mtime_ns:
+					continue
+				entry = self._load(name)
+				if entry.version == current.version:
+					# Touched but not modified; remember the new mtime only
+					current.mtime_ns = entry.mtime_ns
+					continue
+				self._entries[name] = entry
+				reloaded.append(name)
+		return reloaded
+
+	def start_watcher(self, interval=10.0):
+		"""Poll the pickles every `interval` seconds from a daemon thread."""
+		if self._watcher is not None:
+			return
+
+		def watch():
+			while True:
+				time.sleep(interval)
+				try:
+					self.reload_changed()
+				except Exception as e:
+					logger.error('Model reload failed: %s', e, exc_info=True)
+
+		self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+		self._watcher.start()
+
+	def info(self):
+		return {name: entry.info() for name, entry in self._entries.items()}
+
+model_registry = ModelRegistry({
+	'cholera': CHOLERA_MODEL_PATH,
+	'malaria': MALARIA_MODEL_PATH,
+})
 
 def get_cholera_model():
-	global _cholera_model
-	if _cholera_model is None:
-		_cholera_model = joblib.load(CHOLERA_MODEL_PATH)
-	return _cholera_model
+	return model_registry.get('cholera')
 
 def get_malaria_model():
-	global _malaria_model
-	if _malaria_model is None:
-		_malaria_model = joblib.load(MALARIA_MODEL_PATH)
-	return _malaria_model
+	return model_registry.get('malaria')
 
 def get_csv_data():
 	global _csv_data
-	if _csv_data is None:
-		# Load both CSVs and concatenate
-		df_main = pd.read_csv(CSV_DATA_PATH)
-		if os.path.exists(ADDED_CSV_DATA_PATH):
-			df_added = pd.read_csv(ADDED_CSV_DATA_PATH)
-			_csv_data = pd.concat([df_main, df_added], ignore_index=True)
-		else:
-			_csv_data = df_main
+	if _csv_data is None or _csv_pending:
+		with _csv_lock:
+			if _csv_data is None:
+				# Load the CSVs (and the ingestion log) and concatenate
+				start = time.perf_counter()
+				frames = [pd.read_csv(CSV_DATA_PATH)]
+				if os.path.exists(ADDED_CSV_DATA_PATH):
+					frames.append(pd.read_csv(ADDED_CSV_DATA_PATH))
+				frames.extend(read_ingest_log())
+				_csv_data = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+				# Rows ingested before the first load are already in the log
+				_csv_pending.clear()
+				DATA_LOAD_SECONDS.observe(time.perf_counter() - start, source='csv')
+			elif _csv_pending:
+				_csv_data = pd.concat([_csv_data] + _csv_pending, ignore_index=True)
+				_csv_pending.clear()
 	return _csv_data
 
+def data_source_files():
+	"""Paths of every file get_csv_data() reads, in load order."""
+	paths = [CSV_DATA_PATH]
+	if os.path.exists(ADDED_CSV_DATA_PATH):
+		paths.append(ADDED_CSV_DATA_PATH)
+	if os.path.isdir(INGEST_LOG_DIR):
+		paths.extend(os.path.join(INGEST_LOG_DIR, f) for f in sorted(os.listdir(INGEST_LOG_DIR)) if f.endswith('.npz'))
+	return paths
+
+def iter_ingest_log():
+	"""Yield a DataFrame per ingested batch, in the order they were accepted."""
+	if not os.path.isdir(INGEST_LOG_DIR):
+		return
+	for name in sorted(f for f in os.listdir(INGEST_LOG_DIR) if f.endswith('.npz')):
+		with np.load(os.path.join(INGEST_LOG_DIR, name)) as segment:
+			yield pd.DataFrame({column: segment[column] for column in segment.files})
+
+def read_ingest_log():
+	"""DataFrames of the ingested batches, in the order they were accepted."""
+	return list(iter_ingest_log())
+
+def append_csv_data(df):
+	"""Queue ingested rows; they are concatenated on the next get_csv_data() call."""
+	with _csv_lock:
+		if _csv_data is not None:
+			_csv_pending.append(df)
+
 def predict_cholera(features):
 	model = get_cholera_model()
 	return model.predict([features])[0]
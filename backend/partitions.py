@@ -0,0 +1,364 @@
+"""
+Chunked, out-of-core processing of the dataset by month partition.
+
+With DATA_MODE=chunked, the history is never loaded as one DataFrame. The
+source files are split by the month of each row's week into part files:
+  partitions/<fingerprint>/<YYYY>/<YYYY-MM>/part-NNNNNN.npz
+The CSVs are read PARTITION_CHUNK_ROWS rows at a time, then the ingest log
+is added. Everything built from the whole history then reads one partition
+at a time:
+
+  - PartitionedDataset.run(operator) computes a partial aggregate from a
+    DataStore of each partition and folds the partials with the operator's
+    combine(). The partitions can be scanned in a process pool. Partials
+    are cached per partition, so after an ingest only the months it touched
+    are scanned again.
+  - BucketTotals feeds the materialized aggregates (monthly comparison,
+    environmental), and CountyRisk the county rollup of /data/county_data.
+  - report_builder writes the reports of one partition at a time.
+
+Memory is bounded by the largest partition per worker plus the partials,
+which are O(groups), and the sorted report ids ingestion deduplicates
+against. Rows ingested while serving are kept in memory per month and
+scanned with their partition. They are also in the ingest log, so the next
+set of partitions includes them. The dataset's version (the fingerprint of
+its partitions and the batches ingested since) tags cached responses in
+chunked mode, so serving never needs the full data store for them.
+
+Usage (from the backend directory) to write the partitions ahead of time:
+    python partitions.py [--force]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from aggregates import bucket_totals
+from config import CHUNKED_WORKERS, PARTITION_CHUNK_ROWS
+from data_store import CATEGORICAL_COLUMNS, COLUMNS, DataStore, isin_sorted
+from model_utils import ADDED_CSV_DATA_PATH, CSV_DATA_PATH, DATA_DIR, MODEL_FEATURES, iter_ingest_log
+from risk_scores import model_versions, score_rows
+from snapshot import prune_snapshots, source_fingerprint
+from spatial import NO_RISK_COLOR, RISK_COLORS, risk_quantiles
+
+PARTITIONS_DIR = os.path.join(DATA_DIR, 'partitions')
+# Written last, so a directory without it is an interrupted build
+COMPLETE_FILE = '.complete'
+
+_build_lock = threading.Lock()
+
+
+def month_of(df):
+    """Partition of each row: the month its week starts in, e.g. '2023-01'."""
+    return df['week'].astype(str).str[:7]
+
+
+def iter_source_chunks(chunk_rows=PARTITION_CHUNK_ROWS):
+    """Yield the rows get_csv_data() loads, in the same order, as DataFrames of at most `chunk_rows` rows."""
+    for path in (CSV_DATA_PATH, ADDED_CSV_DATA_PATH):
+        if os.path.exists(path):
+            yield from pd.read_csv(path, chunksize=chunk_rows)
+    yield from iter_ingest_log()
+
+
+def write_partitions(path, chunks):
+    """
+    Split the DataFrames `chunks` by month into part files under `path`.
+    Files go to a temporary sibling that is renamed into place.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+    try:
+        for number, chunk in enumerate(chunks):
+            for month, part in chunk.groupby(month_of(chunk), sort=False):
+                directory = os.path.join(tmp, month[:4], month)
+                os.makedirs(directory, exist_ok=True)
+                arrays = {name: part[name].to_numpy(dtype=str if name in CATEGORICAL_COLUMNS else None)
+                          for name in COLUMNS}
+                np.savez(os.path.join(directory, f'part-{number:06d}.npz'), **arrays)
+        open(os.path.join(tmp, COMPLETE_FILE), 'w').close()
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another process finished the same partitions first
+            if not os.path.exists(os.path.join(path, COMPLETE_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def read_partition_arrays(parts, pending=()):
+    """One partition as {column: array}: its part files, then rows ingested since."""
+    chunks = []
+    for part in parts:
+        with np.load(part) as arrays:
+            chunks.append({name: arrays[name] for name in COLUMNS})
+    chunks.extend({name: df[name].to_numpy() for name in COLUMNS} for df in pending)
+    if not chunks:
+        return {name: np.zeros(0, dtype=str if name in CATEGORICAL_COLUMNS else np.float64) for name in COLUMNS}
+    if len(chunks) == 1:
+        return chunks[0]
+    return {name: np.concatenate([np.asarray(chunk[name], dtype=str if name in CATEGORICAL_COLUMNS else None)
+                                  for chunk in chunks]) for name in COLUMNS}
+
+
+def read_partition(parts, pending=()):
+    """One partition as a DataFrame in the CSV schema."""
+    return pd.DataFrame(read_partition_arrays(parts, pending), columns=COLUMNS)
+
+
+def _partial(operator, parts, pending):
+    return operator.partial(DataStore.from_arrays(read_partition_arrays(parts, pending)))
+
+
+def merge_totals(a, b):
+    """Sum two {key: vector} partials; keys in only one of them are kept as is."""
+    merged = dict(a)
+    for key, vector in b.items():
+        merged[key] = merged[key] + vector if key in merged else vector
+    return merged
+
+
+class BucketTotals:
+    """Measure vectors per (month, county, disease) bucket, as in aggregates.py."""
+
+    def key(self):
+        return ('buckets',)
+
+    def partial(self, store):
+        return bucket_totals(store, np.arange(store.n_rows))
+
+    combine = staticmethod(merge_totals)
+
+    def finalize(self, totals):
+        return totals
+
+
+class CountyRisk:
+    """
+    The all-time county view of /data/county_data: cases, outbreaks and mean
+    P(outbreak) per county, coloured by risk quintile. Partials hold
+    [rows, cases, outbreaks, risk sum, risk count] per (county, disease).
+    """
+
+    def key(self):
+        # Every partial depends on the models that scored it
+        return ('county_risk',) + tuple(model_versions()[name] for name in MODEL_FEATURES)
+
+    def partial(self, store):
+        if store.n_rows == 0:
+            return {}
+        risk = score_rows(store, np.arange(store.n_rows)).astype(np.float64)
+        n_diseases = len(store.categories['disease'])
+        combined = store.columns['county'].astype(np.int64) * n_diseases + store.columns['disease']
+        uniq, inverse = np.unique(combined, return_inverse=True)
+        scored = ~np.isnan(risk)
+        totals = np.column_stack([
+            np.bincount(inverse, minlength=len(uniq)),
+            np.bincount(inverse, weights=np.nan_to_num(store.columns['cases'].astype(np.float64)), minlength=len(uniq)),
+            np.bincount(inverse, weights=store.columns['outbreak'].astype(np.float64), minlength=len(uniq)),
+            np.bincount(inverse[scored], weights=risk[scored], minlength=len(uniq)),
+            np.bincount(inverse[scored], minlength=len(uniq)),
+        ]).astype(np.float64)
+        counties = store.categories['county']
+        diseases = store.categories['disease']
+        return {
+            (counties[code // n_diseases], diseases[code % n_diseases].lower()): vector
+            for code, vector in zip(uniq.tolist(), totals)
+        }
+
+    combine = staticmethod(merge_totals)
+
+    def finalize(self, totals):
+        by_county = {}
+        for (county, _), vector in (totals or {}).items():
+            by_county[county] = by_county[county] + vector if county in by_county else vector
+        names = sorted(by_county)
+        sums = np.array([by_county[name] for name in names]).reshape(len(names), 5)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            risk = sums[:, 3] / sums[:, 4]
+        quantile = risk_quantiles(risk)
+        return [
+            {
+                'name': name,
+                'cases': int(sums[i, 1]),
+                'outbreaks': int(sums[i, 2]),
+                'risk': None if np.isnan(risk[i]) else round(float(risk[i]), 4),
+                'color': RISK_COLORS[quantile[i]] if quantile[i] >= 0 else NO_RISK_COLOR,
+            }
+            for i, name in enumerate(names)
+        ]
+
+
+class ReportIds:
+    """Sorted report ids of every row."""
+
+    # Built once and then kept current by PartitionedDataset.add()
+    cache_partials = False
+
+    def key(self):
+        return ('report_ids',)
+
+    def partial(self, store):
+        return [store.columns['report_id'].astype(np.int64)]
+
+    @staticmethod
+    def combine(a, b):
+        return a + b
+
+    def finalize(self, parts):
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+
+class PartitionedDataset:
+    """The month partitions in `path`, plus rows ingested since they were written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprint = os.path.basename(path)
+        # month -> DataFrames ingested in this process
+        self.pending = {}
+        # Batches ingested in this process
+        self.version = 0
+        self._report_ids = None
+        # (operator key, month) -> (partition signature, partial)
+        self._partials = {}
+        self._lock = threading.Lock()
+
+    def months(self):
+        on_disk = [month for year in sorted(os.listdir(self.path)) if os.path.isdir(os.path.join(self.path, year))
+                   for month in sorted(os.listdir(os.path.join(self.path, year)))]
+        return sorted(set(on_disk).union(self.pending))
+
+    def parts(self, month):
+        directory = os.path.join(self.path, month[:4], month)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith('.npz')]
+
+    def scans(self):
+        """(month, part files, ingested frames) of every partition, in month order."""
+        with self._lock:
+            return [(month, self.parts(month), list(self.pending.get(month, ()))) for month in self.months()]
+
+    def read(self, month):
+        with self._lock:
+            pending = list(self.pending.get(month, ()))
+        return read_partition(self.parts(month), pending)
+
+    def report_ids(self):
+        """Sorted report ids of every row, from one scan; add() keeps them current."""
+        if self._report_ids is None:
+            ids = self.run(ReportIds())
+            with self._lock:
+                if self._report_ids is None:
+                    self._report_ids = ids
+        return self._report_ids
+
+    @property
+    def n_rows(self):
+        return len(self.report_ids())
+
+    def has_report_ids(self, report_ids):
+        """Boolean mask of which `report_ids` are already in the dataset."""
+        return isin_sorted(self.report_ids(), report_ids)
+
+    def add(self, df):
+        """Fold newly ingested rows into their partitions."""
+        with self._lock:
+            for month, part in df.groupby(month_of(df), sort=False):
+                self.pending.setdefault(month, []).append(part[COLUMNS].reset_index(drop=True))
+            if self._report_ids is not None:
+                added = np.sort(df['report_id'].to_numpy(dtype=np.int64))
+                self._report_ids = np.insert(self._report_ids, np.searchsorted(self._report_ids, added), added)
+            self.version += 1
+
+    def run(self, operator, workers=None):
+        """
+        operator.finalize() of every partition's operator.partial() folded
+        with operator.combine(). Partitions without a cached partial are
+        scanned in a process pool of `workers` (default CHUNKED_WORKERS);
+        partials are not kept for operators with cache_partials = False.
+        """
+        key = operator.key()
+        scans = self.scans()
+        partials = {}
+        todo = []
+        with self._lock:
+            for month, parts, pending in scans:
+                signature = (tuple(parts), len(pending))
+                cached = self._partials.get((key, month))
+                if cached is not None and cached[0] == signature:
+                    partials[month] = cached[1]
+                else:
+                    todo.append((month, signature, parts, pending))
+
+        workers = workers or CHUNKED_WORKERS or os.cpu_count() or 1
+        if workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+                results = list(pool.map(_partial, [operator] * len(todo), *zip(*[t[2:] for t in todo])))
+        else:
+            results = [_partial(operator, parts, pending) for _, _, parts, pending in todo]
+
+        with self._lock:
+            for (month, signature, _, _), partial in zip(todo, results):
+                if getattr(operator, 'cache_partials', True):
+                    self._partials[(key, month)] = (signature, partial)
+                partials[month] = partial
+        result = None
+        for month in sorted(partials):
+            result = partials[month] if result is None else operator.combine(result, partials[month])
+        return operator.finalize(result)
+
+
+def build_partitions(root=PARTITIONS_DIR, force=False):
+    """Make sure partitions of the current sources exist under `root`; returns their path."""
+    fingerprint = source_fingerprint()
+    path = os.path.join(root, fingerprint)
+    with _build_lock:
+        if force and os.path.isdir(path):
+            shutil.rmtree(path)
+        if not os.path.exists(os.path.join(path, COMPLETE_FILE)):
+            write_partitions(path, iter_source_chunks())
+            prune_snapshots(root, keep=fingerprint)
+    return path
+
+
+_dataset = None
+_dataset_lock = threading.Lock()
+
+
+def get_dataset():
+    """The partitioned dataset, writing the partitions first if the sources changed."""
+    global _dataset
+    if _dataset is None:
+        with _dataset_lock:
+            if _dataset is None:
+                _dataset = PartitionedDataset(build_partitions())
+    return _dataset
+
+
+def add_ingested(df):
+    """Fold ingested rows into the partitioned dataset, if one is open in this process."""
+    if _dataset is not None:
+        _dataset.add(df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the month partitions used in chunked mode.')
+    parser.add_argument('--force', action='store_true', help='rewrite even if the sources are unchanged')
+    args = parser.parse_args()
+    dataset = PartitionedDataset(build_partitions(force=args.force))
+    months = dataset.months()
+    print(f'{len(months)} partitions ({months[0]} to {months[-1]}) in {dataset.path}' if months else 'No partitions')
+
+
+if __name__ == '__main__':
+    main()
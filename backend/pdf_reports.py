@@ -0,0 +1,370 @@
+"""
+Renders CSV reports to PDF and caches the result on disk.
+
+Cached PDFs live in PDF_CACHE_DIR, named after the report and the SHA-256 of
+its CSV, so a regenerated report never matches a stale PDF. A small
+background pool pre-renders PDFs for freshly built reports.
+
+matplotlib and reportlab are imported on first render, not with this
+module, so serving processes that never render stay free of them;
+preload_pdf_stack() imports them off the request path ahead of time.
+"""
+import glob
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import PDF_RENDER_SECONDS
+from report_builder import REPORTS_DIR
+
+PDF_CACHE_DIR = os.path.join(REPORTS_DIR, 'pdf_cache')
+# Background renders run on at most this many threads, with at most
+# MAX_PENDING_RENDERS queued; anything beyond that is rendered on demand
+RENDER_WORKERS = 1
+MAX_PENDING_RENDERS = 256
+# Requested PDFs get their own pool so they never queue behind pre-renders
+ON_DEMAND_RENDER_WORKERS = 2
+
+_background = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='pdf-render')
+_on_demand = ThreadPoolExecutor(max_workers=ON_DEMAND_RENDER_WORKERS, thread_name_prefix='pdf-request')
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def import_pdf_stack():
+    """Import what render_report_pdf() uses, including matplotlib's Agg backend."""
+    import matplotlib.backends.backend_agg  # noqa: F401
+    import matplotlib.figure  # noqa: F401
+    import reportlab.pdfbase.ttfonts  # noqa: F401
+    import reportlab.platypus  # noqa: F401
+
+
+def preload_pdf_stack():
+    """Import the PDF stack on a daemon thread, so the first render doesn't pay for it."""
+    thread = threading.Thread(target=import_pdf_stack, name='pdf-preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def render_png(fig):
+    """Render a matplotlib figure to an in-memory PNG."""
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=120)
+    buf.seek(0)
+    return buf
+
+
+def render_report_pdf(csv_path):
+    """Build the PDF for one CSV report and return its bytes."""
+    from matplotlib.figure import Figure
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
+
+    safe_filename = os.path.basename(csv_path)
+    # Read summary and data
+    with open(csv_path, encoding='utf-8') as f:
+        lines = f.readlines()
+    summary_lines = [l.strip() for l in lines if l.startswith('#')]
+    data_lines = [l for l in lines if not l.startswith('#')]
+    # Prepare summary as key-value pairs
+    summary = [l[2:].split(':', 1) for l in summary_lines if ':' in l]
+    # Prepare data table
+    if not data_lines:
+        data_table = []
+    else:
+        data_table = [row.strip().split(',') for row in data_lines]
+
+    # Convert data table to DataFrame for analytics/graphs
+    # Clean and convert numeric columns for plotting
+    df = pd.DataFrame(data_table[1:], columns=data_table[0]) if data_table else pd.DataFrame()
+    if not df.empty:
+        for col in ['cases', 'outbreak', 'predicted_risk']:
+            if col in df.columns:
+                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+
+    # PDF generation
+    pdf_buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        pdf_buffer,
+        pagesize=letter,
+        rightMargin=60,
+        leftMargin=60,
+        topMargin=70,
+        bottomMargin=50
+    )
+    elements = []
+    styles = getSampleStyleSheet()
+    title_style = styles['Title']
+    subtitle_style = styles['Heading2']
+    normal_style = styles['Normal']
+    summary_style = ParagraphStyle('Summary', parent=normal_style, fontSize=10, spaceAfter=6)
+
+    # Branding and title
+    elements.append(Paragraph("Outbreak Early Warning System", title_style))
+    elements.append(Paragraph("Epidemiological Report", subtitle_style))
+    elements.append(Spacer(1, 0.2 * inch))
+    elements.append(Paragraph(f"<b>Report File:</b> {safe_filename}", normal_style))
+    elements.append(Spacer(1, 0.1 * inch))
+
+    # Summary section
+    if summary:
+        # Check for all-zero cases and outbreaks
+        summary_dict = {k.strip(): v.strip() for k, v in summary}
+        zero_cases = summary_dict.get('total_cases', '0') in ['0', '0.0']
+        zero_outbreaks = summary_dict.get('total_outbreaks', '0') in ['0', '0.0']
+        if zero_cases and zero_outbreaks:
+            warning_style = ParagraphStyle('Warning', parent=styles['Normal'], fontSize=12, textColor=colors.red, spaceAfter=12, alignment=1)
+            elements.append(Paragraph("<b>Notice:</b> No cases or outbreaks were reported for this period. All values are zero.", warning_style))
+        elements.append(Paragraph("<b>Summary Statistics</b>", styles['Heading3']))
+        for k, v in summary:
+            elements.append(Paragraph(f"<b>{k.strip()}:</b> {v.strip()}", summary_style))
+        elements.append(Spacer(1, 0.2 * inch))
+
+    # Analytics and Graphs
+    if not df.empty:
+        # Cases by Disease Bar Chart
+        if 'disease' in df.columns and 'cases' in df.columns:
+            cases_by_disease = df.groupby('disease')['cases'].sum()
+            if not cases_by_disease.empty and cases_by_disease.sum() > 0:
+                fig = Figure(figsize=(4, 2.2))
+                ax = fig.add_subplot()
+                ax.bar(cases_by_disease.index, cases_by_disease.values, color=['#3b82f6', '#ef4444', '#22c55e', '#f59e0b'][:len(cases_by_disease)])
+                ax.set_title('Cases by Disease')
+                ax.set_ylabel('Cases')
+                elements.append(Paragraph("<b>Cases by Disease</b>", styles['Heading4']))
+                elements.append(Image(render_png(fig), width=3.5*inch, height=2*inch))
+        # Outbreaks by County
+        if 'county' in df.columns and 'outbreak' in df.columns:
+            outbreaks_by_county = df.groupby('county')['outbreak'].sum()
+            if not outbreaks_by_county.empty and outbreaks_by_county.sum() > 0:
+                fig = Figure(figsize=(4, 2.2))
+                ax = fig.add_subplot()
+                ax.bar(outbreaks_by_county.index, outbreaks_by_county.values, color='#f97316')
+                ax.set_title('Outbreaks by County')
+                ax.set_ylabel('Outbreaks')
+                ax.tick_params(axis='x', labelrotation=30, labelsize=7)
+                for label in ax.get_xticklabels():
+                    label.set_horizontalalignment('right')
+                elements.append(Paragraph("<b>Outbreaks by County</b>", styles['Heading4']))
+                elements.append(Image(render_png(fig), width=3.5*inch, height=2*inch))
+        elements.append(Spacer(1, 0.2 * inch))
+
+    # Prediction section for special reports
+    if 'special' in safe_filename.lower() or 'assessment' in safe_filename.lower():
+        elements.append(Paragraph("<b>Prediction Analysis</b>", styles['Heading3']))
+        if 'predicted_risk' in df.columns and 'disease' in df.columns:
+            pred_summary = df.groupby('disease')['predicted_risk'].apply(lambda x: np.mean([float(i) for i in x if i not in [None, '', 'nan']])).to_dict()
+            for disease, risk in pred_summary.items():
+                elements.append(Paragraph(f"<b>{disease} Avg Predicted Risk:</b> {risk:.3f}", summary_style))
+        elements.append(Spacer(1, 0.2 * inch))
+
+    # Data table
+    if data_table:
+        elements.append(Paragraph("<b>Detailed Data</b>", styles['Heading3']))
+        from reportlab.platypus import Paragraph as RLParagraph
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.pdfbase import pdfmetrics
+        # Use system-wide font (Noto Serif JP if available, else fallback)
+        try:
+            pdfmetrics.registerFont(TTFont('NotoSerifJP', os.path.join(os.path.dirname(__file__), '../src/fonts/NotoSerifJP-Regular.ttf')))
+            font_name = 'NotoSerifJP'
+        except Exception:
+            font_name = 'Helvetica'
+        # Pad all rows to header length
+        header_len = len(data_table[0])
+        padded_table = [row + [''] * (header_len - len(row)) if len(row) < header_len else row[:header_len] for row in data_table]
+        # Use a smaller font and wrap text for long values
+        def format_cell(val):
+            sval = str(val)
+            # Always wrap text for long values
+            if len(sval) > 15 or any(c in sval for c in [',', ' ', '\n']):
+                return RLParagraph(sval.replace('\n', '<br/>'), ParagraphStyle('tablecell', fontName=font_name, fontSize=7, leading=8))
+            else:
+                return RLParagraph(sval, ParagraphStyle('tablecell', fontName=font_name, fontSize=7, leading=8))
+        formatted_table = [[format_cell(cell) for cell in row] for row in padded_table]
+        # Auto-size columns based on max content width, but cap at 1.2 inch
+        max_table_width = doc.width
+        num_cols = header_len
+        col_widths = []
+        for col in range(num_cols):
+            maxlen = max([len(str(row[col])) for row in padded_table])
+            width = min(0.11 * inch * maxlen + 0.25 * inch, 1.2 * inch)
+            col_widths.append(width)
+        # If total width exceeds page, scale down proportionally
+        total_width = sum(col_widths)
+        if total_width > max_table_width:
+            scale = max_table_width / total_width
+            col_widths = [w * scale for w in col_widths]
+        table = Table(formatted_table, repeatRows=1, hAlign='LEFT', colWidths=col_widths)
+        # Alternating row background color for readability, highlight outbreak rows
+        table_style = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e3e3e3')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor('#222222')),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), font_name),
+            ('FONTSIZE', (0, 0), (-1, 0), 8),
+            ('FONTSIZE', (0, 1), (-1, -1), 7),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 5),
+            ('TOPPADDING', (0, 0), (-1, 0), 5),
+            ('LEFTPADDING', (0, 0), (-1, -1), 1),
+            ('RIGHTPADDING', (0, 0), (-1, -1), 1),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#bbbbbb')),
+        ]
+        # Find outbreak column index
+        outbreak_col = None
+        for idx, col in enumerate(data_table[0]):
+            if col.strip().lower() == 'outbreak':
+                outbreak_col = idx
+                break
+        for i in range(1, len(formatted_table)):
+            # Highlight outbreak rows
+            if outbreak_col is not None:
+                val = str(padded_table[i][outbreak_col]).strip()
+                if val == '1' or val.lower() == 'true':
+                    table_style.append(('BACKGROUND', (0, i), (-1, i), colors.HexColor('#fef3c7')))
+                    table_style.append(('TEXTCOLOR', (0, i), (-1, i), colors.HexColor('#b45309')))
+            elif i % 2 == 1:
+                table_style.append(('BACKGROUND', (0, i), (-1, i), colors.whitesmoke))
+        table.setStyle(TableStyle(table_style))
+        table._argW = col_widths
+        table.repeatRows = 1
+        table.splitByRow = 1
+        elements.append(table)
+
+    # Footer with page number
+    def add_footer(canvas, doc):
+        canvas.saveState()
+        footer_text = f"Generated by Outbreak Early Warning System | Page {doc.page}"
+        canvas.setFont('Helvetica', 8)
+        canvas.setFillColor(colors.HexColor('#888888'))
+        canvas.drawString(60, 35, footer_text)
+        canvas.restoreState()
+
+    doc.build(elements, onFirstPage=add_footer, onLaterPages=add_footer)
+    return pdf_buffer.getvalue()
+
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def cached_pdf_path(csv_path, digest):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(PDF_CACHE_DIR, f'{stem}.{digest[:16]}.pdf')
+
+
+def _render_to_cache(csv_path, pdf_path):
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    start = time.perf_counter()
+    pdf_bytes = render_report_pdf(csv_path)
+    PDF_RENDER_SECONDS.observe(time.perf_counter() - start)
+    tmp_path = f'{pdf_path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf_bytes)
+    os.replace(tmp_path, pdf_path)
+    # Drop PDFs rendered from earlier versions of this report
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    for old in glob.glob(os.path.join(glob.escape(PDF_CACHE_DIR), f'{glob.escape(stem)}.*.pdf')):
+        if old != pdf_path:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+    return pdf_path
+
+
+def _finish(pdf_path, future):
+    with _inflight_lock:
+        if _inflight.get(pdf_path) is future:
+            del _inflight[pdf_path]
+
+
+def _submit(csv_path, pdf_path, executor):
+    """Queue a render unless one for the same PDF is already running. Caller holds _inflight_lock."""
+    future = _inflight.get(pdf_path)
+    if future is None:
+        future = executor.submit(_render_to_cache, csv_path, pdf_path)
+        future.on_demand = executor is _on_demand
+        _inflight[pdf_path] = future
+        future.add_done_callback(lambda f: _finish(pdf_path, f))
+    return future
+
+
+def get_report_pdf(csv_path, timeout=None):
+    """
+    Path of the cached PDF for `csv_path`, rendering it first if needed.
+    Renders run on the on-demand pool, never on the calling thread; raises
+    concurrent.futures.TimeoutError after `timeout` seconds, leaving the
+    render to finish in the background.
+    """
+    pdf_path = cached_pdf_path(csv_path, file_hash(csv_path))
+    if os.path.exists(pdf_path):
+        return pdf_path
+    with _inflight_lock:
+        queued = _inflight.get(pdf_path)
+    # A pre-render still waiting in the background queue moves to the
+    # on-demand pool (cancel() runs _finish, so not under the lock)
+    if queued is not None and not queued.on_demand:
+        queued.cancel()
+    with _inflight_lock:
+        future = _submit(csv_path, pdf_path, _on_demand)
+    return future.result(timeout=timeout)
+
+
+def prune_pdf_cache(filenames):
+    """Delete cached PDFs of reports not among the CSV `filenames`; returns how many."""
+    keep = {os.path.splitext(fname)[0] for fname in filenames}
+    removed = 0
+    for path in glob.glob(os.path.join(glob.escape(PDF_CACHE_DIR), '*.pdf')):
+        # <report stem>.<digest>.pdf
+        stem = os.path.basename(path).rsplit('.', 2)[0]
+        if stem not in keep:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _missing_pdfs(filenames):
+    """(csv_path, pdf_path) for the CSV reports among `filenames` without a cached PDF."""
+    for fname in filenames:
+        if not fname.endswith('.csv'):
+            continue
+        csv_path = os.path.join(REPORTS_DIR, fname)
+        try:
+            pdf_path = cached_pdf_path(csv_path, file_hash(csv_path))
+        except FileNotFoundError:
+            continue
+        if not os.path.exists(pdf_path):
+            yield csv_path, pdf_path
+
+
+def prerender_reports(filenames):
+    """Queue background renders for the given CSV reports in REPORTS_DIR."""
+    for csv_path, pdf_path in _missing_pdfs(filenames):
+        with _inflight_lock:
+            if len(_inflight) >= MAX_PENDING_RENDERS:
+                return
+            _submit(csv_path, pdf_path, _background)
+
+
+def render_reports(filenames):
+    """Render the missing PDFs of the given reports on the calling thread; returns how many."""
+    rendered = 0
+    for csv_path, pdf_path in _missing_pdfs(filenames):
+        _render_to_cache(csv_path, pdf_path)
+        rendered += 1
+    return rendered
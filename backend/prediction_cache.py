@@ -0,0 +1,118 @@
+"""
+Bounded LRU cache in front of model scoring, shared by the prediction
+endpoints. Keys are (model name, model version, quantized feature tuple), so
+a hot-reloaded model never serves stale scores; entries of the old version
+are dropped the first time the new version is seen. Batches of more than
+max_batch rows are scored directly, since the per-row key building and
+lookups would cost more than the vectorized kernel.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import PREDICTION_CACHE_MAX_BATCH, PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_QUANTUM
+from metrics import REGISTRY
+from model_utils import model_registry
+
+
+class PredictionCache:
+    def __init__(self, max_entries, ttl=None, quantum=1e-6, max_batch=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.quantum = quantum
+        self.max_batch = max_batch
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bypassed = 0
+
+    def _quantize(self, row):
+        return tuple(round(v / self.quantum) if math.isfinite(v) else v for v in row)
+
+    def _check_version(self, name, version):
+        if self._versions.get(name) == version:
+            return
+        with self._lock:
+            if self._versions.get(name) != version:
+                stale = [key for key in self._entries if key[0] == name and key[1] != version]
+                for key in stale:
+                    del self._entries[key]
+                self._versions[name] = version
+
+    def score(self, name, X):
+        """Like model_registry.score(name, X), answering repeated rows from the cache."""
+        X = np.asarray(X, dtype=np.float64)
+        if self.max_batch is not None and len(X) > self.max_batch:
+            with self._lock:
+                self.bypassed += len(X)
+            return model_registry.score(name, X)
+        version = model_registry.version(name)
+        self._check_version(name, version)
+        keys = [(name, version, self._quantize(row)) for row in X.tolist()]
+        out = np.empty(len(keys))
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                item = self._entries.get(key)
+                if item is not None and (self.ttl is None or item[1] > now):
+                    self._entries.move_to_end(key)
+                    out[i] = item[0]
+                    continue
+                if item is not None:
+                    del self._entries[key]
+                    self.expirations += 1
+                missing.append(i)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            values = model_registry.score(name, X[missing])
+            out[missing] = values
+            expires = now + self.ttl if self.ttl is not None else None
+            with self._lock:
+                for i, value in zip(missing, values.tolist()):
+                    self._entries[keys[i]] = (value, expires)
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'max_batch': self.max_batch,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'bypassed': self.bypassed,
+                'hit_rate': self.hits / lookups if lookups else None,
+            }
+
+    def collect(self):
+        """The counters as metric families for metrics.REGISTRY."""
+        stats = self.stats()
+        for name in ('hits', 'misses', 'evictions', 'expirations', 'bypassed'):
+            yield f'prediction_cache_{name}_total', 'counter', f'Prediction cache {name}.', [({}, stats[name])]
+        yield 'prediction_cache_entries', 'gauge', 'Entries in the prediction cache.', [({}, stats['size'])]
+
+
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL, PREDICTION_CACHE_QUANTUM,
+                                   PREDICTION_CACHE_MAX_BATCH)
+REGISTRY.add_collector(prediction_cache.collect)
@@ -0,0 +1,293 @@
+"""
+Builds the weekly and monthly CSV reports in REPORTS_DIR.
+
+Predictions are the stored per-row scores (see risk_scores.py), and a manifest of
+source-row hashes lets a rebuild skip every report whose rows (and models)
+are unchanged. Changed reports are written in parallel across a process pool.
+With DATA_MODE=chunked the dataset is read one month partition at a time.
+The manifest also records each report's counties, row count and summary, and
+serves as the catalog /reports/list is answered from (see report_catalog.py).
+
+Usage (from the backend directory):
+    python report_builder.py [--force] [--workers N] [--pdf] [--chunked]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import REPORT_BUILD_SECONDS, REPORTS_WRITTEN
+from config import DATA_MODE
+from data_store import DataStore, get_data_store
+from model_utils import get_csv_data, model_registry
+from partitions import get_dataset, read_partition
+from risk_scores import get_risk_scores, score_rows
+
+REPORTS_DIR = os.environ.get('REPORTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports'))
+MANIFEST_PATH = os.path.join(REPORTS_DIR, 'manifest.json')
+# Bump when the report contents change for the same rows and models, so
+# existing reports are rewritten (2: predicted_risk is P(outbreak), not the class)
+REPORT_FORMAT = 2
+# Longest report filename; longer county lists are replaced by a hash of the
+# list (the manifest keeps the counties). Leaves room for .pdf and .tmp suffixes.
+MAX_FILENAME_LENGTH = 200
+
+
+def sanitize_filename(s):
+    return s.replace('/', '_').replace('\\', '_')
+
+
+def make_report_filename(report_type, period, extra_desc=None, ext='csv'):
+    # Example: weekly_2024-11-18_2024-11-24_Baringo_and_Nairobi.csv
+    base = f"{report_type}_{period}"
+    if extra_desc:
+        base += f"_{sanitize_filename(extra_desc)}"
+        if len(base) + len(ext) + 1 > MAX_FILENAME_LENGTH:
+            base = f"{report_type}_{period}_{hashlib.sha256(extra_desc.encode()).hexdigest()[:16]}"
+    return f"{base}.{ext}"
+
+
+def add_predictions(df, stored=True):
+    """
+    Return a copy of `df` with a predicted_risk column, P(outbreak) of each
+    row. These are the stored scores when `df` is the current dataset (and
+    `stored` is set), and are scored on the spot otherwise.
+    """
+    df = df.copy()
+    store = get_data_store() if stored else None
+    if store is not None and len(df) == store.n_rows and np.array_equal(df['report_id'].to_numpy(), store.columns['report_id']):
+        scores = get_risk_scores().scores(store)
+    else:
+        frame_store = DataStore.from_frame(df)
+        scores = score_rows(frame_store, np.arange(frame_store.n_rows))
+    df['predicted_risk'] = np.asarray(scores)
+    return df
+
+
+def summarize(group):
+    summary = {
+        'total_cases': int(group['cases'].sum()),
+        'total_outbreaks': int(group['outbreak'].sum()),
+        'avg_temp': float(group['avg_temp'].mean()),
+        'avg_rainfall': float(group['avg_rainfall'].mean()),
+        'avg_sanitation_rate': float(group['unimproved_sanitation_rate'].mean()),
+        'avg_ndvi': float(group['mean_ndvi'].mean()),
+    }
+    # Add per-disease summary
+    for disease in group['disease'].unique():
+        mask = group['disease'] == disease
+        summary[f'{disease}_cases'] = int(group[mask]['cases'].sum())
+        summary[f'{disease}_avg_predicted_risk'] = float(group[mask]['predicted_risk'].astype(float).mean())
+    return summary
+
+
+def write_report(path, group):
+    """
+    Write one report: `# key: value` summary lines followed by the rows.
+    Returns the filename and the summary.
+    """
+    summary = summarize(group)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for k, v in summary.items():
+            f.write(f'# {k}: {v}\n')
+        group.to_csv(f, index=False)
+    os.replace(tmp_path, path)
+    return os.path.basename(path), summary
+
+
+def models_fingerprint():
+    return '|'.join(model_registry.version(name) for name in ('cholera', 'malaria'))
+
+
+def content_hash(group, fingerprint):
+    h = hashlib.sha256(f'{REPORT_FORMAT}|{fingerprint}'.encode())
+    h.update(pd.util.hash_pandas_object(group, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _read_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {'version': 0, 'reports': {}}
+    # Manifests written before versioning hold the report entries only
+    return data if 'reports' in data else {'version': 0, 'reports': data}
+
+
+def load_manifest():
+    """Report entries of the last build, by filename."""
+    return _read_manifest()['reports']
+
+
+def save_manifest(manifest):
+    """Write the report entries, bumping the manifest version if they changed."""
+    previous = _read_manifest()
+    version = previous['version'] + (manifest != previous['reports'])
+    tmp_path = f'{MANIFEST_PATH}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'reports': manifest}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def plan_reports(df):
+    """Yield (report_type, period, filename, counties, source rows) for every report."""
+    df = df.copy()
+    df['week'] = df['week'].astype(str)
+    for week, group in df.groupby('week'):
+        counties = sorted(group['county'].unique())
+        fname = make_report_filename('weekly', sanitize_filename(week), '_'.join(counties), 'csv')
+        yield 'weekly', week, fname, counties, group
+    months = df['week'].str[:7]
+    for month, group in df.groupby(months):
+        counties = sorted(group['county'].unique())
+        fname = make_report_filename('monthly', sanitize_filename(month), '_'.join(counties), 'csv')
+        yield 'monthly', month, fname, counties, group
+
+
+def update_reports(df, manifest, fingerprint, workers=1, stored_scores=True):
+    """
+    Plan the reports of the rows in `df` and rewrite those that are stale
+    against `manifest`, across `workers` processes. Returns the manifest
+    entries of df's reports and the filenames written.
+    """
+    new_manifest = {}
+    stale = []
+    for report_type, period, fname, counties, group in plan_reports(df):
+        digest = content_hash(group, fingerprint)
+        new_manifest[fname] = {'type': report_type, 'period': period, 'hash': digest,
+                               'counties': [str(c) for c in counties], 'rows': len(group)}
+        previous = manifest.get(fname)
+        # Entries from before the catalog have no summary; rewriting the report records it
+        if (previous is None or previous['hash'] != digest or 'summary' not in previous
+                or not os.path.exists(os.path.join(REPORTS_DIR, fname))):
+            stale.append((report_type, fname, group.index))
+
+    written = []
+    if stale:
+        predicted = add_predictions(df, stored=stored_scores)
+        predicted['week'] = predicted['week'].astype(str)
+        jobs = []
+        for report_type, fname, index in stale:
+            group = predicted.loc[index]
+            if report_type == 'monthly':
+                group.insert(len(group.columns) - 1, 'month', group['week'].str[:7])
+            jobs.append((os.path.join(REPORTS_DIR, fname), group))
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                results = list(pool.map(write_report, *zip(*jobs), chunksize=max(1, len(jobs) // (4 * workers))))
+        else:
+            results = [write_report(path, group) for path, group in jobs]
+        for fname, summary in results:
+            new_manifest[fname]['summary'] = summary
+            written.append(fname)
+    return new_manifest, written
+
+
+def _update_partition(parts, pending, manifest, fingerprint):
+    # Scored on the spot: a chunked build never loads the whole store
+    return update_reports(read_partition(parts, pending), manifest, fingerprint, stored_scores=False)
+
+
+def generate_and_save_reports(force=False, workers=None, chunked=None):
+    """
+    Bring REPORTS_DIR up to date with the dataset. Only reports whose source
+    rows or models changed since the last build are rewritten; reports that
+    no longer correspond to any period are removed, with their cached PDFs.
+
+    With `chunked` (default: DATA_MODE is 'chunked') the dataset is read
+    one month partition at a time (see partitions.py), and the pool works
+    on whole partitions. Every report covers a week or month, so it falls
+    within a single partition.
+    Returns the list of filenames written.
+    """
+    start = time.perf_counter()
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    previous = load_manifest()
+    manifest = {} if force else previous
+    fingerprint = models_fingerprint()
+    workers = workers or os.cpu_count() or 1
+    if chunked is None:
+        chunked = DATA_MODE == 'chunked'
+
+    if chunked:
+        jobs = [(parts, pending, manifest, fingerprint) for _, parts, pending in get_dataset().scans()]
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                results = list(pool.map(_update_partition, *zip(*jobs)))
+        else:
+            results = [_update_partition(*job) for job in jobs]
+        new_manifest = {}
+        written = []
+        for entries, files in results:
+            new_manifest.update(entries)
+            written.extend(files)
+    else:
+        new_manifest, written = update_reports(get_csv_data(), manifest, fingerprint, workers)
+
+    for fname in set(previous) - set(new_manifest):
+        try:
+            os.remove(os.path.join(REPORTS_DIR, fname))
+        except FileNotFoundError:
+            pass
+    save_manifest(new_manifest)
+    # Imported here: pdf_reports imports this module
+    from pdf_reports import prune_pdf_cache
+    prune_pdf_cache(new_manifest)
+    REPORT_BUILD_SECONDS.observe(time.perf_counter() - start)
+    REPORTS_WRITTEN.inc(len(written))
+    return written
+
+
+_build_lock = threading.Lock()
+build_status = {'running': False, 'written': None, 'error': None}
+
+
+def start_background_build(force=False, on_complete=None):
+    """
+    Run generate_and_save_reports in a daemon thread; False if one is already
+    running. `on_complete` is called with the written filenames on success.
+    """
+    if not _build_lock.acquire(blocking=False):
+        return False
+    build_status.update(running=True, error=None)
+
+    def run():
+        try:
+            build_status['written'] = generate_and_save_reports(force=force)
+            if on_complete is not None:
+                on_complete(build_status['written'])
+        except Exception as e:
+            build_status['error'] = str(e)
+        finally:
+            build_status['running'] = False
+            _build_lock.release()
+
+    threading.Thread(target=run, name='report-builder', daemon=True).start()
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build weekly and monthly CSV reports.')
+    parser.add_argument('--force', action='store_true', help='rewrite every report, ignoring the manifest')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (default: CPU count)')
+    parser.add_argument('--pdf', action='store_true', help='also render PDFs of the reports written')
+    parser.add_argument('--chunked', action='store_true', default=None,
+                        help='read the dataset one month partition at a time (default: DATA_MODE)')
+    args = parser.parse_args()
+    written = generate_and_save_reports(force=args.force, workers=args.workers, chunked=args.chunked)
+    print(f'{len(written)} report(s) written to {REPORTS_DIR}')
+    if args.pdf:
+        from pdf_reports import render_reports
+        print(f'{render_reports(written)} PDF(s) rendered')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+The report catalog: queries over the manifest report_builder.py writes.
+
+Each manifest entry records a report's type, period, counties, row count,
+summary (the `# key: value` lines at the top of the file) and content hash.
+The manifest is parsed into an index sorted by filename once per change of
+the file on disk, so /reports/list never lists the reports directory or
+opens a report.
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+from report_builder import MANIFEST_PATH
+
+REPORT_TYPES = ('weekly', 'monthly')
+
+_EMPTY = {'key': None, 'version': 0, 'digest': None, 'names': [], 'index': []}
+_catalog = _EMPTY
+_catalog_lock = threading.Lock()
+
+
+def _period_bounds(report_type, period):
+    """First and last day (YYYY-MM-DD) covered by a report period."""
+    if report_type == 'monthly':
+        return f'{period}-01', f'{period}-31'
+    # Weekly periods are the dataset's week strings, 'YYYY-MM-DD/YYYY-MM-DD'
+    first, _, last = period.partition('/')
+    return first, last or first
+
+
+def _parse_bound(value, last):
+    """A YYYY-MM or YYYY-MM-DD query bound as YYYY-MM-DD; ValueError otherwise."""
+    for fmt in ('%Y-%m-%d', '%Y-%m'):
+        try:
+            datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == '%Y-%m':
+            return f'{value}-31' if last else f'{value}-01'
+        return value
+    raise ValueError(f'{value!r} is not YYYY-MM or YYYY-MM-DD')
+
+
+def _build(key, raw):
+    data = json.loads(raw)
+    # Manifests written before versioning hold the report entries only
+    version, reports = (data.get('version', 0), data['reports']) if 'reports' in data else (0, data)
+    index = []
+    for name in sorted(reports):
+        entry = reports[name]
+        first, last = _period_bounds(entry['type'], entry['period'])
+        counties = entry.get('counties', [])
+        record = {
+            'filename': name,
+            'type': entry['type'],
+            'period': entry['period'],
+            'counties': counties,
+            'rows': entry.get('rows'),
+            'summary': entry.get('summary'),
+            'hash': entry['hash'],
+        }
+        index.append((entry['type'], first, last, frozenset(c.lower() for c in counties), record))
+    return {
+        'key': key,
+        'version': version,
+        'digest': hashlib.sha256(raw).hexdigest()[:16],
+        'names': [record['filename'] for *_, record in index],
+        'index': index,
+    }
+
+
+def load_catalog():
+    """
+    The parsed manifest. The file is only re-read when its stat changes, so
+    the report build may run in another process.
+    """
+    global _catalog
+    try:
+        st = os.stat(MANIFEST_PATH)
+    except OSError:
+        return _EMPTY
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    if _catalog['key'] != key:
+        with _catalog_lock:
+            if _catalog['key'] != key:
+                try:
+                    with open(MANIFEST_PATH, 'rb') as f:
+                        _catalog = _build(key, f.read())
+                except (OSError, ValueError, KeyError):
+                    return _EMPTY
+    return _catalog
+
+
+def manifest_version():
+    """
+    (version, digest) of the manifest on disk. The version only grows; the
+    digest tells apart manifests that restarted from 0 (e.g. after the
+    reports directory was removed).
+    """
+    catalog = load_catalog()
+    return catalog['version'], catalog['digest']
+
+
+def query_reports(types=None, period_from=None, period_to=None, counties=None, cursor=None, limit=None):
+    """
+    Catalog records matching every filter given, in filename order, and the
+    cursor of the next page (None on the last page).
+
+    `types` and `counties` are lists (counties match case-insensitively and a
+    report matches if it covers any of them); `period_from`/`period_to` are
+    YYYY-MM or YYYY-MM-DD and keep reports whose period overlaps the range;
+    `cursor` is the last filename of the previous page. Raises ValueError on
+    an unknown type or a malformed date.
+    """
+    if types:
+        unknown = [t for t in types if t not in REPORT_TYPES]
+        if unknown:
+            raise ValueError(f'unknown report type(s): {", ".join(unknown)}')
+    low = _parse_bound(period_from, last=False) if period_from else None
+    high = _parse_bound(period_to, last=True) if period_to else None
+    wanted = {c.strip().lower() for c in counties} if counties else None
+
+    catalog = load_catalog()
+    start = bisect.bisect_right(catalog['names'], cursor) if cursor else 0
+    selected = []
+    for report_type, first, last, report_counties, record in catalog['index'][start:]:
+        if types and report_type not in types:
+            continue
+        if (low and last < low) or (high and first > high):
+            continue
+        if wanted and wanted.isdisjoint(report_counties):
+            continue
+        if limit is not None and len(selected) == limit:
+            return selected, selected[-1]['filename']
+        selected.append(record)
+    return selected, None
@@ -0,0 +1,82 @@
+"""
+Lookup tables for interactive what-if queries.
+
+Both models are tree ensembles over two inputs, so their probability is
+constant between consecutive split thresholds. model_export tabulates each
+one on its threshold grid (TableKernel); here that table is copied into
+plain Python lists and a query is answered with one bisect per axis and a
+list read, in plain Python (no NumPy call per query). The answer is exact,
+so every grid reports a max_error of 0. Queries with NaN or out-of-range
+inputs, and models without a table kernel, are scored through the model
+registry instead.
+"""
+import bisect
+import math
+import struct
+import threading
+
+import numpy as np
+
+from model_export import TableKernel
+from model_utils import model_registry
+
+_FLOAT32 = struct.Struct('f')
+
+
+class RiskGrid:
+    """A two-input TableKernel as Python lists."""
+
+    max_error = 0.0
+
+    def __init__(self, kernel):
+        self.x_cuts, self.y_cuts = [c.tolist() for c in kernel.cuts]
+        self.ny = len(self.y_cuts) + 1
+        self.values = kernel.table.tolist()
+        # Same bins as the kernel's np.searchsorted(cuts, x, side=kernel.side)
+        self.bin = bisect.bisect_right if kernel.side == 'right' else bisect.bisect_left
+        # Inputs are compared in the kernel's dtype, so round them the same way
+        self.float32 = kernel.input_dtype == np.float32
+
+    def lookup(self, x, y):
+        """Probability at one point; OverflowError if it doesn't fit the input dtype."""
+        if self.float32:
+            x = _FLOAT32.unpack(_FLOAT32.pack(x))[0]
+            y = _FLOAT32.unpack(_FLOAT32.pack(y))[0]
+        return self.values[self.bin(self.x_cuts, x) * self.ny + self.bin(self.y_cuts, y)]
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+
+def get_risk_grid(name):
+    """
+    Grid for the currently loaded version of model `name`, or None if the
+    model has no two-input table kernel.
+    """
+    version = model_registry.version(name)
+    cached = _grids.get(name)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with _grids_lock:
+        cached = _grids.get(name)
+        if cached is None or cached[0] != version:
+            kernel = model_registry.entry(name).kernel
+            grid = RiskGrid(kernel) if isinstance(kernel, TableKernel) and len(kernel.cuts) == 2 else None
+            cached = _grids[name] = (version, grid)
+    return cached[1]
+
+
+def score_what_if(name, x, y):
+    """
+    P(outbreak) at one point, from the lookup table when there is one.
+    Returns (probability, mode, max_error); max_error is None for scores
+    from the model registry.
+    """
+    grid = get_risk_grid(name)
+    if grid is not None and not (math.isnan(x) or math.isnan(y)):
+        try:
+            return grid.lookup(x, y), 'grid', grid.max_error
+        except OverflowError:
+            pass
+    return float(model_registry.score(name, np.array([[x, y]]))[0]), 'exact', None
@@ -0,0 +1,139 @@
+"""
+Stored P(outbreak) for every row of the data store.
+
+Each row is scored by the model of its disease (NaN for diseases without a
+model), in one vectorized model call per disease. The scores are kept in
+step with the store and the models: after an ingest only the appended rows
+are scored, and after a model reload only the rows of the diseases whose
+model changed. The map rollups, /data/outbreak and the reports read these
+scores instead of calling the models themselves.
+
+Scores of a store mapped from a snapshot are saved in the snapshot
+directory, one file per set of model versions, so other workers and later
+restarts map them instead of scoring again.
+"""
+import glob
+import logging
+import os
+import threading
+
+import numpy as np
+
+from data_store import get_data_store
+from model_utils import MODEL_FEATURES, model_registry
+
+logger = logging.getLogger(__name__)
+
+SCORE_COLUMN = 'p_outbreak'
+
+
+def model_versions():
+    """Model version of every disease, e.g. {'cholera': '84a81efa...', ...}."""
+    return {name: model_registry.version(name) for name in MODEL_FEATURES}
+
+
+def _scores_path(store, models):
+    return os.path.join(store.path, 'scores.{}.npy'.format('-'.join(models[name] for name in MODEL_FEATURES)))
+
+
+def score_rows(store, rows, diseases=MODEL_FEATURES):
+    """P(outbreak) of the store rows `rows` (float32), scoring only those of `diseases`."""
+    scores = np.full(len(rows), np.nan, dtype=np.float32)
+    names = np.char.lower(np.asarray(store.categories['disease'], dtype=str))
+    codes = store.columns['disease'][rows]
+    for name in diseases:
+        mask = np.isin(codes, np.flatnonzero(names == name))
+        if mask.any():
+            X = np.column_stack([store.columns[f][rows[mask]] for f in MODEL_FEATURES[name]]).astype(np.float64)
+            scores[mask] = model_registry.score(name, X)
+    return scores
+
+
+class RiskScores:
+    """
+    Scores aligned with the rows of the data store. Stores only grow by
+    appending, so the scores of an older store are a prefix of ours.
+    """
+
+    def __init__(self):
+        self.values = np.zeros(0, dtype=np.float32)
+        self.models = None
+        self._lock = threading.Lock()
+
+    @property
+    def n_rows(self):
+        return len(self.values)
+
+    def scores(self, store):
+        """P(outbreak) of every row of `store`, indexed by row id."""
+        with self._lock:
+            self._update(store)
+            return self.values[:store.n_rows]
+
+    def _update(self, store):
+        models = model_versions()
+        if self.n_rows == 0 and store.path is not None and self._load(store, models):
+            return
+        changed = [name for name in MODEL_FEATURES if self.models is None or self.models[name] != models[name]]
+        if changed and store.n_rows < self.n_rows:
+            # Rows past this store are scored again when a later store reaches them
+            self.values = self.values[:store.n_rows]
+        scored = self.n_rows
+        if changed and scored:
+            values = np.array(self.values)
+            for name in changed:
+                rows = store.rows(disease=name)
+                rows = rows[rows < scored]
+                values[rows] = score_rows(store, rows, diseases=[name])
+            self.values = values
+        if store.n_rows > scored:
+            added = score_rows(store, np.arange(scored, store.n_rows, dtype=np.int64))
+            self.values = np.concatenate([self.values, added])
+        if self.models != models or store.n_rows > scored:
+            self.models = models
+            if store.path is not None and self.n_rows == store.n_rows:
+                self._save(store, models)
+
+    def _load(self, store, models):
+        try:
+            values = np.load(_scores_path(store, models), mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if len(values) != store.n_rows:
+            return False
+        self.values = np.asarray(values)
+        self.models = models
+        return True
+
+    def _save(self, store, models):
+        """Write the scores next to the snapshot, replacing those of other model versions."""
+        path = _scores_path(store, models)
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, self.values)
+            os.replace(tmp_path, path)
+            for old in glob.glob(os.path.join(store.path, 'scores.*.npy')):
+                if old != path:
+                    os.remove(old)
+        except OSError as e:
+            logger.warning('Scores not saved to %s: %s', store.path, e)
+
+
+_risk_scores = None
+_risk_scores_lock = threading.Lock()
+
+
+def get_risk_scores():
+    global _risk_scores
+    if _risk_scores is None:
+        with _risk_scores_lock:
+            if _risk_scores is None:
+                _risk_scores = RiskScores()
+    return _risk_scores
+
+
+def current_scores():
+    """(store, scores) for the current data store."""
+    store = get_data_store()
+    return store, get_risk_scores().scores(store)
@@ -0,0 +1,225 @@
+"""
+Response serializers that encode data store columns without building Python
+records first.
+
+JSON goes through orjson when it is installed; numeric columns are then
+encoded as whole NumPy arrays, and each category string is encoded once per
+store. Rows of a selection are encoded as:
+
+  - records: `[{"report_id": 1, ...}, ...]`, the CSV schema row by row
+  - columnar: `{"columns": [...], "data": {"report_id": [...], ...}}`
+  - ndjson: one record per line
+  - arrow: an Arrow IPC stream, categorical columns as dictionary arrays
+    (needs pyarrow)
+
+Columns that are not in the store (e.g. the stored risk scores) can be
+passed in `extra`, as arrays indexed by row id. Floats are written as the
+shortest text that reads back to the stored float32, and NaN as null.
+FastJSONProvider puts the same encoder behind Flask's jsonify.
+"""
+import functools
+import importlib.util
+import json
+import weakref
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+from data_store import CATEGORICAL_COLUMNS, COLUMNS
+
+try:
+    import orjson
+except ImportError:  # Fall back to the standard library encoder
+    orjson = None
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+# ?format= values of the row endpoints
+FORMATS = {'json': JSON, 'ndjson': NDJSON, 'arrow': ARROW_STREAM}
+SHAPES = ['records', 'columnar']
+# Rows encoded per chunk of a streamed response
+STREAM_CHUNK_ROWS = 10000
+
+if orjson is not None:
+    _NUMPY_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+    _PROVIDER_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+# store -> {column: encoded category strings}
+_category_cache = weakref.WeakKeyDictionary()
+
+
+def dumps(obj):
+    """`obj` as compact JSON bytes; NumPy arrays and scalars are allowed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=_NUMPY_OPTIONS)
+    return json.dumps(obj, separators=(',', ':'), default=_to_python).encode()
+
+
+def _to_python(value):
+    if isinstance(value, np.ndarray):
+        return _array_to_list(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _array_to_list(values):
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        values = values.astype(object)
+        values[np.isnan(values.astype(np.float64))] = None
+    return values.tolist()
+
+
+@functools.lru_cache(maxsize=None)
+def arrow_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def available_mimetypes():
+    """Response types the row endpoints can produce here, preferred first."""
+    return [JSON, NDJSON] + ([ARROW_STREAM] if arrow_available() else [])
+
+
+def negotiate(accept, fmt=None):
+    """
+    Response type for a row endpoint from ?format= (`fmt`) or else the Accept
+    header, JSON by default. None if only Arrow is acceptable and pyarrow is
+    not installed. Raises ValueError for an unknown format.
+    """
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f'format must be one of {", ".join(FORMATS)}')
+        mimetype = FORMATS[fmt]
+    else:
+        mimetype = accept.best_match(available_mimetypes())
+        if mimetype is None:
+            mimetype = ARROW_STREAM if accept and accept.quality(ARROW_STREAM) else JSON
+    if mimetype == ARROW_STREAM and not arrow_available():
+        return None
+    return mimetype
+
+
+def _categories(store, name):
+    encoded = _category_cache.setdefault(store, {})
+    if name not in encoded:
+        # Code -1 (no category) indexes the trailing null
+        encoded[name] = np.array([dumps(value) for value in store.categories[name]] + [b'null'], dtype=object)
+    return encoded[name]
+
+
+def _values(store, name, rows, extra=None):
+    values = extra[name] if extra and name in extra else store.columns[name]
+    return values if rows is None else values[rows]
+
+
+def column_tokens(store, name, rows=None, extra=None):
+    """The JSON text of every value of column `name` at `rows`, as a list of bytes."""
+    values = _values(store, name, rows, extra)
+    if len(values) == 0:
+        return []
+    if name in CATEGORICAL_COLUMNS:
+        return _categories(store, name)[values].tolist()
+    return dumps(np.ascontiguousarray(values))[1:-1].split(b',')
+
+
+def column_json(store, name, rows=None, extra=None):
+    """Column `name` at `rows` as one JSON array (bytes)."""
+    if name in CATEGORICAL_COLUMNS:
+        return b'[' + b','.join(column_tokens(store, name, rows)) + b']'
+    return dumps(np.ascontiguousarray(_values(store, name, rows, extra)))
+
+
+def _record_format(columns):
+    return b'{' + b','.join(dumps(name) + b':%b' for name in columns) + b'}'
+
+
+def _chunks(rows, n_rows):
+    for start in range(0, n_rows, STREAM_CHUNK_ROWS):
+        stop = min(start + STREAM_CHUNK_ROWS, n_rows)
+        yield rows[start:stop] if rows is not None else np.arange(start, stop)
+
+
+def encode_records(store, rows=None, columns=COLUMNS, extra=None):
+    """Yield a JSON array of row objects in chunks."""
+    record = _record_format(columns)
+    n_rows = store.n_rows if rows is None else len(rows)
+    yield b'['
+    for i, chunk in enumerate(_chunks(rows, n_rows)):
+        tokens = [column_tokens(store, name, chunk, extra) for name in columns]
+        yield (b',' if i else b'') + b','.join([record % values for values in zip(*tokens)])
+    yield b']'
+
+
+def encode_ndjson(store, rows=None, columns=COLUMNS, extra=None):
+    """Yield newline-delimited JSON row objects in chunks."""
+    record = _record_format(columns)
+    n_rows = store.n_rows if rows is None else len(rows)
+    for chunk in _chunks(rows, n_rows):
+        tokens = [column_tokens(store, name, chunk, extra) for name in columns]
+        yield b''.join([record % values + b'\n' for values in zip(*tokens)])
+
+
+def encode_columnar(store, rows=None, columns=COLUMNS, extra=None):
+    """Yield `{"columns": [...], "data": {column: [...]}}`, one column at a time."""
+    yield b'{"columns":' + dumps(list(columns)) + b',"data":{'
+    for i, name in enumerate(columns):
+        yield (b',' if i else b'') + dumps(name) + b':' + column_json(store, name, rows, extra)
+    yield b'}}'
+
+
+def encode_arrow(store, rows=None, columns=COLUMNS, extra=None):
+    """The rows as an Arrow IPC stream (bytes). Requires pyarrow."""
+    import pyarrow as pa
+
+    arrays = []
+    for name in columns:
+        values = _values(store, name, rows, extra)
+        if name in CATEGORICAL_COLUMNS:
+            arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(values, type=pa.int32()), pa.array(store.categories[name], type=pa.string())))
+        else:
+            arrays.append(pa.array(values))
+    batch = pa.RecordBatch.from_arrays(arrays, names=list(columns))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_rows(store, rows, mimetype=JSON, shape='records', columns=COLUMNS, extra=None):
+    """
+    Body of `rows` in the given response type and (for JSON) shape: an
+    iterable of bytes chunks.
+    """
+    if mimetype == ARROW_STREAM:
+        return [encode_arrow(store, rows, columns, extra)]
+    if mimetype == NDJSON:
+        return encode_ndjson(store, rows, columns, extra)
+    if shape == 'columnar':
+        return encode_columnar(store, rows, columns, extra)
+    return encode_records(store, rows, columns, extra)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider, encoding with orjson (NumPy values allowed) when
+    it is installed. Keys stay sorted as with the default provider, and
+    types orjson does not know are handed to the default provider's hook.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs.get('cls') is not None:
+            return super().dumps(obj, **kwargs)
+        return self._dumps_bytes(obj, kwargs.get('indent')).decode()
+
+    def _dumps_bytes(self, obj, indent=None):
+        option = _PROVIDER_OPTIONS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
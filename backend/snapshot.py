@@ -0,0 +1,146 @@
+"""
+Binary snapshot of the data store: one .npy file per column and per row
+index, plus meta.json with the categories, in a directory named after a
+fingerprint of the source files.
+
+Workers open the arrays with np.load(mmap_mode='r'), so loading is
+independent of history length and every process on the host shares the same
+pages through the OS page cache instead of holding a private parsed copy.
+A snapshot is keyed by a fingerprint of the source files (CSVs and ingest
+log segments: path, size, mtime); when they change a new one is built from
+get_csv_data() on the next load and older snapshots are removed.
+
+Usage (from the backend directory) to build the snapshot ahead of time:
+    python snapshot.py [--force]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from data_store import DataStore, INDEXED_COLUMNS, index_from_bounds, index_to_bounds
+from metrics import DATA_LOAD_SECONDS
+from model_utils import SNAPSHOT_DIR, data_source_files, get_csv_data
+
+# Bump when the on-disk layout changes so old snapshots are rebuilt
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+_build_lock = threading.Lock()
+
+
+def source_fingerprint(paths=None):
+    """Hash of the format version and the (path, size, mtime) of every source file."""
+    h = hashlib.sha256(f'format:{FORMAT_VERSION}'.encode())
+    for path in data_source_files() if paths is None else paths:
+        st = os.stat(path)
+        h.update(f'\n{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'.encode())
+    return h.hexdigest()[:16]
+
+
+def write_snapshot(store, path):
+    """
+    Write `store` to the directory `path`. Files go to a temporary sibling
+    that is renamed into place, so readers never see a partial snapshot.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+    try:
+        for name, values in store.columns.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), values)
+        for name in INDEXED_COLUMNS:
+            order, bounds = index_to_bounds(store.indexes[name])
+            np.save(os.path.join(tmp, f'index.{name}.order.npy'), order)
+            np.save(os.path.join(tmp, f'index.{name}.bounds.npy'), bounds)
+        meta = {
+            'format': FORMAT_VERSION,
+            'n_rows': store.n_rows,
+            'columns': sorted(store.columns),
+            'categories': store.categories,
+            'fingerprint': store.fingerprint,
+        }
+        with open(os.path.join(tmp, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another process finished the same snapshot first
+            if not os.path.exists(os.path.join(path, META_FILE)):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return path
+
+
+def read_snapshot(path, mmap_mode='r'):
+    """DataStore over the arrays in `path`, memory-mapped unless mmap_mode is None."""
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_VERSION:
+        raise ValueError(f'Unsupported snapshot format {meta.get("format")!r} in {path}')
+
+    def load(filename):
+        # Plain ndarray views keep the mapping alive without memmap semantics
+        return np.asarray(np.load(os.path.join(path, filename), mmap_mode=mmap_mode))
+
+    columns = {name: load(f'{name}.npy') for name in meta['columns']}
+    indexes = {
+        name: index_from_bounds(load(f'index.{name}.order.npy'), load(f'index.{name}.bounds.npy'))
+        for name in INDEXED_COLUMNS
+    }
+    return DataStore(columns, meta['categories'], indexes, fingerprint=meta.get('fingerprint'), path=path)
+
+
+def prune_snapshots(root, keep):
+    for name in os.listdir(root):
+        if name != keep and not name.startswith('.tmp-'):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def build_snapshot(root=SNAPSHOT_DIR, force=False):
+    """Make sure a snapshot of the current sources exists under `root`; returns its path."""
+    fingerprint = source_fingerprint()
+    path = os.path.join(root, fingerprint)
+    with _build_lock:
+        if force and os.path.isdir(path):
+            shutil.rmtree(path)
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            write_snapshot(DataStore.from_frame(get_csv_data()), path)
+            prune_snapshots(root, keep=fingerprint)
+    return path
+
+
+def load_snapshot(root=SNAPSHOT_DIR):
+    """
+    Memory-mapped DataStore of the current sources, building the snapshot
+    first if the sources changed. Falls back to parsing the CSVs when the
+    snapshot directory cannot be written.
+    """
+    start = time.perf_counter()
+    try:
+        path = build_snapshot(root)
+    except OSError:
+        return DataStore.from_frame(get_csv_data())
+    store = read_snapshot(path)
+    DATA_LOAD_SECONDS.observe(time.perf_counter() - start, source='snapshot')
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the memory-mappable data snapshot.')
+    parser.add_argument('--force', action='store_true', help='rebuild even if the sources are unchanged')
+    args = parser.parse_args()
+    path = build_snapshot(force=args.force)
+    store = read_snapshot(path)
+    print(f'{store.n_rows} rows in {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Map rollups per county and sub-county over any range of weeks.
+
+Weekly totals of cases, outbreaks and model risk per (area, disease) are
+turned into prefix sums along the week axis. The totals for any contiguous
+week range (months map to one) are then one subtraction per series, and a
+whole map payload costs O(areas) regardless of the range length.
+
+Risk is the mean P(outbreak) of the area's rows, from the stored scores
+(see risk_scores.py). Map colours come from the quantile of an area's mean risk
+among the areas on the map, not from the order of the areas.
+"""
+import threading
+
+import numpy as np
+
+from data_store import get_data_store
+from model_utils import MODEL_FEATURES, model_registry
+from risk_scores import get_risk_scores
+from weekly_series import WeeklySeries, column_measure
+
+LEVELS = {
+    'county': ('county', 'disease'),
+    'sub_county': ('county', 'sub_county', 'disease'),
+}
+MEASURES = ['cases', 'outbreak', 'risk']
+# Lowest to highest risk quintile
+RISK_COLORS = ['#94a3b8', '#eab308', '#f59e0b', '#f97316', '#ef4444']
+NO_RISK_COLOR = '#94a3b8'
+
+
+def risk_measure(store, rows):
+    """Stored P(outbreak) of each row; NaN for diseases without a model."""
+    return get_risk_scores().scores(store)[rows].astype(np.float64)
+
+
+def risk_quantiles(risk, n_bins=len(RISK_COLORS)):
+    """Quantile bin (0 = lowest) of each value among the non-NaN ones; -1 for NaN."""
+    bins = np.full(len(risk), -1)
+    present = np.flatnonzero(~np.isnan(risk))
+    if len(present):
+        values = risk[present]
+        ordered = np.sort(values)
+        # Mean rank, so tied areas share a bin
+        rank = (np.searchsorted(ordered, values, side='left') + np.searchsorted(ordered, values, side='right') - 1) / 2
+        bins[present] = np.minimum((rank * n_bins / len(values)).astype(int), n_bins - 1)
+    return bins
+
+
+class SpatialRollups:
+    """Prefix sums per level, kept in step with the data store and the models."""
+
+    def __init__(self):
+        measures = {'cases': column_measure('cases'), 'outbreak': column_measure('outbreak'), 'risk': risk_measure}
+        self.levels = {level: WeeklySeries(keys, measures) for level, keys in LEVELS.items()}
+        self.prefix = {level: {} for level in LEVELS}
+        self.models = None
+        self._lock = threading.Lock()
+
+    @property
+    def store_version(self):
+        return self.levels['county'].store_version
+
+    def update(self, store):
+        with self._lock:
+            models = tuple(model_registry.version(name) for name in MODEL_FEATURES)
+            for level, data in self.levels.items():
+                if models != self.models:
+                    # Every stored risk came from the old models
+                    data.clear()
+                change = data.sync(store)
+                if change is not None:
+                    self._extend_prefix(level, change[0] if change[1] is None else 0)
+            self.models = models
+
+    def _extend_prefix(self, level, first):
+        """Recompute the prefix sums of `level` from week column `first` on."""
+        data = self.levels[level]
+        prefix = self.prefix[level]
+        for name in MEASURES:
+            for kind, matrix in (('total', data.totals[name]), ('count', data.counts[name])):
+                key = (name, kind)
+                old = prefix.get(key)
+                if old is None or old.shape != (len(data.series), len(data.weeks) + 1):
+                    old = np.zeros((len(data.series), len(data.weeks) + 1))
+                    first = 0
+                old[:, first + 1:] = old[:, first:first + 1] + np.cumsum(matrix[:, first:], axis=1)
+                prefix[key] = old
+
+    def week_range(self, level='county', week_from=None, week_to=None, month_from=None, month_to=None):
+        """Column range [start, stop) of the weeks overlapping the dates and months given."""
+        data = self.levels[level]
+        mask = data.weeks_between(week_from, week_to)
+        month = data.week_start.astype('datetime64[M]')
+        if month_from:
+            mask &= month >= np.datetime64(month_from, 'M')
+        if month_to:
+            mask &= month <= np.datetime64(month_to, 'M')
+        columns = np.flatnonzero(mask)
+        if len(columns) == 0:
+            return 0, 0
+        # Weeks are sorted and disjoint, so the overlap is contiguous
+        return int(columns[0]), int(columns[-1]) + 1
+
+    def map(self, level='county', diseases=None, **period):
+        """
+        One entry per area of `level` with cases, outbreaks, reports, mean
+        risk and its colour, for the weeks selected by week_range(**period).
+        """
+        with self._lock:
+            data = self.levels[level]
+            prefix = self.prefix[level]
+            start, stop = self.week_range(level, **period)
+            weeks = data.weeks[start:stop]
+            selected = data.select(diseases=diseases)
+
+            def window(name, kind):
+                matrix = prefix[(name, kind)]
+                return (matrix[:, stop] - matrix[:, start])[selected]
+
+            # Areas are the series keys without the disease
+            areas = sorted({key[:-1] for key, keep in zip(data.series, selected) if keep})
+            position = {area: i for i, area in enumerate(areas)}
+            area_of = np.array([position[key[:-1]] for key, keep in zip(data.series, selected) if keep], dtype=np.intp)
+            sums = {
+                (name, kind): np.bincount(area_of, weights=window(name, kind), minlength=len(areas))
+                for name in MEASURES for kind in ('total', 'count')
+            }
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            risk = sums[('risk', 'total')] / sums[('risk', 'count')]
+        quantile = risk_quantiles(risk)
+        result = []
+        for i, area in enumerate(areas):
+            entry = dict(zip(LEVELS[level][:-1], area))
+            entry.update({
+                'cases': float(sums[('cases', 'total')][i]),
+                'outbreaks': int(sums[('outbreak', 'total')][i]),
+                'reports': int(sums[('cases', 'count')][i]),
+                'risk': None if np.isnan(risk[i]) else round(float(risk[i]), 4),
+                'risk_quantile': int(quantile[i]) if quantile[i] >= 0 else None,
+                'color': RISK_COLORS[quantile[i]] if quantile[i] >= 0 else NO_RISK_COLOR,
+            })
+            result.append(entry)
+        return {'level': level, 'weeks': [weeks[0], weeks[-1]] if weeks else [], 'areas': result}
+
+
+_rollups = None
+_rollups_lock = threading.Lock()
+
+
+def get_spatial_rollups():
+    """The shared rollups, caught up with the current data store and models."""
+    global _rollups
+    if _rollups is None:
+        with _rollups_lock:
+            if _rollups is None:
+                _rollups = SpatialRollups()
+    _rollups.update(get_data_store())
+    return _rollups
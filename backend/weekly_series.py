@@ -0,0 +1,169 @@
+import numpy as np
+
+_EMPTY = np.zeros(0, dtype=np.intp)
+
+
+def column_measure(column):
+    """Measure taking a data store column as is."""
+    def measure(store, rows):
+        return store.columns[column][rows].astype(np.float64)
+    return measure
+
+
+class WeeklySeries:
+    """
+    Weekly totals per series as dense (series, weeks) matrices, kept in
+    step with the data store.
+
+    A series is a tuple of the `keys` columns (disease lowercased), e.g.
+    (county, disease). Weeks are the sorted week categories plus a 7-day
+    week for every gap between them (see calendar_weeks), so consecutive
+    columns are consecutive weeks even when no row covers some week. Both
+    axes are keyed by name rather than store code, because an append may
+    renumber the codes. Every measure (a function of the store and row ids
+    returning one value per row, NaN to skip) gets a NaN-skipping sum and a
+    count of the rows that had a value. Not thread-safe; owners lock around
+    it.
+    """
+
+    def __init__(self, keys=('county', 'disease'), measures=None):
+        self.keys = tuple(keys)
+        self.measures = measures or {'cases': column_measure('cases')}
+        self.clear()
+
+    def clear(self):
+        self.series = []
+        self.weeks = []
+        self.totals = {name: np.zeros((0, 0)) for name in self.measures}
+        self.counts = {name: np.zeros((0, 0), dtype=np.int64) for name in self.measures}
+        self.week_start = np.zeros(0, dtype='datetime64[D]')
+        self.week_end = np.zeros(0, dtype='datetime64[D]')
+        self.n_rows = 0
+        self.store_version = None
+
+    @property
+    def shape(self):
+        return (len(self.series), len(self.weeks))
+
+    @property
+    def cases(self):
+        return self.totals['cases']
+
+    @property
+    def reports(self):
+        """Rows with a case count per series and week."""
+        return self.counts['cases']
+
+    def values(self, measure='cases'):
+        """Totals of `measure`, NaN for weeks in which a series has no value."""
+        return np.where(self.counts[measure] > 0, self.totals[measure], np.nan)
+
+    def sync(self, store):
+        """
+        Fold in the rows appended to `store` since the last call.
+
+        Returns None if nothing changed, otherwise (first, moved). `first` is
+        the first column whose totals changed or that was inserted. `moved`
+        is None when the axes were kept; otherwise it holds the (rows, cols)
+        positions of the old cells in the new matrix, for callers that keep
+        matrices of their own aligned with this one (see move()).
+        """
+        if store.version == self.store_version and store.n_rows == self.n_rows:
+            return None
+        if store.n_rows < self.n_rows:
+            # Not an extension of what we have seen: start over
+            self.clear()
+        rows = np.arange(self.n_rows, store.n_rows)
+        self.n_rows = store.n_rows
+        self.store_version = store.version
+        if len(rows) == 0:
+            return None
+
+        parts = []
+        for column in self.keys:
+            names = np.asarray(store.categories[column], dtype=str)[store.columns[column][rows]]
+            parts.append((np.char.lower(names) if column == 'disease' else names).tolist())
+        keys = list(zip(*parts))
+        weeks = np.asarray(store.categories['week'], dtype=object)[store.columns['week'][rows]].tolist()
+
+        moved = None
+        new_series = sorted(set(self.series).union(keys))
+        new_weeks = calendar_weeks(sorted(set(self.weeks).union(weeks)))
+        first = None
+        if new_series != self.series or new_weeks != self.weeks:
+            moved = self._reshape(new_series, new_weeks)
+            inserted = np.setdiff1d(np.arange(len(new_weeks)), moved[1])
+            first = int(inserted.min()) if len(inserted) else None
+
+        series_pos = {key: i for i, key in enumerate(self.series)}
+        week_pos = {week: j for j, week in enumerate(self.weeks)}
+        s = np.fromiter((series_pos[key] for key in keys), dtype=np.intp, count=len(keys))
+        w = np.fromiter((week_pos[week] for week in weeks), dtype=np.intp, count=len(keys))
+        for name, measure in self.measures.items():
+            values = measure(store, rows)
+            present = ~np.isnan(values)
+            np.add.at(self.totals[name], (s[present], w[present]), values[present])
+            np.add.at(self.counts[name], (s[present], w[present]), 1)
+        # Every column whose position moved follows an inserted one
+        first = int(w.min()) if first is None else min(first, int(w.min()))
+        return first, moved
+
+    def _reshape(self, series, weeks):
+        series_pos = {key: i for i, key in enumerate(series)}
+        rows = np.array([series_pos[key] for key in self.series], dtype=np.intp) if self.series else _EMPTY
+        cols = np.searchsorted(weeks, self.weeks).astype(np.intp) if self.weeks else _EMPTY
+        moved = (rows, cols)
+        shape = (len(series), len(weeks))
+        self.totals = {name: move(values, moved, shape, 0.0) for name, values in self.totals.items()}
+        self.counts = {name: move(values, moved, shape, 0) for name, values in self.counts.items()}
+        self.series, self.weeks = series, weeks
+        self.week_start = np.array([w.split('/')[0] for w in weeks], dtype='datetime64[D]')
+        self.week_end = np.array([w.split('/')[-1] for w in weeks], dtype='datetime64[D]')
+        return moved
+
+    def select(self, counties=None, diseases=None):
+        """Boolean mask over series for case-insensitive county/disease name lists."""
+        selected = np.ones(len(self.series), dtype=bool)
+        for column, names in (('county', counties), ('disease', diseases)):
+            if names:
+                position = self.keys.index(column)
+                wanted = {name.lower() for name in names}
+                selected &= np.array([key[position].lower() in wanted for key in self.series], dtype=bool)
+        return selected
+
+    def weeks_between(self, start=None, end=None):
+        """Boolean mask over weeks overlapping the inclusive date range [start, end]."""
+        overlaps = np.ones(len(self.weeks), dtype=bool)
+        if start:
+            overlaps &= self.week_end >= np.datetime64(start, 'D')
+        if end:
+            overlaps &= self.week_start <= np.datetime64(end, 'D')
+        return overlaps
+
+
+def calendar_weeks(weeks):
+    """
+    The sorted 'start/end' week strings `weeks` plus a 7-day week for every
+    whole week missing between two consecutive ones.
+    """
+    if len(weeks) < 2:
+        return list(weeks)
+    starts = np.array([w.split('/')[0] for w in weeks], dtype='datetime64[D]')
+    gaps = np.flatnonzero(np.diff(starts) >= np.timedelta64(14, 'D'))
+    if len(gaps) == 0:
+        return list(weeks)
+    filled = list(weeks)
+    for i in gaps.tolist():
+        start = starts[i] + np.timedelta64(7, 'D')
+        while start + np.timedelta64(7, 'D') <= starts[i + 1]:
+            filled.append(f'{start}/{start + np.timedelta64(6, "D")}')
+            start += np.timedelta64(7, 'D')
+    return sorted(filled)
+
+
+def move(old, moved, shape, fill):
+    """Copy of `old` on the axes of a reshaped WeeklySeries; new cells hold `fill`."""
+    rows, cols = moved
+    new = np.full(shape + old.shape[2:], fill, dtype=old.dtype)
+    new[np.ix_(rows, cols)] = old
+    return new
@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production servers, e.g. (from the backend directory):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is warmed up here, so with preload_app the models and data are
+loaded once in the master and shared copy-on-write by the forked workers.
+Background threads are started per worker by the gunicorn config.
+"""
+from app import create_app
+
+app = create_app(warm=True)